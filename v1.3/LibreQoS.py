@@ -21,7 +21,12 @@ import binpacking
 
 from ispConfig import fqOrCAKE, upstreamBandwidthCapacityDownloadMbps, upstreamBandwidthCapacityUploadMbps, \
 	interfaceA, interfaceB, enableActualShellCommands, useBinPackingToBalanceCPU, \
-	runShellCommandsAsSudo, generatedPNDownloadMbps, generatedPNUploadMbps, queuesAvailableOverride
+	runShellCommandsAsSudo, generatedPNDownloadMbps, generatedPNUploadMbps, queuesAvailableOverride, \
+	useMeasuredTrafficForBinpacking, measuredTrafficHistoryDays
+
+from usageWeights import loadWeights, measuredBinpackingWeights
+from integrationCommon import loadShapedDevicesChanges
+from statsPipeline import statsFilesLock
 
 # Automatically account for TCP overhead of plans. For example a 100Mbps plan needs to be set to 109Mbps for the user to ever see that result on a speed test
 # Does not apply to nodes of any sort, just endpoint devices
@@ -447,6 +452,9 @@ def refreshShapers():
 			generatedPNs.append(genPNname)
 		if useBinPackingToBalanceCPU:
 			print("Using binpacking module to sort circuits by CPU core")
+			if useMeasuredTrafficForBinpacking:
+				dictForCircuitsWithoutParentNodes, measuredCount = measuredBinpackingWeights(subscriberCircuits, dictForCircuitsWithoutParentNodes, loadWeights(historyDays=measuredTrafficHistoryDays))
+				print("Weighting " + str(measuredCount) + " of " + str(len(dictForCircuitsWithoutParentNodes)) + " circuits by measured throughput, the rest by plan rate")
 			bins = binpacking.to_constant_bin_number(dictForCircuitsWithoutParentNodes, numberOfGeneratedPNs)
 			genPNcounter = 0
 			for binItem in bins:
@@ -751,11 +759,13 @@ def refreshShapers():
 		# Save ShapedDevices.csv as ShapedDevices.lastLoaded.csv
 		shutil.copyfile('ShapedDevices.csv', 'ShapedDevices.lastLoaded.csv')
 		
-		# Save for stats
-		with open('statsByCircuit.json', 'w') as f:
-			f.write(json.dumps(subscriberCircuits, indent=4))
-		with open('statsByParentNode.json', 'w') as f:
-			f.write(json.dumps(parentNodes, indent=4))
+		# Save for stats, once the stats collector isn't midway through
+		# rewriting them with the circuits being replaced
+		with statsFilesLock():
+			with open('statsByCircuit.json', 'w') as f:
+				f.write(json.dumps(subscriberCircuits, indent=4))
+			with open('statsByParentNode.json', 'w') as f:
+				f.write(json.dumps(parentNodes, indent=4))
 		
 		
 		# Record time this run completed at
@@ -822,13 +832,6 @@ def refreshShapersUpdateOnly():
 		lastLoadedSubscriberCircuits, lastLoadedDictForCircuitsWithoutParentNodes = loadSubscriberCircuits('ShapedDevices.lastLoaded.csv')		
 		
 		
-		# Load stats files
-		with open('statsByParentNode.json', 'r') as j:
-			parentNodes = json.loads(j.read())
-
-		with open('statsByCircuit.json', 'r') as j:
-			subscriberCircuits = json.loads(j.read())
-		
 		newlyUpdatedSubscriberCircuitsByID = {}
 		for circuit in newlyUpdatedSubscriberCircuits:
 			circuitid = circuit['circuitID']
@@ -975,7 +978,16 @@ def refreshShapersUpdateOnly():
 		circuitsIDsToRemove = []
 		circuitsToUpdateByID = {}
 		circuitsToAddByParentNode = {}
-		for circuitID, circuit in lastLoadedSubscriberCircuitsByID.items():
+		# The importer's change summary names the circuits that were
+		# modified or removed, otherwise every circuit is compared
+		changes = loadShapedDevicesChanges('ShapedDevices.lastLoaded.csv', 'ShapedDevices.csv')
+		if changes != None:
+			print("Using ShapedDevices.changes.json: " + str(len(changes['added'])) + " circuits added, " + str(len(changes['removed'])) + " removed, " + str(len(changes['modified'])) + " modified")
+			circuitIDsToCompare = [circuitID for circuitID in changes['modified'] + changes['removed'] if circuitID in lastLoadedSubscriberCircuitsByID]
+		else:
+			circuitIDsToCompare = list(lastLoadedSubscriberCircuitsByID.keys())
+		for circuitID in circuitIDsToCompare:
+			circuit = lastLoadedSubscriberCircuitsByID[circuitID]
 			# Same circuit, update parameters (bandwidth, devices)
 			bandwidthChanged = False
 			devicesChanged = False
@@ -1119,11 +1131,9 @@ def refreshShapersUpdateOnly():
 		shutil.copyfile('ShapedDevices.csv', 'lastGoodConfig.csv')
 		
 		
-		# Save for stats
-		with open('statsByCircuit.json', 'w') as f:
-			f.write(json.dumps(subscriberCircuits, indent=4))
-		with open('statsByParentNode.json', 'w') as f:
-			f.write(json.dumps(parentNodes, indent=4))
+		# statsByCircuit.json and statsByParentNode.json are left to the
+		# stats collector. A partial reload doesn't change them, and saving
+		# the copies loaded at its start would undo the polls made since.
 		
 		
 		# Report reload time
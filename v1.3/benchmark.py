@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# Micro-benchmarks for the stats and integration code paths. These use
+# synthetic data and never touch tc or InfluxDB, so they can be run
+# anywhere, e.g.
+#   python3 benchmark.py lineprotocol --circuits 100000
+#   python3 benchmark.py prometheus --series 500000
+#   python3 benchmark.py graph --nodes 100000
+# The graph benchmark imports integrationCommon.py, which reads ispConfig.py.
+
+import argparse
+import time
+
+
+def syntheticCircuits(count):
+	# Circuit dictionaries shaped like the entries of statsByCircuit.json
+	circuits = []
+	for i in range(count):
+		circuits.append({
+			'circuitID': str(i),
+			'circuitName': str(i) + ' Main Street, Some Town, ST 12345',
+			'ParentNode': 'AP_' + str(i % 500),
+			'classid': hex(1 + (i % 16)) + ':' + hex(3 + (i // 16)),
+			'maxDownload': 100,
+			'maxUpload': 20,
+			'stats': {'sinceLastQuery': {'bitsDownload': float(1000 + i * 37), 'bitsUpload': float(200 + i * 11)}},
+		})
+	return circuits
+
+
+def benchmarkLineProtocol(circuitCount):
+	# Compares building Bandwidth + Utilization points through
+	# influxdb_client.Point against lineProtocol.LineProtocolSerializer
+	from lineProtocol import LineProtocolSerializer
+	circuits = syntheticCircuits(circuitCount)
+	pointCount = circuitCount * 2
+
+	def pointPath():
+		from influxdb_client import Point
+		lines = []
+		for circuit in circuits:
+			bitsDownload = circuit['stats']['sinceLastQuery']['bitsDownload']
+			bitsUpload = circuit['stats']['sinceLastQuery']['bitsUpload']
+			p = Point('Bandwidth').tag("Circuit", circuit['circuitName']).tag("ParentNode", circuit['ParentNode']).tag("Type", "Circuit").field("Download", bitsDownload).field("Upload", bitsUpload)
+			lines.append(p.to_line_protocol())
+			p = Point('Utilization').tag("Circuit", circuit['circuitName']).tag("ParentNode", circuit['ParentNode']).tag("Type", "Circuit").field("Download", round(bitsDownload / 1000000.0, 1)).field("Upload", round(bitsUpload / 200000.0, 1))
+			lines.append(p.to_line_protocol())
+		return '\n'.join(lines)
+
+	serializer = LineProtocolSerializer()
+	def serializerPath():
+		for circuit in circuits:
+			bitsDownload = circuit['stats']['sinceLastQuery']['bitsDownload']
+			bitsUpload = circuit['stats']['sinceLastQuery']['bitsUpload']
+			tags = serializer.tagSet(circuit['classid'], (("Circuit", circuit['circuitName']), ("ParentNode", circuit['ParentNode']), ("Type", "Circuit")))
+			serializer.add('Bandwidth', tags, (("Download", bitsDownload), ("Upload", bitsUpload)))
+			serializer.add('Utilization', tags, (("Download", round(bitsDownload / 1000000.0, 1)), ("Upload", round(bitsUpload / 200000.0, 1))))
+		body = serializer.getvalue()
+		serializer.reset()
+		return body
+
+	print("Line protocol for " + str(circuitCount) + " circuits (" + str(pointCount) + " points)")
+	import importlib.util
+	if importlib.util.find_spec('influxdb_client') is not None:
+		reportTiming("influxdb_client.Point", pointPath, pointCount)
+	else:
+		print("\tinfluxdb_client is not installed, skipping the Point path")
+	reportTiming("Serializer (cold tag cache)", serializerPath, pointCount)
+	reportTiming("Serializer (warm tag cache)", serializerPath, pointCount)
+
+
+def benchmarkPrometheus(seriesCount, scrapes):
+	# Time to rebuild the exposition after a poll, and scrape latency of
+	# /metrics over HTTP. Each circuit has 8 series (4 metrics x 2 directions).
+	import statistics
+	import urllib.request
+	from prometheusExporter import MetricsExporter, serveMetrics
+	circuits = syntheticCircuits(max(seriesCount // 8, 1))
+	for circuit in circuits:
+		sinceLastQuery = circuit['stats']['sinceLastQuery']
+		circuit['stats']['currentQuery'] = {}
+		for direction in ['Download', 'Upload']:
+			sinceLastQuery['packetDrops' + direction] = 1.0
+			sinceLastQuery['packetsSent' + direction] = 100.0
+			circuit['stats']['currentQuery']['bytesSent' + direction] = sinceLastQuery['bits' + direction] * 1250.0
+			circuit['stats']['currentQuery']['packetsSent' + direction] = 123456.0
+			circuit['stats']['currentQuery']['packetDrops' + direction] = 12.0
+	parentNodes = [{'parentNodeName': 'AP_' + str(i), 'stats': {'sinceLastQuery': {'bitsDownload': 1.0, 'bitsUpload': 1.0, 'packetDropsTotal': 0.0, 'overloadFactorTotal': 0.0}}} for i in range(500)]
+
+	exporter = MetricsExporter()
+	print("Prometheus exposition for " + str(len(circuits)) + " circuits (" + str(len(circuits) * 8) + " circuit series)")
+	reportTiming("Rebuild (cold label cache)", lambda: exporter.updateBandwidth(circuits, parentNodes), len(circuits) * 8)
+	reportTiming("Rebuild (warm label cache)", lambda: exporter.updateBandwidth(circuits, parentNodes), len(circuits) * 8)
+	print("\tBody size".ljust(33) + str(round(len(exporter.body) / 1000000.0, 1)) + " MB")
+
+	server = serveMetrics(exporter, '127.0.0.1', 0)
+	url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/metrics'
+	for label, headers in [("Scrape", {}), ("Scrape (gzip)", {'Accept-Encoding': 'gzip'})]:
+		latencies = []
+		for i in range(scrapes):
+			startTime = time.perf_counter()
+			with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+				response.read()
+			latencies.append(time.perf_counter() - startTime)
+		print("\t" + label.ljust(32) + "p50 " + "{:8.3f}".format(statistics.median(latencies) * 1000.0) + " ms\tmax " + "{:8.3f}".format(max(latencies) * 1000.0) + " ms")
+	server.shutdown()
+
+
+def syntheticUispGraph(nodeCount):
+	# NetworkNodes shaped like a full UISP export: towers, sites below them,
+	# client sites (every 20th a relay with client sites of its own) and one
+	# device per client site, in UISP's order (sites, then devices)
+	from integrationCommon import NetworkNode, NodeType
+	sites = []
+	devices = []
+	siteCount = max(nodeCount // 50, 1)
+	towerCount = max(siteCount // 10, 1)
+	for i in range(towerCount):
+		sites.append(NetworkNode(id='tower-' + str(i), displayName='Tower ' + str(i), type=NodeType.site))
+	for i in range(siteCount):
+		sites.append(NetworkNode(id='site-' + str(i), displayName='Site ' + str(i), parentId='tower-' + str(i % towerCount), type=NodeType.site, download=1000, upload=1000))
+	clientCount = max((nodeCount - len(sites)) // 2, 1)
+	for i in range(clientCount):
+		if (i % 20 == 19):
+			parentId = 'client-' + str(i - 1)
+		else:
+			parentId = 'site-' + str(i % siteCount)
+		sites.append(NetworkNode(id='client-' + str(i), displayName='Client ' + str(i), parentId=parentId, type=NodeType.client, download=100, upload=20, address=str(i) + ' Main Street'))
+		devices.append(NetworkNode(id='device-' + str(i), displayName='CPE ' + str(i), parentId='client-' + str(i), type=NodeType.device,
+			ipv4=['100.' + str(64 + (i >> 16)) + '.' + str((i >> 8) & 255) + '.' + str(i & 255) + '/32'], ipv6=[], mac='00:00:00:00:00:00'))
+	return sites + devices
+
+
+def benchmarkGraph(nodeCount):
+	# Builds a UISP-like NetworkGraph and times the steps of prepareTree,
+	# the lookups integrations make, and writing network.json and
+	# ShapedDevices.csv (in a temporary directory)
+	import os
+	import tempfile
+	from integrationCommon import NetworkGraph
+	nodes = syntheticUispGraph(nodeCount)
+	graph = NetworkGraph()
+	graph.ipv4ToIPv6 = {}
+	print("NetworkGraph with " + str(len(nodes)) + " nodes")
+
+	def addNodes():
+		for node in nodes:
+			graph.addRawNode(node)
+
+	def lookups():
+		for node in nodes:
+			graph.findNodeIndexById(node.id)
+			graph.findNodeIndexByName(node.displayName)
+
+	reportTiming("addRawNode", addNodes, len(nodes))
+	reportTiming("findNodeIndexById / ByName", lookups, len(nodes) * 2)
+	reportTiming("Reparent by id", graph._NetworkGraph__reparentById, len(graph.nodes))
+	reportTiming("Promote clients with children", graph._NetworkGraph__promoteClientsWithChildren, len(graph.nodes))
+	reportTiming("Clients with children to sites", graph._NetworkGraph__clientsWithChildrenToSites, len(graph.nodes))
+	for i in range(1, len(graph.nodes), 25):
+		graph.nodes[i].parentIndex = i # Orphan every 25th node
+	reportTiming("Reconnect unconnected", graph._NetworkGraph__reconnectUnconnected, len(graph.nodes))
+	workingDirectory = os.getcwd()
+	with tempfile.TemporaryDirectory() as directory:
+		os.chdir(directory)
+		try:
+			reportTiming("createNetworkJson", graph.createNetworkJson, len(graph.nodes))
+			reportTiming("createShapedDevices", graph.createShapedDevices, len(graph.nodes))
+		finally:
+			os.chdir(workingDirectory)
+
+
+def reportTiming(label, function, operations):
+	startTime = time.perf_counter()
+	function()
+	elapsed = time.perf_counter() - startTime
+	print("\t" + label.ljust(32) + "{:8.3f}".format(elapsed) + " s\t" + "{:8.3f}".format((elapsed / operations) * 1000000.0) + " us/op")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers(dest='benchmark', required=True)
+	lineProtocolParser = subparsers.add_parser('lineprotocol', help="Point objects vs. the direct line protocol serializer")
+	lineProtocolParser.add_argument('--circuits', type=int, default=100000)
+	prometheusParser = subparsers.add_parser('prometheus', help="Exposition rebuild time and /metrics scrape latency")
+	prometheusParser.add_argument('--series', type=int, default=500000)
+	prometheusParser.add_argument('--scrapes', type=int, default=20)
+	graphParser = subparsers.add_parser('graph', help="NetworkGraph build, lookups and file output for a UISP-like network")
+	graphParser.add_argument('--nodes', type=int, default=100000)
+	args = parser.parse_args()
+
+	if args.benchmark == 'lineprotocol':
+		benchmarkLineProtocol(args.circuits)
+	elif args.benchmark == 'prometheus':
+		benchmarkPrometheus(args.series, args.scrapes)
+	elif args.benchmark == 'graph':
+		benchmarkGraph(args.nodes)
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# Traffic carried by each MQ queue and CPU.
+# LibreQoS.py puts every top level node, and everything under it, in the
+# HTB tree of one MQ queue (HTB major = queue number) and steers its
+# traffic to CPU cpuNum (see queuingStructure.json). Each poll sums the
+# circuits' throughput, packets and drops per queue, and flags a queue
+# when it carries more than cpuQueueImbalanceShare of the traffic in a
+# direction, since its CPU will saturate before the others do. The last
+# poll is saved to cpuLoad.json, e.g.
+#   python3 cpuLoad.py
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+directions = ['Download', 'Upload']
+# Below this much total traffic in a direction, shares are not flagged
+minimumBitsForImbalance = 10000000
+
+
+def queuePlan(queuingStructure):
+	# {queue: {'cpu': int, 'nodes': [top level node names], 'circuits': int,
+	# 'downloadMbps': float, 'uploadMbps': float}}, queue being the HTB major
+	def countCircuits(data):
+		circuits = 0
+		for node in data:
+			circuits += len(data[node].get('circuits', []))
+			if 'children' in data[node]:
+				circuits += countCircuits(data[node]['children'])
+		return circuits
+	plan = {}
+	network = queuingStructure['Network']
+	for node in network:
+		queue = int(network[node]['classMajor'], 16)
+		if queue not in plan:
+			plan[queue] = {'cpu': int(network[node]['cpuNum'], 16), 'nodes': [], 'circuits': 0, 'downloadMbps': 0.0, 'uploadMbps': 0.0}
+		plan[queue]['nodes'].append(node)
+		plan[queue]['circuits'] += countCircuits({node: network[node]})
+		plan[queue]['downloadMbps'] += network[node]['downloadBandwidthMbps']
+		plan[queue]['uploadMbps'] += network[node]['uploadBandwidthMbps']
+	return plan
+
+
+def queueForClassID(classid):
+	return int(classid.split(':')[0], 16)
+
+
+class QueueLoad:
+
+	def __init__(self, imbalanceShare=0.5):
+		self.imbalanceShare = imbalanceShare
+		self.plan = {}
+		self.planModified = None
+		self.queues = []
+
+	def refreshPlan(self, path='queuingStructure.json'):
+		# Rereads the plan only when LibreQoS.py has rewritten it
+		try:
+			modified = os.stat(path).st_mtime
+		except FileNotFoundError:
+			return
+		if modified != self.planModified:
+			with open(path, 'r') as j:
+				self.plan = queuePlan(json.loads(j.read()))
+			self.planModified = modified
+
+	def update(self, subscriberCircuits):
+		# Call after getCircuitBandwidthStats(). Returns the queue list.
+		totals = {queue: self.__emptyEntry(queue) for queue in self.plan}
+		for circuit in subscriberCircuits:
+			queue = queueForClassID(circuit['classid'])
+			entry = totals.get(queue)
+			if entry == None:
+				entry = totals[queue] = self.__emptyEntry(queue)
+			entry['activeCircuits'] += 1
+			sinceLastQuery = circuit['stats']['sinceLastQuery']
+			for direction in directions:
+				entry['bits' + direction] += sinceLastQuery['bits' + direction]
+				entry['packets' + direction] += sinceLastQuery['packetsSent' + direction]
+				entry['drops' + direction] += sinceLastQuery['packetDrops' + direction]
+		queues = [totals[queue] for queue in sorted(totals)]
+		for direction in directions:
+			totalBits = sum(entry['bits' + direction] for entry in queues)
+			for entry in queues:
+				share = (entry['bits' + direction] / totalBits) if totalBits > 0 else 0.0
+				entry['share' + direction] = round(share, 3)
+				if (len(queues) > 1) and (totalBits >= minimumBitsForImbalance) and (share > self.imbalanceShare):
+					entry['imbalanced'].append(direction)
+		self.queues = queues
+		return queues
+
+	def __emptyEntry(self, queue):
+		plan = self.plan.get(queue, {'cpu': queue - 1, 'nodes': [], 'circuits': 0, 'downloadMbps': 0.0, 'uploadMbps': 0.0})
+		entry = {'queue': queue, 'cpu': plan['cpu'], 'nodes': plan['nodes'], 'plannedCircuits': plan['circuits'],
+			'plannedDownloadMbps': plan['downloadMbps'], 'plannedUploadMbps': plan['uploadMbps'], 'activeCircuits': 0, 'imbalanced': []}
+		for direction in directions:
+			entry['bits' + direction] = 0.0
+			entry['packets' + direction] = 0.0
+			entry['drops' + direction] = 0.0
+		return entry
+
+	def cpus(self):
+		# Queue totals summed per CPU, both directions
+		cpus = {}
+		for entry in self.queues:
+			if entry['cpu'] not in cpus:
+				cpus[entry['cpu']] = {'cpu': entry['cpu'], 'queues': [], 'bits': 0.0, 'packets': 0.0, 'drops': 0.0}
+			totals = cpus[entry['cpu']]
+			totals['queues'].append(entry['queue'])
+			for direction in directions:
+				totals['bits'] += entry['bits' + direction]
+				totals['packets'] += entry['packets' + direction]
+				totals['drops'] += entry['drops' + direction]
+		return [cpus[cpu] for cpu in sorted(cpus)]
+
+	def imbalanced(self):
+		return [entry for entry in self.queues if len(entry['imbalanced']) > 0]
+
+	def save(self, path='cpuLoad.json'):
+		with open(path, 'w') as f:
+			f.write(json.dumps({'imbalanceShare': self.imbalanceShare, 'queues': self.queues, 'cpus': self.cpus()}, indent=4))
+
+
+def printLoad(path='cpuLoad.json'):
+	fileLoc = Path(path)
+	if not fileLoc.is_file():
+		print(path + " not found. It is written by the stats collector (scheduler.py) every poll.")
+		return
+	with open(fileLoc, 'r') as j:
+		load = json.loads(j.read())
+	print("Queue".rjust(6) + "CPU".rjust(5) + "Circuits".rjust(10) + "Down Mbps".rjust(12) + "Share".rjust(7) + "Up Mbps".rjust(12) + "Share".rjust(7) + "  Top level nodes")
+	for entry in load['queues']:
+		flag = "  <-- over " + str(load['imbalanceShare']) + " of " + "/".join(entry['imbalanced']) if len(entry['imbalanced']) > 0 else ""
+		print(hex(entry['queue']).rjust(6) + str(entry['cpu']).rjust(5) + str(entry['activeCircuits']).rjust(10)
+			+ str(round(entry['bitsDownload'] / 1000000, 1)).rjust(12) + str(entry['shareDownload']).rjust(7)
+			+ str(round(entry['bitsUpload'] / 1000000, 1)).rjust(12) + str(entry['shareUpload']).rjust(7)
+			+ "  " + ", ".join(entry['nodes']) + flag)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Show the traffic carried by each MQ queue / CPU in the last stats poll")
+	parser.add_argument('--path', default='cpuLoad.json')
+	args = parser.parse_args()
+	printLoad(args.path)
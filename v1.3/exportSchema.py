@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# Tag schemas for the points written to InfluxDB, and a series count
+# estimate for each of them.
+# 'names' tags circuits by circuitName and ParentNode, so every rename or
+# re-parent starts new series. 'ids' tags circuits by circuitID and nodes
+# by node ID (a node's "id" in network.json, or its name when it has none),
+# and publishes names and network.json paths in separate metadata
+# measurements that are only written when they change. Estimate the
+# series count from queuingStructure.json with
+#   python3 exportSchema.py cardinality
+
+import argparse
+import json
+
+schemas = ['names', 'ids']
+
+# Fields written per circuit / parent node / tin. In InfluxDB, every
+# field of every tag set is a separate series.
+circuitFields = {
+	'Bandwidth': 2,
+	'Utilization': 2,
+	'TCP Latency': 1,
+	'TCP Latency Percentiles': 3,
+}
+circuitRollupFields = {
+	'Bandwidth Rollup': 6,
+	'Utilization Rollup': 6,
+}
+nodeFields = {
+	'Bandwidth': 2,
+	'Utilization': 2,
+	'Overload': 1,
+	'TCP Latency': 1,
+	'TCP Latency Percentiles': 3,
+}
+# 4 tins, Download and Upload fields of 'Tin Drop Percentage' and 'Tin Mark Percentage'
+tinSeriesPerRow = 4 * 2 * 2
+globalTinSeries = 4 * 2 * 3
+circuitMetadataFields = 6
+nodeMetadataFields = 4
+
+
+def circuitTagPairs(circuit, schema):
+	if schema == 'ids':
+		return (("CircuitID", circuit['circuitID']), ("Type", "Circuit"))
+	return (("Circuit", circuit['circuitName']), ("ParentNode", circuit['ParentNode']), ("Type", "Circuit"))
+
+
+def nodeTagPairs(nodeName, nodeDetails, schema):
+	if schema == 'ids':
+		return (("NodeID", nodeDetails[nodeName]['id'] if nodeName in nodeDetails else nodeName), ("Type", "Parent Node"))
+	return (("Device", nodeName), ("ParentNode", nodeName), ("Type", "Parent Node"))
+
+
+def getNodeDetails(network, path='', nodeDetails=None):
+	# {nodeName: {'id': ..., 'path': 'Site_1/AP_A'}} for every node of network.json
+	if nodeDetails == None:
+		nodeDetails = {}
+	for node in network:
+		nodePath = path + '/' + node if path != '' else node
+		nodeDetails[node] = {'id': str(network[node].get('id', node)), 'path': nodePath}
+		if 'children' in network[node]:
+			getNodeDetails(network[node]['children'], nodePath, nodeDetails)
+	return nodeDetails
+
+
+class MetadataPublisher:
+	# Decides which circuits and nodes need their metadata point written:
+	# those that are new or changed since the last write, and all of them
+	# once every refreshSeconds so they stay within the bucket's retention.
+
+	def __init__(self, refreshSeconds=86400):
+		self.refreshSeconds = refreshSeconds
+		self.lastWritten = {}
+		self.lastRefresh = None
+
+	def pending(self, subscriberCircuits, parentNodes, nodeDetails, now):
+		# Returns (circuitRows, nodeRows), each a list of (tagPairs, fields)
+		refreshAll = (self.lastRefresh == None) or ((now - self.lastRefresh) >= self.refreshSeconds)
+		if refreshAll:
+			self.lastRefresh = now
+		circuitRows = []
+		for circuit in subscriberCircuits:
+			parent = nodeDetails.get(circuit['ParentNode'], {'id': circuit['ParentNode'], 'path': circuit['ParentNode']})
+			fields = (("Name", circuit['circuitName']), ("ParentNode", circuit['ParentNode']), ("ParentNodeID", parent['id']),
+				("Path", parent['path']), ("maxDownload", float(circuit['maxDownload'])), ("maxUpload", float(circuit['maxUpload'])))
+			if self.__changed(('Circuit', circuit['circuitID']), fields, refreshAll):
+				circuitRows.append((circuitTagPairs(circuit, 'ids'), fields))
+		nodeRows = []
+		for parentNode in parentNodes:
+			name = parentNode['parentNodeName']
+			details = nodeDetails.get(name, {'id': name, 'path': name})
+			fields = (("Name", name), ("Path", details['path']), ("maxDownload", float(parentNode['maxDownload'])), ("maxUpload", float(parentNode['maxUpload'])))
+			if self.__changed(('Parent Node', details['id']), fields, refreshAll):
+				nodeRows.append((nodeTagPairs(name, nodeDetails, 'ids'), fields))
+		return circuitRows, nodeRows
+
+	def __changed(self, key, fields, refreshAll):
+		if refreshAll or (self.lastWritten.get(key) != fields):
+			self.lastWritten[key] = fields
+			return True
+		return False
+
+
+def countQueuingStructure(queuingStructure):
+	# Returns (nodeCount, circuitCount) of queuingStructure.json
+	def walk(data):
+		nodes = 0
+		circuits = 0
+		for node in data:
+			nodes += 1
+			circuits += len(data[node].get('circuits', []))
+			if 'children' in data[node]:
+				childNodes, childCircuits = walk(data[node]['children'])
+				nodes += childNodes
+				circuits += childCircuits
+		return nodes, circuits
+	return walk(queuingStructure['Network'])
+
+
+def estimateSeries(nodeCount, circuitCount, schema, tinStatsGranularity='global', circuitRollupSeconds=0, heavyHitterCount=50, cake=True):
+	# Returns {measurement: series} for one poll's worth of points
+	series = {}
+	def addSeries(measurement, count):
+		series[measurement] = series.get(measurement, 0) + count
+	fullResolutionCircuits = circuitCount if circuitRollupSeconds <= 0 else min(circuitCount, 2 * heavyHitterCount)
+	for measurement, fields in circuitFields.items():
+		addSeries(measurement, (fullResolutionCircuits if measurement in ('Bandwidth', 'Utilization') else circuitCount) * fields)
+	if circuitRollupSeconds > 0:
+		for measurement, fields in circuitRollupFields.items():
+			addSeries(measurement, circuitCount * fields)
+	for measurement, fields in nodeFields.items():
+		addSeries(measurement, nodeCount * fields)
+	if cake:
+		addSeries('Tins', globalTinSeries)
+		if tinStatsGranularity in ('node', 'circuit'):
+			addSeries('Tin Drop/Mark Percentage', nodeCount * tinSeriesPerRow)
+		if tinStatsGranularity == 'circuit':
+			addSeries('Tin Drop/Mark Percentage', circuitCount * tinSeriesPerRow)
+	if schema == 'ids':
+		addSeries('Circuit Metadata', circuitCount * circuitMetadataFields)
+		addSeries('Node Metadata', nodeCount * nodeMetadataFields)
+	return series
+
+
+def cardinalityReport(queuingStructurePath='queuingStructure.json'):
+	from ispConfig import fqOrCAKE, tinStatsGranularity, circuitRollupSeconds, heavyHitterCount, influxDBTagSchema
+	with open(queuingStructurePath, 'r') as j:
+		queuingStructure = json.loads(j.read())
+	nodeCount, circuitCount = countQueuingStructure(queuingStructure)
+	print(str(circuitCount) + " circuits, " + str(nodeCount) + " parent nodes in " + queuingStructurePath)
+	estimates = {schema: estimateSeries(nodeCount, circuitCount, schema, tinStatsGranularity, circuitRollupSeconds, heavyHitterCount, 'cake' in fqOrCAKE) for schema in schemas}
+	measurements = []
+	for schema in schemas:
+		for measurement in estimates[schema]:
+			if measurement not in measurements:
+				measurements.append(measurement)
+	print("Measurement".ljust(32) + ''.join(schema.rjust(12) for schema in schemas))
+	for measurement in measurements:
+		print(measurement.ljust(32) + ''.join(str(estimates[schema].get(measurement, 0)).rjust(12) for schema in schemas))
+	print("Active series".ljust(32) + ''.join(str(sum(estimates[schema].values())).rjust(12) for schema in schemas))
+	print("influxDBTagSchema is '" + influxDBTagSchema + "'. With 'names', each renamed or re-parented circuit adds "
+		+ str(sum(circuitFields.values())) + " series until the old ones expire; with 'ids' it only rewrites its metadata.")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	cardinalityParser = subparsers.add_parser('cardinality', help="Estimate the InfluxDB series count from queuingStructure.json")
+	cardinalityParser.add_argument('--queuingStructure', default='queuingStructure.json')
+	args = parser.parse_args()
+
+	if args.command == 'cardinality':
+		cardinalityReport(args.queuingStructure)
@@ -1,34 +1,116 @@
 import subprocess
 import json
+import os
 import subprocess
+import time
 from datetime import datetime
 from pathlib import Path
-import statistics
 
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import InfluxDBClient
 from influxdb_client.client.write_api import SYNCHRONOUS
 
-from ispConfig import interfaceA, interfaceB, influxDBEnabled, influxDBBucket, influxDBOrg, influxDBtoken, influxDBurl, fqOrCAKE
+from ispConfig import interfaceA, interfaceB, influxDBEnabled, influxDBBucket, influxDBOrg, influxDBtoken, influxDBurl, fqOrCAKE, tinStatsGranularity, heavyHitterCount, timeSeriesEnabled, prometheusEnabled, circuitRollupSeconds, influxDBTagSchema, cpuQueueImbalanceShare, hostTelemetryEnabled, measuredTrafficHistoryDays, usageLedgerEnabled
+from lineProtocol import LineProtocolSerializer
+from tinStats import TinStats, tinNames
+from topK import HeavyHitters
+from latencySketch import LatencySketch, rollUpSketches
+import timeSeriesStore
+from prometheusExporter import MetricsExporter
+from rollup import CircuitRollup
+from exportSchema import circuitTagPairs, nodeTagPairs, getNodeDetails, MetadataPublisher
+from cpuLoad import QueueLoad
+from hostTelemetry import HostTelemetry, correlateQueues
+from usageWeights import UsageTracker
+from latencyReader import tcHandleToClassID, mergeEntries
+from statsPipeline import statsFilesLock
+import usageLedger
+
+# Kept for the life of the process, so escaped tag sets are reused across polls
+serializer = LineProtocolSerializer()
+# Kept for the life of the process, so per-circuit tin deltas survive between polls
+tinStats = TinStats(tinStatsGranularity)
+# Top circuits by throughput, drops, overload and latency, saved to topK.json
+heavyHitters = HeavyHitters(heavyHitterCount)
+# Rendered once per poll, served by scheduler.py (see prometheusExporter.py)
+metricsExporter = MetricsExporter() if prometheusEnabled else None
+# Circuits outside the busiest heavyHitterCount are written as min / mean / max per window
+circuitRollup = CircuitRollup(circuitRollupSeconds) if circuitRollupSeconds > 0 else None
+# With influxDBTagSchema = 'ids', names and paths are written only when they change
+metadataPublisher = MetadataPublisher()
+# Throughput per MQ queue / CPU, saved to cpuLoad.json
+queueLoad = QueueLoad(cpuQueueImbalanceShare)
+# Stores kept in files are opened by openStores() in the process that polls,
+# not at import: stats workers are forked from scheduler.py, and a copy
+# opened before the fork wouldn't know what an earlier exporter wrote.
+# Local history, kept in memory-mapped files (see timeSeriesStore.py)
+timeSeries = None
+# Daily 95th percentile throughput per circuit, for CPU balancing by LibreQoS.py
+usageTracker = None
+# Hourly / daily / monthly bytes per circuit, appended to usageLedger.bin
+circuitUsageLedger = None
+# The process the stores above were opened in
+storesProcess = None
+# Softirq, interrupt and NIC counters, read from files kept open (see hostTelemetry.py)
+hostTelemetry = None
+if hostTelemetryEnabled:
+	try:
+		hostTelemetry = HostTelemetry([interfaceA, interfaceB])
+	except OSError:
+		print("Could not open /proc counters, host telemetry disabled")
+
+
+def openStores():
+	# Opens the file-backed stores the first time this process polls
+	global timeSeries, usageTracker, circuitUsageLedger, storesProcess
+	if storesProcess == os.getpid():
+		return
+	storesProcess = os.getpid()
+	timeSeries = timeSeriesStore.openFromConfig() if timeSeriesEnabled else None
+	usageTracker = UsageTracker(measuredTrafficHistoryDays)
+	circuitUsageLedger = usageLedger.openFromConfig() if usageLedgerEnabled else None
 
 
 def getInterfaceStats(interface):
+	# Returns the qdisc stats of an interface keyed by classid, along with
+	# the monotonic time the counters were read. tc reads the counters while
+	# it runs, so the sample is timestamped at the midpoint of the dump.
 	command = 'tc -j -s qdisc show dev ' + interface
-	jsonAr = json.loads(subprocess.run(command.split(' '), stdout=subprocess.PIPE).stdout.decode('utf-8'))
+	dumpStartTime = time.monotonic()
+	output = subprocess.run(command.split(' '), stdout=subprocess.PIPE).stdout
+	sampleTime = (dumpStartTime + time.monotonic()) / 2.0
+	jsonAr = json.loads(output.decode('utf-8'))
 	jsonDict = {}
 	for element in filter(lambda e: 'parent' in e, jsonAr):
 		flowID = ':'.join(map(lambda p: f'0x{p}', element['parent'].split(':')[0:2]))
 		jsonDict[flowID] = element
 	del jsonAr
-	return jsonDict
+	return jsonDict, sampleTime
+
+
+def monotonicToWallTime(monotonicTime):
+	# Converts a time.monotonic() reading to seconds since the epoch
+	return time.time() - (time.monotonic() - monotonicTime)
 
 
 def chunk_list(l, n):
 	for i in range(0, len(l), n):
 		yield l[i:i + n]
 
-def getCircuitBandwidthStats(subscriberCircuits, tinsStats):
+def getCircuitBandwidthStats(subscriberCircuits, tinsStats, interfaceStatsReader=getInterfaceStats):
+	# Rates are computed against the monotonic time of each interface's tc
+	# dump, so a slow poll doesn't skew them. Returns the wall-clock time of
+	# the download sample (nanoseconds), to be used as the point timestamp.
+	# interfaceStatsReader is called like getInterfaceStats(), and can be
+	# swapped for one reading samples taken elsewhere (see statsPipeline.py).
 	interfaces = [interfaceA, interfaceB]
-	ifaceStats = list(map(getInterfaceStats, interfaces))
+	ifaceStats = []
+	sampleTimes = []
+	for interface in interfaces:
+		stats, sampleTime = interfaceStatsReader(interface)
+		ifaceStats.append(stats)
+		sampleTimes.append(sampleTime)
+	sampleWallTime = monotonicToWallTime(sampleTimes[0])
+	sampleTimeISO = datetime.fromtimestamp(sampleWallTime).isoformat()
 	
 	for circuit in subscriberCircuits:
 		if 'stats' not in circuit:
@@ -43,28 +125,11 @@ def getCircuitBandwidthStats(subscriberCircuits, tinsStats):
 			circuit['stats']['currentQuery'] = {}
 			circuit['stats']['sinceLastQuery'] = {}
 
-	#for entry in tinsStats:
-	if 'currentQuery' in tinsStats:
-		tinsStats['priorQuery'] = tinsStats['currentQuery']
-		tinsStats['currentQuery'] = {}
-		tinsStats['sinceLastQuery'] = {}
-	else:
-		tinsStats['currentQuery'] = {}
-		tinsStats['sinceLastQuery'] = {}
-	
-	tinsStats['currentQuery'] = {	'Bulk': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-									'BestEffort': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-									'Video': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-									'Voice': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-								}
-	tinsStats['sinceLastQuery'] = {	'Bulk': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-									'BestEffort': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-									'Video': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-									'Voice': {'Download': {'sent_packets': 0.0, 'drops': 0.0}, 'Upload': {'sent_packets': 0.0, 'drops': 0.0}},
-								}
+	if 'cake diffserv4' in fqOrCAKE:
+		tinStats.startQuery(subscriberCircuits)
 	
-	for circuit in subscriberCircuits:
-		for (interface, stats, dirSuffix) in zip(interfaces, ifaceStats, ['Download', 'Upload']):
+	for (circuitIndex, circuit) in enumerate(subscriberCircuits):
+		for (direction, (interface, stats, sampleTime, dirSuffix)) in enumerate(zip(interfaces, ifaceStats, sampleTimes, ['Download', 'Upload'])):
 
 			element = stats[circuit['classid']] if circuit['classid'] in stats else False
 
@@ -78,69 +143,49 @@ def getCircuitBandwidthStats(subscriberCircuits, tinsStats):
 					overloadFactor = 0.0
 				
 				if 'cake diffserv4' in fqOrCAKE:
-					tinCounter = 1
-					for tin in element['tins']:
-						sent_packets = float(tin['sent_packets'])
-						ack_drops = float(tin['ack_drops'])
-						ecn_mark = float(tin['ecn_mark'])
-						tinDrops = float(tin['drops'])
-						trueDrops = ecn_mark + tinDrops - ack_drops
-						if tinCounter == 1:
-							tinsStats['currentQuery']['Bulk'][dirSuffix]['sent_packets'] += sent_packets
-							tinsStats['currentQuery']['Bulk'][dirSuffix]['drops'] += trueDrops
-						elif tinCounter == 2:
-							tinsStats['currentQuery']['BestEffort'][dirSuffix]['sent_packets'] += sent_packets
-							tinsStats['currentQuery']['BestEffort'][dirSuffix]['drops'] += trueDrops
-						elif tinCounter == 3:
-							tinsStats['currentQuery']['Video'][dirSuffix]['sent_packets'] += sent_packets
-							tinsStats['currentQuery']['Video'][dirSuffix]['drops'] += trueDrops
-						elif tinCounter == 4:
-							tinsStats['currentQuery']['Voice'][dirSuffix]['sent_packets'] += sent_packets
-							tinsStats['currentQuery']['Voice'][dirSuffix]['drops'] += trueDrops
-						tinCounter += 1
+					tinStats.record(circuitIndex, direction, element['tins'])
 
 				circuit['stats']['currentQuery']['bytesSent' + dirSuffix] = bytesSent
 				circuit['stats']['currentQuery']['packetDrops' + dirSuffix] = drops
 				circuit['stats']['currentQuery']['packetsSent' + dirSuffix] = packets
 				circuit['stats']['currentQuery']['overloadFactor' + dirSuffix] = overloadFactor
+				circuit['stats']['currentQuery']['sampleTime' + dirSuffix] = sampleTime
 				
 				#if 'cake diffserv4' in fqOrCAKE:
 				#	circuit['stats']['currentQuery']['tins'] = theseTins
 
-		circuit['stats']['currentQuery']['time'] = datetime.now().isoformat()
+		circuit['stats']['currentQuery']['time'] = sampleTimeISO
 		
-	allPacketsDownload = 0.0
-	allPacketsUpload = 0.0
 	for circuit in subscriberCircuits:
 		circuit['stats']['sinceLastQuery']['bitsDownload'] = circuit['stats']['sinceLastQuery']['bitsUpload'] = 0.0
 		circuit['stats']['sinceLastQuery']['bytesSentDownload'] = circuit['stats']['sinceLastQuery']['bytesSentUpload'] = 0.0
 		circuit['stats']['sinceLastQuery']['packetDropsDownload'] = circuit['stats']['sinceLastQuery']['packetDropsUpload'] = 0.0
 		circuit['stats']['sinceLastQuery']['packetsSentDownload'] = circuit['stats']['sinceLastQuery']['packetsSentUpload'] = 0.0
 		
-		try:
-			circuit['stats']['sinceLastQuery']['bytesSentDownload'] = circuit['stats']['currentQuery']['bytesSentDownload'] - circuit['stats']['priorQuery']['bytesSentDownload']
-			circuit['stats']['sinceLastQuery']['bytesSentUpload'] = circuit['stats']['currentQuery']['bytesSentUpload'] - circuit['stats']['priorQuery']['bytesSentUpload']
-		except:
-			circuit['stats']['sinceLastQuery']['bytesSentDownload'] = 0.0
-			circuit['stats']['sinceLastQuery']['bytesSentUpload'] = 0.0
-		try:
-			circuit['stats']['sinceLastQuery']['packetDropsDownload'] = circuit['stats']['currentQuery']['packetDropsDownload'] - circuit['stats']['priorQuery']['packetDropsDownload']
-			circuit['stats']['sinceLastQuery']['packetDropsUpload'] = circuit['stats']['currentQuery']['packetDropsUpload'] - circuit['stats']['priorQuery']['packetDropsUpload']
-		except:
-			circuit['stats']['sinceLastQuery']['packetDropsDownload'] = 0.0
-			circuit['stats']['sinceLastQuery']['packetDropsUpload'] = 0.0
-		try:
-			circuit['stats']['sinceLastQuery']['packetsSentDownload'] = circuit['stats']['currentQuery']['packetsSentDownload'] - circuit['stats']['priorQuery']['packetsSentDownload']
-			circuit['stats']['sinceLastQuery']['packetsSentUpload'] = circuit['stats']['currentQuery']['packetsSentUpload'] - circuit['stats']['priorQuery']['packetsSentUpload']
-		except:
-			circuit['stats']['sinceLastQuery']['packetsSentDownload'] = 0.0
-			circuit['stats']['sinceLastQuery']['packetsSentUpload'] = 0.0
-		
-		allPacketsDownload += circuit['stats']['sinceLastQuery']['packetsSentDownload']
-		allPacketsUpload += circuit['stats']['sinceLastQuery']['packetsSentUpload']
+		# Monotonic times survive restarts of the collector, but not a reboot.
+		# A prior query taken later than this one is from before a reboot,
+		# so it is discarded rather than used for deltas.
+		if 'priorQuery' in circuit['stats']:
+			for dirSuffix in ['Download', 'Upload']:
+				priorSampleTime = circuit['stats']['priorQuery'].get('sampleTime' + dirSuffix)
+				currentSampleTime = circuit['stats']['currentQuery'].get('sampleTime' + dirSuffix)
+				if (priorSampleTime != None) and (currentSampleTime != None) and (priorSampleTime > currentSampleTime):
+					del circuit['stats']['priorQuery']
+					break
 		
 		if 'priorQuery' in circuit['stats']:
-			if 'time' in circuit['stats']['priorQuery']:
+			# Each direction only has deltas when both queries saw its qdisc
+			for counterName in ['bytesSent', 'packetDrops', 'packetsSent']:
+				for dirSuffix in ['Download', 'Upload']:
+					if (counterName + dirSuffix in circuit['stats']['priorQuery']) and (counterName + dirSuffix in circuit['stats']['currentQuery']):
+						circuit['stats']['sinceLastQuery'][counterName + dirSuffix] = circuit['stats']['currentQuery'][counterName + dirSuffix] - circuit['stats']['priorQuery'][counterName + dirSuffix]
+			if ('sampleTimeDownload' in circuit['stats']['priorQuery']) or ('sampleTimeUpload' in circuit['stats']['priorQuery']):
+				for dirSuffix in ['Download', 'Upload']:
+					if ('sampleTime' + dirSuffix in circuit['stats']['priorQuery']) and ('sampleTime' + dirSuffix in circuit['stats']['currentQuery']):
+						deltaSeconds = circuit['stats']['currentQuery']['sampleTime' + dirSuffix] - circuit['stats']['priorQuery']['sampleTime' + dirSuffix]
+						circuit['stats']['sinceLastQuery']['bits' + dirSuffix] = round(
+							((circuit['stats']['sinceLastQuery']['bytesSent' + dirSuffix] * 8) / deltaSeconds)) if deltaSeconds > 0 else 0
+			elif 'time' in circuit['stats']['priorQuery']:
 				currentQueryTime = datetime.fromisoformat(circuit['stats']['currentQuery']['time'])
 				priorQueryTime = datetime.fromisoformat(circuit['stats']['priorQuery']['time'])
 				deltaSeconds = (currentQueryTime - priorQueryTime).total_seconds()
@@ -152,92 +197,10 @@ def getCircuitBandwidthStats(subscriberCircuits, tinsStats):
 			circuit['stats']['sinceLastQuery']['bitsDownload'] = (circuit['stats']['sinceLastQuery']['bytesSentDownload'] * 8)
 			circuit['stats']['sinceLastQuery']['bitsUpload'] = (circuit['stats']['sinceLastQuery']['bytesSentUpload'] * 8)
 	
-	tinsStats['sinceLastQuery']['Bulk']['Download']['dropPercentage'] = tinsStats['sinceLastQuery']['Bulk']['Upload']['dropPercentage'] = 0.0
-	tinsStats['sinceLastQuery']['BestEffort']['Download']['dropPercentage'] = tinsStats['sinceLastQuery']['BestEffort']['Upload']['dropPercentage'] = 0.0
-	tinsStats['sinceLastQuery']['Video']['Download']['dropPercentage'] = tinsStats['sinceLastQuery']['Video']['Upload']['dropPercentage'] = 0.0
-	tinsStats['sinceLastQuery']['Voice']['Download']['dropPercentage'] = tinsStats['sinceLastQuery']['Voice']['Upload']['dropPercentage'] = 0.0
-	
-	tinsStats['sinceLastQuery']['Bulk']['Download']['percentage'] = tinsStats['sinceLastQuery']['Bulk']['Upload']['percentage'] = 0.0
-	tinsStats['sinceLastQuery']['BestEffort']['Download']['percentage'] = tinsStats['sinceLastQuery']['BestEffort']['Upload']['percentage'] = 0.0
-	tinsStats['sinceLastQuery']['Video']['Download']['percentage'] = tinsStats['sinceLastQuery']['Video']['Upload']['percentage'] = 0.0
-	tinsStats['sinceLastQuery']['Voice']['Download']['percentage'] = tinsStats['sinceLastQuery']['Voice']['Upload']['percentage'] = 0.0
-	
-	try:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['sent_packets'] = tinsStats['currentQuery']['Bulk']['Download']['sent_packets'] - tinsStats['priorQuery']['Bulk']['Download']['sent_packets']
-		tinsStats['sinceLastQuery']['BestEffort']['Download']['sent_packets'] = tinsStats['currentQuery']['BestEffort']['Download']['sent_packets'] - tinsStats['priorQuery']['BestEffort']['Download']['sent_packets']
-		tinsStats['sinceLastQuery']['Video']['Download']['sent_packets'] = tinsStats['currentQuery']['Video']['Download']['sent_packets'] - tinsStats['priorQuery']['Video']['Download']['sent_packets']
-		tinsStats['sinceLastQuery']['Voice']['Download']['sent_packets'] = tinsStats['currentQuery']['Voice']['Download']['sent_packets'] - tinsStats['priorQuery']['Voice']['Download']['sent_packets']
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['sent_packets'] = tinsStats['currentQuery']['Bulk']['Upload']['sent_packets'] - tinsStats['priorQuery']['Bulk']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['BestEffort']['Upload']['sent_packets'] = tinsStats['currentQuery']['BestEffort']['Upload']['sent_packets'] - tinsStats['priorQuery']['BestEffort']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['Video']['Upload']['sent_packets'] = tinsStats['currentQuery']['Video']['Upload']['sent_packets'] - tinsStats['priorQuery']['Video']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['Voice']['Upload']['sent_packets'] = tinsStats['currentQuery']['Voice']['Upload']['sent_packets'] - tinsStats['priorQuery']['Voice']['Upload']['sent_packets']
-	except:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['sent_packets'] = tinsStats['sinceLastQuery']['BestEffort']['Download']['sent_packets'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Download']['sent_packets'] = tinsStats['sinceLastQuery']['Voice']['Download']['sent_packets'] = 0.0
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['sent_packets'] = tinsStats['sinceLastQuery']['BestEffort']['Upload']['sent_packets'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Upload']['sent_packets'] = tinsStats['sinceLastQuery']['Voice']['Upload']['sent_packets'] = 0.0
-
-	try:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['drops'] = tinsStats['currentQuery']['Bulk']['Download']['drops'] - tinsStats['priorQuery']['Bulk']['Download']['drops']
-		tinsStats['sinceLastQuery']['BestEffort']['Download']['drops'] = tinsStats['currentQuery']['BestEffort']['Download']['drops'] - tinsStats['priorQuery']['BestEffort']['Download']['drops']
-		tinsStats['sinceLastQuery']['Video']['Download']['drops'] = tinsStats['currentQuery']['Video']['Download']['drops'] - tinsStats['priorQuery']['Video']['Download']['drops']
-		tinsStats['sinceLastQuery']['Voice']['Download']['drops'] = tinsStats['currentQuery']['Voice']['Download']['drops'] - tinsStats['priorQuery']['Voice']['Download']['drops']
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['drops'] = tinsStats['currentQuery']['Bulk']['Upload']['drops'] - tinsStats['priorQuery']['Bulk']['Upload']['drops']
-		tinsStats['sinceLastQuery']['BestEffort']['Upload']['drops'] = tinsStats['currentQuery']['BestEffort']['Upload']['drops'] - tinsStats['priorQuery']['BestEffort']['Upload']['drops']
-		tinsStats['sinceLastQuery']['Video']['Upload']['drops'] = tinsStats['currentQuery']['Video']['Upload']['drops'] - tinsStats['priorQuery']['Video']['Upload']['drops']
-		tinsStats['sinceLastQuery']['Voice']['Upload']['drops'] = tinsStats['currentQuery']['Voice']['Upload']['drops'] - tinsStats['priorQuery']['Voice']['Upload']['drops']
-	except:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['drops'] = tinsStats['sinceLastQuery']['BestEffort']['Download']['drops'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Download']['drops'] = tinsStats['sinceLastQuery']['Voice']['Download']['drops'] = 0.0
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['drops'] = tinsStats['sinceLastQuery']['BestEffort']['Upload']['drops'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Upload']['drops'] = tinsStats['sinceLastQuery']['Voice']['Upload']['drops'] = 0.0
-
-	try:
-		dlPerc = tinsStats['sinceLastQuery']['Bulk']['Download']['drops'] / tinsStats['sinceLastQuery']['Bulk']['Download']['sent_packets']
-		ulPerc = tinsStats['sinceLastQuery']['Bulk']['Upload']['drops'] / tinsStats['sinceLastQuery']['Bulk']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['Bulk']['Download']['dropPercentage'] = max(round(dlPerc * 100.0, 3),0.0)
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['dropPercentage'] = max(round(ulPerc * 100.0, 3),0.0)
-		
-		dlPerc = tinsStats['sinceLastQuery']['BestEffort']['Download']['drops'] / tinsStats['sinceLastQuery']['BestEffort']['Download']['sent_packets']
-		ulPerc = tinsStats['sinceLastQuery']['BestEffort']['Upload']['drops'] / tinsStats['sinceLastQuery']['BestEffort']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['BestEffort']['Download']['dropPercentage'] = max(round(dlPerc * 100.0, 3),0.0)
-		tinsStats['sinceLastQuery']['BestEffort']['Upload']['dropPercentage'] = max(round(ulPerc * 100.0, 3),0.0)
-		
-		dlPerc = tinsStats['sinceLastQuery']['Video']['Download']['drops'] / tinsStats['sinceLastQuery']['Video']['Download']['sent_packets']
-		ulPerc = tinsStats['sinceLastQuery']['Video']['Upload']['drops'] / tinsStats['sinceLastQuery']['Video']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['Video']['Download']['dropPercentage'] = max(round(dlPerc * 100.0, 3),0.0)
-		tinsStats['sinceLastQuery']['Video']['Upload']['dropPercentage'] = max(round(ulPerc * 100.0, 3),0.0)
-		
-		dlPerc = tinsStats['sinceLastQuery']['Voice']['Download']['drops'] / tinsStats['sinceLastQuery']['Voice']['Download']['sent_packets']
-		ulPerc = tinsStats['sinceLastQuery']['Voice']['Upload']['drops'] / tinsStats['sinceLastQuery']['Voice']['Upload']['sent_packets']
-		tinsStats['sinceLastQuery']['Voice']['Download']['dropPercentage'] = max(round(dlPerc * 100.0, 3),0.0)
-		tinsStats['sinceLastQuery']['Voice']['Upload']['dropPercentage'] = max(round(ulPerc * 100.0, 3),0.0)
-	except:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['BestEffort']['Download']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['BestEffort']['Upload']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Download']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Upload']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['Voice']['Download']['dropPercentage'] = 0.0
-		tinsStats['sinceLastQuery']['Voice']['Upload']['dropPercentage'] = 0.0
-		
-	try:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['percentage'] = min(round((tinsStats['sinceLastQuery']['Bulk']['Download']['sent_packets']/allPacketsUpload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['Bulk']['Upload']['percentage'] = min(round((tinsStats['sinceLastQuery']['Bulk']['Upload']['sent_packets']/allPacketsUpload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['BestEffort']['Download']['percentage'] = min(round((tinsStats['sinceLastQuery']['BestEffort']['Download']['sent_packets']/allPacketsDownload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['BestEffort']['Upload']['percentage'] = min(round((tinsStats['sinceLastQuery']['BestEffort']['Upload']['sent_packets']/allPacketsUpload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['Video']['Download']['percentage'] = min(round((tinsStats['sinceLastQuery']['Video']['Download']['sent_packets']/allPacketsDownload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['Video']['Upload']['percentage'] = min(round((tinsStats['sinceLastQuery']['Video']['Upload']['sent_packets']/allPacketsUpload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['Voice']['Download']['percentage'] = min(round((tinsStats['sinceLastQuery']['Voice']['Download']['sent_packets']/allPacketsDownload)*100.0, 3),100.0)
-		tinsStats['sinceLastQuery']['Voice']['Upload']['percentage'] = min(round((tinsStats['sinceLastQuery']['Voice']['Upload']['sent_packets']/allPacketsUpload)*100.0, 3),100.0)
-	except:
-		tinsStats['sinceLastQuery']['Bulk']['Download']['percentage'] = tinsStats['sinceLastQuery']['Bulk']['Upload']['percentage'] = 0.0
-		tinsStats['sinceLastQuery']['BestEffort']['Download']['percentage'] = tinsStats['sinceLastQuery']['BestEffort']['Upload']['percentage'] = 0.0
-		tinsStats['sinceLastQuery']['Video']['Download']['percentage'] = tinsStats['sinceLastQuery']['Video']['Upload']['percentage'] = 0.0
-		tinsStats['sinceLastQuery']['Voice']['Download']['percentage'] = tinsStats['sinceLastQuery']['Voice']['Upload']['percentage'] = 0.0
+	if 'cake diffserv4' in fqOrCAKE:
+		tinStats.finishQuery(tinsStats)
 	
-	return subscriberCircuits, tinsStats
+	return subscriberCircuits, tinsStats, round(sampleWallTime * 1000000000)
 
 
 def getParentNodeBandwidthStats(parentNodes, subscriberCircuits):
@@ -281,38 +244,59 @@ def getParentNodeBandwidthStats(parentNodes, subscriberCircuits):
 	return parentNodes
 
 
-def getParentNodeLatencyStats(parentNodes, subscriberCircuits):
-	for parentNode in parentNodes:
-		if 'stats' not in parentNode:
-			parentNode['stats'] = {}
-			parentNode['stats']['sinceLastQuery'] = {}
+def getParentNodeLatencyStats(parentNodes, subscriberCircuits, sketchForClassID, parentNodeNameDict):
+	# Each node's latency covers every circuit beneath it in network.json,
+	# not only the circuits attached to it directly
+	sketchForNode = {}
+	for circuit in subscriberCircuits:
+		if circuit['classid'] in sketchForClassID:
+			if circuit['ParentNode'] not in sketchForNode:
+				sketchForNode[circuit['ParentNode']] = LatencySketch()
+			sketchForNode[circuit['ParentNode']].merge(sketchForClassID[circuit['classid']])
+	rollUpSketches(sketchForNode, parentNodeNameDict)
 	
 	for parentNode in parentNodes:
 		thisParentNodeStats = {'sinceLastQuery': {}}
-		circuitsMatchedLatencies = []
-		for circuit in subscriberCircuits:
-			if circuit['ParentNode'] == parentNode['parentNodeName']:
-				if circuit['stats']['sinceLastQuery']['tcpLatency'] != None:
-					circuitsMatchedLatencies.append(circuit['stats']['sinceLastQuery']['tcpLatency'])
-		if len(circuitsMatchedLatencies) > 0:
-			thisParentNodeStats['sinceLastQuery']['tcpLatency'] = statistics.median(circuitsMatchedLatencies)
+		if parentNode['parentNodeName'] in sketchForNode:
+			percentiles = sketchForNode[parentNode['parentNodeName']].percentiles()
+			thisParentNodeStats['sinceLastQuery']['tcpLatency'] = percentiles['p50']
+			thisParentNodeStats['sinceLastQuery']['tcpLatencyPercentiles'] = percentiles
 		else:
 			thisParentNodeStats['sinceLastQuery']['tcpLatency'] = None
+			thisParentNodeStats['sinceLastQuery']['tcpLatencyPercentiles'] = None
 		parentNode['stats'] = thisParentNodeStats
 	return parentNodes
 
 
-def getCircuitLatencyStats(subscriberCircuits):
+def getPpingEntries():
+	# Returns xdp_pping's per-circuit entries, and the wall-clock time of
+	# the sample (nanoseconds)
 	command = './cpumap-pping/src/xdp_pping'
+	sampleTimeNs = time.time_ns()
 	listOfEntries = json.loads(subprocess.run(command.split(' '), stdout=subprocess.PIPE).stdout.decode('utf-8'))
+	return listOfEntries, sampleTimeNs
+
+
+def getCircuitLatencyStats(subscriberCircuits, ppingReader=getPpingEntries):
+	# Returns the circuits, a latency sketch per classid (see latencySketch.py)
+	# and the wall-clock time of the sample (nanoseconds)
+	listOfEntries, sampleTimeNs = ppingReader()
 	
-	tcpLatencyForClassID = {}
+	# A circuit may have an entry per poll (see latencyReader.py). Each goes
+	# into the circuit's sketch, and the averages are weighted by samples.
+	sketchForClassID = {}
 	for entry in listOfEntries:
 		if 'tc' in entry:
-			handle = hex(int(entry['tc'].split(':')[0])) + ':' + hex(int(entry['tc'].split(':')[1]))
-			# To avoid outliers messing up avg for each circuit - cap at ceiling of 200ms
-			ceiling = 200.0
-			tcpLatencyForClassID[handle] = min(entry['avg'], ceiling)
+			handle = tcHandleToClassID(entry['tc'])
+			if handle not in sketchForClassID:
+				sketchForClassID[handle] = LatencySketch()
+			sketchForClassID[handle].addPpingEntry(entry)
+	
+	tcpLatencyForClassID = {}
+	for entry in mergeEntries(listOfEntries):
+		# To avoid outliers messing up avg for each circuit - cap at ceiling of 200ms
+		ceiling = 200.0
+		tcpLatencyForClassID[tcHandleToClassID(entry['tc'])] = min(entry['avg'], ceiling)
 	
 	for circuit in subscriberCircuits:
 		if 'stats' not in circuit:
@@ -323,10 +307,12 @@ def getCircuitLatencyStats(subscriberCircuits):
 		classID = circuit['classid']
 		if classID in tcpLatencyForClassID:
 			circuit['stats']['sinceLastQuery']['tcpLatency'] = tcpLatencyForClassID[classID]
+			circuit['stats']['sinceLastQuery']['tcpLatencyPercentiles'] = sketchForClassID[classID].percentiles()
 		else:
 			circuit['stats']['sinceLastQuery']['tcpLatency'] = None
+			circuit['stats']['sinceLastQuery']['tcpLatencyPercentiles'] = None
 
-	return subscriberCircuits
+	return subscriberCircuits, sketchForClassID, sampleTimeNs
 
 
 def getParentNodeDict(data, depth, parentNodeNameDict):
@@ -342,6 +328,22 @@ def getParentNodeDict(data, depth, parentNodeNameDict):
 	return parentNodeNameDict
 
 
+def nodeDetailsPull():
+	# Node IDs and paths, for influxDBTagSchema = 'ids'
+	if influxDBTagSchema != 'ids':
+		return {}
+	with open('network.json', 'r') as j:
+		network = json.loads(j.read())
+	return getNodeDetails(network)
+
+def writeMetadataPoints(write_api, subscriberCircuits, parentNodes, nodeDetails, timestamp):
+	# Writes 'Circuit Metadata' / 'Node Metadata' for new or changed circuits and nodes
+	circuitRows, nodeRows = metadataPublisher.pending(subscriberCircuits, parentNodes, nodeDetails, timestamp / 1000000000.0)
+	for measurement, rows in [('Circuit Metadata', circuitRows), ('Node Metadata', nodeRows)]:
+		for tagPairs, fields in rows:
+			serializer.add(measurement, serializer.tagSet((measurement,) + tagPairs, tagPairs), fields, timestamp=timestamp)
+	return writeSerializedPoints(write_api)
+
 def parentNodeNameDictPull():
 	# Load network heirarchy
 	with open('network.json', 'r') as j:
@@ -349,7 +351,94 @@ def parentNodeNameDictPull():
 	parentNodeNameDict = getParentNodeDict(network, 0, None)
 	return parentNodeNameDict
 
-def refreshBandwidthGraphs():
+def writeSerializedPoints(write_api):
+	# Sends whatever the serializer has buffered as a single write,
+	# then empties the buffer for reuse. Returns the number of points sent.
+	# With InfluxDB disabled (write_api is None) the buffer is discarded.
+	pointCount = len(serializer)
+	if (pointCount > 0) and (write_api != None):
+		write_api.write(bucket=influxDBBucket, record=serializer.getvalue())
+	serializer.reset()
+	return pointCount
+
+def writeRollupPoints(write_api, finishedRollup):
+	# Writes one window of CircuitRollup results as 'Bandwidth Rollup' and
+	# 'Utilization Rollup' points, timestamped at the start of the window
+	windowStart, results = finishedRollup
+	timestamp = round(windowStart * 1000000000)
+	pointCount = 0
+	for circuit, download, upload in results:
+		tags = serializer.tagSet(circuit['classid'], circuitTagPairs(circuit, influxDBTagSchema))
+		serializer.add('Bandwidth Rollup', tags, (("DownloadMin", download[0]), ("DownloadMean", download[1]), ("DownloadMax", download[2]),
+			("UploadMin", upload[0]), ("UploadMean", upload[1]), ("UploadMax", upload[2])), timestamp=timestamp)
+		downloadCapacity = circuit['maxDownload'] * 10000.0
+		uploadCapacity = circuit['maxUpload'] * 10000.0
+		serializer.add('Utilization Rollup', tags, tuple((field, round(value / capacity, 1)) for field, value, capacity in (
+			("DownloadMin", download[0], downloadCapacity), ("DownloadMean", download[1], downloadCapacity), ("DownloadMax", download[2], downloadCapacity),
+			("UploadMin", upload[0], uploadCapacity), ("UploadMean", upload[1], uploadCapacity), ("UploadMax", upload[2], uploadCapacity))), timestamp=timestamp)
+		if len(serializer) >= 2000:
+			pointCount += writeSerializedPoints(write_api)
+	pointCount += writeSerializedPoints(write_api)
+	return pointCount
+
+def writeHostPoints(write_api, hostSample, timestamp):
+	# NIC queue n-1 carries LibreQoS queue n, so it is tagged with the same Queue as 'Queue Load'
+	for cpu, entry in hostSample['cpus'].items():
+		tags = serializer.tagSet(('Host CPU', cpu), (("CPU", str(cpu)), ("Type", "CPU")))
+		serializer.add('Host CPU', tags, tuple(entry.items()), timestamp=timestamp)
+	for (interface, queue), entry in hostSample['queues'].items():
+		fields = tuple((field, value) for field, value in entry.items() if (field != 'interruptCPU') and (value != None))
+		if len(fields) > 0:
+			tags = serializer.tagSet(('NIC Queue', interface, queue), (("Interface", interface), ("Queue", hex(queue + 1)), ("CPU", str(queue)), ("Type", "NIC Queue")))
+			serializer.add('NIC Queue', tags, fields, timestamp=timestamp)
+	for interface, entry in hostSample['interfaces'].items():
+		if len(entry) > 0:
+			tags = serializer.tagSet(('NIC', interface), (("Interface", interface), ("Type", "NIC")))
+			serializer.add('NIC', tags, tuple(entry.items()), timestamp=timestamp)
+	return writeSerializedPoints(write_api)
+
+def recordBandwidthTimeSeries(subscriberCircuits, parentNodes, sampleTimeNs):
+	# Series of circuits and nodes removed by a reload can be reused
+	timeSeries.retainOnly(set(('circuit', circuit['circuitID']) for circuit in subscriberCircuits) | set(('node', parentNode['parentNodeName']) for parentNode in parentNodes))
+	timeSeries.startSample(sampleTimeNs / 1000000000.0)
+	for circuit in subscriberCircuits:
+		sinceLastQuery = circuit['stats']['sinceLastQuery']
+		for metric in ('bitsDownload', 'bitsUpload', 'packetDropsDownload', 'packetDropsUpload'):
+			timeSeries.record('circuit', circuit['circuitID'], metric, sinceLastQuery[metric])
+	for parentNode in parentNodes:
+		sinceLastQuery = parentNode['stats']['sinceLastQuery']
+		for metric in ('bitsDownload', 'bitsUpload', 'packetDropsTotal', 'overloadFactorTotal'):
+			timeSeries.record('node', parentNode['parentNodeName'], metric, sinceLastQuery[metric])
+	timeSeries.finishSample()
+
+def recordLatencyTimeSeries(subscriberCircuits, parentNodes, sampleTimeNs):
+	timeSeries.startSample(sampleTimeNs / 1000000000.0, 'latency')
+	for circuit in subscriberCircuits:
+		timeSeries.record('circuit', circuit['circuitID'], 'tcpLatency', circuit['stats']['sinceLastQuery']['tcpLatency'])
+	for parentNode in parentNodes:
+		timeSeries.record('node', parentNode['parentNodeName'], 'tcpLatency', parentNode['stats']['sinceLastQuery']['tcpLatency'])
+	timeSeries.finishSample()
+
+def addTinPoints(percentages, row, cacheKey, tags, timestamp):
+	# Adds drop and mark percentages for each tin of one node or circuit
+	# row, skipping tins that carried no packets in either direction
+	for tin, tinName in enumerate(tinNames):
+		sentDownload, dropsDownload, marksDownload = percentages[(0, tin)]
+		sentUpload, dropsUpload, marksUpload = percentages[(1, tin)]
+		if (sentDownload[row] > 0) or (sentUpload[row] > 0):
+			tinTags = serializer.tagSet(cacheKey + (tinName,), tags + (("Tin", tinName),))
+			serializer.add('Tin Drop Percentage', tinTags, (("Download", dropsDownload[row]), ("Upload", dropsUpload[row])), timestamp=timestamp)
+			serializer.add('Tin Mark Percentage', tinTags, (("Download", marksDownload[row]), ("Upload", marksUpload[row])), timestamp=timestamp)
+
+def refreshBandwidthGraphs(pollerMetrics=None, interfaceStatsReader=getInterfaceStats):
+	# pollerMetrics, if given, is written as a 'Poller' point (see poller.py).
+	# The stats files are read and rewritten under statsFilesLock(), so a
+	# reload saved meanwhile isn't overwritten with the circuits it replaced.
+	openStores()
+	with statsFilesLock():
+		updateBandwidthGraphs(pollerMetrics, interfaceStatsReader)
+
+def updateBandwidthGraphs(pollerMetrics, interfaceStatsReader):
 	startTime = datetime.now()
 	with open('statsByParentNode.json', 'r') as j:
 		parentNodes = json.loads(j.read())
@@ -375,40 +464,67 @@ def refreshBandwidthGraphs():
 		droppedPacketsAllTime = 0.0
 
 	parentNodeNameDict = parentNodeNameDictPull()
+	nodeDetails = nodeDetailsPull()
 
 	print("Retrieving circuit statistics")
-	subscriberCircuits, tinsStats = getCircuitBandwidthStats(subscriberCircuits, tinsStats)
+	subscriberCircuits, tinsStats, sampleTimeNs = getCircuitBandwidthStats(subscriberCircuits, tinsStats, interfaceStatsReader)
 	print("Computing parent node statistics")
 	parentNodes = getParentNodeBandwidthStats(parentNodes, subscriberCircuits)
-	print("Writing data to InfluxDB")
-	client = InfluxDBClient(
-		url=influxDBurl,
-		token=influxDBtoken,
-		org=influxDBOrg
-	)
-	write_api = client.write_api(write_options=SYNCHRONOUS)
+	heavyHitters.updateBandwidth(subscriberCircuits)
+	usageTracker.add(subscriberCircuits, sampleTimeNs / 1000000000.0)
+	if circuitUsageLedger != None:
+		circuitUsageLedger.add(subscriberCircuits, sampleTimeNs / 1000000000.0)
+		circuitUsageLedger.compactIfDue(sampleTimeNs / 1000000000.0)
+	queueLoad.refreshPlan()
+	queueLoad.update(subscriberCircuits)
+	hostSample = hostTelemetry.sample() if hostTelemetry != None else None
+	if hostSample != None:
+		correlateQueues(queueLoad.queues, hostSample, [interfaceA, interfaceB])
+	for entry in queueLoad.imbalanced():
+		print("Queue " + hex(entry['queue']) + " (CPU " + str(entry['cpu']) + ") is carrying more than " + str(cpuQueueImbalanceShare) + " of " + "/".join(entry['imbalanced']) + " traffic")
+	if timeSeries != None:
+		recordBandwidthTimeSeries(subscriberCircuits, parentNodes, sampleTimeNs)
+	if metricsExporter != None:
+		metricsExporter.updateBandwidth(subscriberCircuits, parentNodes)
+		metricsExporter.updateQueueLoad(queueLoad)
+		if hostSample != None:
+			metricsExporter.updateHost(hostSample)
+		if 'cake diffserv4' in fqOrCAKE:
+			metricsExporter.updateTins(tinsStats, tinStats if tinStats.granularity != 'global' else None)
+	if influxDBEnabled:
+		print("Writing data to InfluxDB")
+		client = InfluxDBClient(
+			url=influxDBurl,
+			token=influxDBtoken,
+			org=influxDBOrg
+		)
+		write_api = client.write_api(write_options=SYNCHRONOUS)
+	else:
+		client = write_api = None
 
 	chunkedsubscriberCircuits = list(chunk_list(subscriberCircuits, 200))
 
 	queriesToSendCount = 0
+	if circuitRollup != None:
+		fullResolutionCircuitIDs = heavyHitters.circuitIDs('throughput')
+		finishedRollup = circuitRollup.add(subscriberCircuits, sampleTimeNs / 1000000000.0)
+		if finishedRollup != None:
+			queriesToSendCount += writeRollupPoints(write_api, finishedRollup)
 	for chunk in chunkedsubscriberCircuits:
-		queriesToSend = []
 		for circuit in chunk:
+			if (circuitRollup != None) and (circuit['circuitID'] not in fullResolutionCircuitIDs):
+				continue
 			bitsDownload = float(circuit['stats']['sinceLastQuery']['bitsDownload'])
 			bitsUpload = float(circuit['stats']['sinceLastQuery']['bitsUpload'])
 			if (bitsDownload > 0) and (bitsUpload > 0):
 				percentUtilizationDownload = round((bitsDownload / round(circuit['maxDownload'] * 1000000))*100.0, 1)
 				percentUtilizationUpload = round((bitsUpload / round(circuit['maxUpload'] * 1000000))*100.0, 1)
-				p = Point('Bandwidth').tag("Circuit", circuit['circuitName']).tag("ParentNode", circuit['ParentNode']).tag("Type", "Circuit").field("Download", bitsDownload).field("Upload", bitsUpload)
-				queriesToSend.append(p)
-				p = Point('Utilization').tag("Circuit", circuit['circuitName']).tag("ParentNode", circuit['ParentNode']).tag("Type", "Circuit").field("Download", percentUtilizationDownload).field("Upload", percentUtilizationUpload)
-				queriesToSend.append(p)
+				tags = serializer.tagSet(circuit['classid'], circuitTagPairs(circuit, influxDBTagSchema))
+				serializer.add('Bandwidth', tags, (("Download", bitsDownload), ("Upload", bitsUpload)), timestamp=sampleTimeNs)
+				serializer.add('Utilization', tags, (("Download", percentUtilizationDownload), ("Upload", percentUtilizationUpload)), timestamp=sampleTimeNs)
 
-		write_api.write(bucket=influxDBBucket, record=queriesToSend)
-		# print("Added " + str(len(queriesToSend)) + " points to InfluxDB.")
-		queriesToSendCount += len(queriesToSend)
+		queriesToSendCount += writeSerializedPoints(write_api)
 
-	queriesToSend = []
 	for parentNode in parentNodes:
 		bitsDownload = float(parentNode['stats']['sinceLastQuery']['bitsDownload'])
 		bitsUpload = float(parentNode['stats']['sinceLastQuery']['bitsUpload'])
@@ -418,33 +534,56 @@ def refreshBandwidthGraphs():
 		if (bitsDownload > 0) and (bitsUpload > 0):
 			percentUtilizationDownload = round((bitsDownload / round(parentNode['maxDownload'] * 1000000))*100.0, 1)
 			percentUtilizationUpload = round((bitsUpload / round(parentNode['maxUpload'] * 1000000))*100.0, 1)
-			p = Point('Bandwidth').tag("Device", parentNode['parentNodeName']).tag("ParentNode", parentNode['parentNodeName']).tag("Type", "Parent Node").field("Download", bitsDownload).field("Upload", bitsUpload)
-			queriesToSend.append(p)
-			p = Point('Utilization').tag("Device", parentNode['parentNodeName']).tag("ParentNode", parentNode['parentNodeName']).tag("Type", "Parent Node").field("Download", percentUtilizationDownload).field("Upload", percentUtilizationUpload)
-			queriesToSend.append(p)
-			p = Point('Overload').tag("Device", parentNode['parentNodeName']).tag("ParentNode", parentNode['parentNodeName']).tag("Type", "Parent Node").field("Overload", overloadFactor)
-			queriesToSend.append(p)
-
-	write_api.write(bucket=influxDBBucket, record=queriesToSend)
-	# print("Added " + str(len(queriesToSend)) + " points to InfluxDB.")
-	queriesToSendCount += len(queriesToSend)
+			tags = serializer.tagSet(('Parent Node', parentNode['parentNodeName']), nodeTagPairs(parentNode['parentNodeName'], nodeDetails, influxDBTagSchema))
+			serializer.add('Bandwidth', tags, (("Download", bitsDownload), ("Upload", bitsUpload)), timestamp=sampleTimeNs)
+			serializer.add('Utilization', tags, (("Download", percentUtilizationDownload), ("Upload", percentUtilizationUpload)), timestamp=sampleTimeNs)
+			serializer.add('Overload', tags, (("Overload", overloadFactor),), timestamp=sampleTimeNs)
+
+	queriesToSendCount += writeSerializedPoints(write_api)
 	
-	if 'cake diffserv4' in fqOrCAKE:
-		queriesToSend = []
-		listOfTins = ['Bulk', 'BestEffort', 'Video', 'Voice']
-		for tin in listOfTins:
-			p = Point('Tin Drop Percentage').tag("Type", "Tin").tag("Tin", tin).field("Download", tinsStats['sinceLastQuery'][tin]['Download']['dropPercentage']).field("Upload", tinsStats['sinceLastQuery'][tin]['Upload']['dropPercentage'])
-			queriesToSend.append(p)
-			p = Point('Tins Assigned').tag("Type", "Tin").tag("Tin", tin).field("Download", tinsStats['sinceLastQuery'][tin]['Download']['percentage']).field("Upload", tinsStats['sinceLastQuery'][tin]['Upload']['percentage'])
-			queriesToSend.append(p)
-
-		write_api.write(bucket=influxDBBucket, record=queriesToSend)
-		# print("Added " + str(len(queriesToSend)) + " points to InfluxDB.")
-		queriesToSendCount += len(queriesToSend)
+	for entry in queueLoad.queues:
+		tags = serializer.tagSet(('Queue', entry['queue']), (("Queue", hex(entry['queue'])), ("CPU", str(entry['cpu'])), ("Type", "Queue")))
+		serializer.add('Queue Load', tags, (("Download", float(entry['bitsDownload'])), ("Upload", float(entry['bitsUpload'])),
+			("PacketsDownload", float(entry['packetsDownload'])), ("PacketsUpload", float(entry['packetsUpload'])),
+			("ShareDownload", float(entry['shareDownload'])), ("ShareUpload", float(entry['shareUpload'])),
+			("Imbalanced", len(entry['imbalanced']) > 0)), timestamp=sampleTimeNs)
+	queriesToSendCount += writeSerializedPoints(write_api)
+	
+	if hostSample != None:
+		queriesToSendCount += writeHostPoints(write_api, hostSample, sampleTimeNs)
 	
-	print("Added " + str(queriesToSendCount) + " points to InfluxDB.")
+	if influxDBTagSchema == 'ids':
+		queriesToSendCount += writeMetadataPoints(write_api, subscriberCircuits, parentNodes, nodeDetails, sampleTimeNs)
+	
+	if 'cake diffserv4' in fqOrCAKE:
+		for tin in tinNames:
+			tags = serializer.tagSet(('Tin', tin), (("Type", "Tin"), ("Tin", tin)))
+			serializer.add('Tin Drop Percentage', tags, (("Download", tinsStats['sinceLastQuery'][tin]['Download']['dropPercentage']), ("Upload", tinsStats['sinceLastQuery'][tin]['Upload']['dropPercentage'])), timestamp=sampleTimeNs)
+			serializer.add('Tin Mark Percentage', tags, (("Download", tinsStats['sinceLastQuery'][tin]['Download']['markPercentage']), ("Upload", tinsStats['sinceLastQuery'][tin]['Upload']['markPercentage'])), timestamp=sampleTimeNs)
+			serializer.add('Tins Assigned', tags, (("Download", tinsStats['sinceLastQuery'][tin]['Download']['percentage']), ("Upload", tinsStats['sinceLastQuery'][tin]['Upload']['percentage'])), timestamp=sampleTimeNs)
 
-	client.close()
+		queriesToSendCount += writeSerializedPoints(write_api)
+		
+		# Per-node and per-circuit tins, depending on tinStatsGranularity
+		if tinStats.granularity in ('node', 'circuit'):
+			for row, nodeName in enumerate(tinStats.nodeNames):
+				addTinPoints(tinStats.nodePercentages, row, ('Tin', 'Parent Node', nodeName), nodeTagPairs(nodeName, nodeDetails, influxDBTagSchema), sampleTimeNs)
+			queriesToSendCount += writeSerializedPoints(write_api)
+		if tinStats.granularity == 'circuit':
+			for row, circuit in enumerate(tinStats.circuits):
+				addTinPoints(tinStats.circuitPercentages, row, ('Tin', circuit['classid']), circuitTagPairs(circuit, influxDBTagSchema), sampleTimeNs)
+				if len(serializer) >= 2000:
+					queriesToSendCount += writeSerializedPoints(write_api)
+			queriesToSendCount += writeSerializedPoints(write_api)
+	
+	if pollerMetrics is not None:
+		tags = serializer.tagSet('Poller', (("Type", "Poller"),))
+		serializer.add('Poller', tags, tuple(pollerMetrics.items()), timestamp=sampleTimeNs)
+		queriesToSendCount += writeSerializedPoints(write_api)
+	
+	if client != None:
+		print("Added " + str(queriesToSendCount) + " points to InfluxDB.")
+		client.close()
 	
 	with open('statsByParentNode.json', 'w') as f:
 		f.write(json.dumps(parentNodes, indent=4))
@@ -458,12 +597,20 @@ def refreshBandwidthGraphs():
 		
 	with open('tinsStats.json', 'w') as f:
 		f.write(json.dumps(tinsStats, indent=4))
+	
+	heavyHitters.save()
+	queueLoad.save()
 
 	endTime = datetime.now()
 	durationSeconds = round((endTime - startTime).total_seconds(), 2)
 	print("Graphs updated within " + str(durationSeconds) + " seconds.")
 
-def refreshLatencyGraphs():
+def refreshLatencyGraphs(ppingReader=getPpingEntries):
+	openStores()
+	with statsFilesLock():
+		updateLatencyGraphs(ppingReader)
+
+def updateLatencyGraphs(ppingReader):
 	startTime = datetime.now()
 	with open('statsByParentNode.json', 'r') as j:
 		parentNodes = json.loads(j.read())
@@ -472,52 +619,60 @@ def refreshLatencyGraphs():
 		subscriberCircuits = json.loads(j.read())
 
 	parentNodeNameDict = parentNodeNameDictPull()
+	nodeDetails = nodeDetailsPull()
 
 	print("Retrieving circuit statistics")
-	subscriberCircuits = getCircuitLatencyStats(subscriberCircuits)
+	subscriberCircuits, sketchForClassID, sampleTimeNs = getCircuitLatencyStats(subscriberCircuits, ppingReader)
 	print("Computing parent node statistics")
-	parentNodes = getParentNodeLatencyStats(parentNodes, subscriberCircuits)
-	print("Writing data to InfluxDB")
-	client = InfluxDBClient(
-		url=influxDBurl,
-		token=influxDBtoken,
-		org=influxDBOrg
-	)
-	write_api = client.write_api(write_options=SYNCHRONOUS)
+	parentNodes = getParentNodeLatencyStats(parentNodes, subscriberCircuits, sketchForClassID, parentNodeNameDict)
+	heavyHitters.updateLatency(subscriberCircuits)
+	if timeSeries != None:
+		recordLatencyTimeSeries(subscriberCircuits, parentNodes, sampleTimeNs)
+	if metricsExporter != None:
+		metricsExporter.updateLatency(subscriberCircuits, parentNodes)
+	if influxDBEnabled:
+		print("Writing data to InfluxDB")
+		client = InfluxDBClient(
+			url=influxDBurl,
+			token=influxDBtoken,
+			org=influxDBOrg
+		)
+		write_api = client.write_api(write_options=SYNCHRONOUS)
+	else:
+		client = write_api = None
 
 	chunkedsubscriberCircuits = list(chunk_list(subscriberCircuits, 200))
 
 	queriesToSendCount = 0
 	for chunk in chunkedsubscriberCircuits:
-		queriesToSend = []
 		for circuit in chunk:
 			if circuit['stats']['sinceLastQuery']['tcpLatency'] != None:
 				tcpLatency = float(circuit['stats']['sinceLastQuery']['tcpLatency'])
-				p = Point('TCP Latency').tag("Circuit", circuit['circuitName']).tag("ParentNode", circuit['ParentNode']).tag("Type", "Circuit").field("TCP Latency", tcpLatency)
-				queriesToSend.append(p)
-		write_api.write(bucket=influxDBBucket, record=queriesToSend)
-		queriesToSendCount += len(queriesToSend)
+				tags = serializer.tagSet(circuit['classid'], circuitTagPairs(circuit, influxDBTagSchema))
+				serializer.add('TCP Latency', tags, (("TCP Latency", tcpLatency),), timestamp=sampleTimeNs)
+				serializer.add('TCP Latency Percentiles', tags, tuple(circuit['stats']['sinceLastQuery']['tcpLatencyPercentiles'].items()), timestamp=sampleTimeNs)
+		queriesToSendCount += writeSerializedPoints(write_api)
 
-	queriesToSend = []
 	for parentNode in parentNodes:
 		if parentNode['stats']['sinceLastQuery']['tcpLatency'] != None:
 			tcpLatency = float(parentNode['stats']['sinceLastQuery']['tcpLatency'])
-			p = Point('TCP Latency').tag("Device", parentNode['parentNodeName']).tag("ParentNode", parentNode['parentNodeName']).tag("Type", "Parent Node").field("TCP Latency", tcpLatency)
-			queriesToSend.append(p)
+			tags = serializer.tagSet(('Parent Node', parentNode['parentNodeName']), nodeTagPairs(parentNode['parentNodeName'], nodeDetails, influxDBTagSchema))
+			serializer.add('TCP Latency', tags, (("TCP Latency", tcpLatency),), timestamp=sampleTimeNs)
+			serializer.add('TCP Latency Percentiles', tags, tuple(parentNode['stats']['sinceLastQuery']['tcpLatencyPercentiles'].items()), timestamp=sampleTimeNs)
 
-	write_api.write(bucket=influxDBBucket, record=queriesToSend)
-	# print("Added " + str(len(queriesToSend)) + " points to InfluxDB.")
-	queriesToSendCount += len(queriesToSend)
+	queriesToSendCount += writeSerializedPoints(write_api)
 	
-	print("Added " + str(queriesToSendCount) + " points to InfluxDB.")
-
-	client.close()
+	if client != None:
+		print("Added " + str(queriesToSendCount) + " points to InfluxDB.")
+		client.close()
 	
 	with open('statsByParentNode.json', 'w') as f:
 		f.write(json.dumps(parentNodes, indent=4))
 
 	with open('statsByCircuit.json', 'w') as f:
 		f.write(json.dumps(subscriberCircuits, indent=4))
+	
+	heavyHitters.save()
 
 	endTime = datetime.now()
 	durationSeconds = round((endTime - startTime).total_seconds(), 2)
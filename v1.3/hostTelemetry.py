@@ -0,0 +1,233 @@
+# Host counters that bound shaping performance: softirq and busy time per
+# CPU (/proc/stat), NET_RX / NET_TX softirqs per CPU (/proc/softirqs), and,
+# for interfaceA and interfaceB, interrupts per NIC queue (/proc/interrupts),
+# tx byte queue limits (/sys/class/net/<interface>/queues) and NIC drops.
+# Every file is opened once and reread with os.pread(), so a sample costs
+# a handful of syscalls and no subprocesses. LibreQoS.py shapes MQ queue n
+# on NIC queue n-1 and CPU n-1, so rows are reported per CPU / NIC queue
+# index and can be lined up with cpuLoad.py by queue.
+
+import os
+import time
+
+# Per interface totals from /sys/class/net/<interface>/statistics.
+# rx_missed_errors counts packets the NIC dropped because a ring was full.
+interfaceCounters = {
+	'rx_packets': 'rxPacketsPerSecond',
+	'tx_packets': 'txPacketsPerSecond',
+	'rx_dropped': 'rxDroppedPerSecond',
+	'tx_dropped': 'txDroppedPerSecond',
+	'rx_missed_errors': 'rxMissedPerSecond',
+}
+
+
+class PreadFile:
+	# A file kept open and read from the start on every read()
+
+	def __init__(self, path):
+		self.path = path
+		self.fd = os.open(path, os.O_RDONLY)
+		self.bufferSize = 65536
+
+	def read(self):
+		while True:
+			data = os.pread(self.fd, self.bufferSize, 0)
+			if len(data) < self.bufferSize:
+				return data.decode('ascii', 'replace')
+			self.bufferSize *= 2
+
+	def close(self):
+		os.close(self.fd)
+
+
+def openIfExists(path):
+	try:
+		return PreadFile(path)
+	except OSError:
+		return None
+
+
+def parseCPUColumns(header):
+	# 'CPU0 CPU1 ...' -> [0, 1, ...]
+	return [int(column[3:]) for column in header.split()]
+
+
+def parseStat(text):
+	# /proc/stat -> {cpu: (busy, softirq, total)} in jiffies
+	cpus = {}
+	for line in text.splitlines():
+		if line.startswith('cpu') and line[3].isdigit():
+			fields = line.split()
+			values = [int(value) for value in fields[1:9]]
+			total = sum(values)
+			idle = values[3] + values[4]
+			cpus[int(fields[0][3:])] = (total - idle, values[6], total)
+	return cpus
+
+
+def parseSoftirqs(text, names=('NET_RX', 'NET_TX')):
+	# /proc/softirqs -> {name: {cpu: count}}
+	lines = text.splitlines()
+	columns = parseCPUColumns(lines[0])
+	counts = {}
+	for line in lines[1:]:
+		name, values = line.split(':', 1)
+		name = name.strip()
+		if name in names:
+			counts[name] = dict(zip(columns, (int(value) for value in values.split())))
+	return counts
+
+
+def parseInterrupts(text, interfaces):
+	# /proc/interrupts -> {(interface, queue): {cpu: count}} for the IRQs named
+	# after an interface and ending in a queue number, e.g. eth0-TxRx-3
+	lines = text.splitlines()
+	columns = parseCPUColumns(lines[0])
+	counts = {}
+	for line in lines[1:]:
+		fields = line.split()
+		if len(fields) <= len(columns) + 1:
+			continue
+		name = fields[-1]
+		for interface in interfaces:
+			if name.startswith(interface + '-'):
+				digits = len(name) - len(name.rstrip('0123456789'))
+				if digits > 0:
+					key = (interface, int(name[-digits:]))
+					perCPU = counts.setdefault(key, {})
+					for cpu, value in zip(columns, fields[1:len(columns) + 1]):
+						perCPU[cpu] = perCPU.get(cpu, 0) + int(value)
+	return counts
+
+
+class HostTelemetry:
+
+	def __init__(self, interfaces, procPath='/proc', sysPath='/sys/class/net'):
+		self.interfaces = interfaces
+		self.statFile = PreadFile(os.path.join(procPath, 'stat'))
+		self.softirqsFile = PreadFile(os.path.join(procPath, 'softirqs'))
+		self.interruptsFile = openIfExists(os.path.join(procPath, 'interrupts'))
+		# {(interface, queue): {counter: PreadFile}}
+		self.txQueueFiles = {}
+		for interface in interfaces:
+			queuesPath = os.path.join(sysPath, interface, 'queues')
+			if not os.path.isdir(queuesPath):
+				continue
+			for item in os.listdir(queuesPath):
+				if item.startswith('tx-'):
+					files = {}
+					for counter, path in [('inflightBytes', 'byte_queue_limits/inflight'), ('limitBytes', 'byte_queue_limits/limit'), ('timeouts', 'tx_timeout')]:
+						pathFile = openIfExists(os.path.join(queuesPath, item, path))
+						if pathFile != None:
+							files[counter] = pathFile
+					self.txQueueFiles[(interface, int(item[3:]))] = files
+		# {interface: {counter: PreadFile}}
+		self.statisticsFiles = {}
+		for interface in interfaces:
+			files = {}
+			for counter in interfaceCounters:
+				pathFile = openIfExists(os.path.join(sysPath, interface, 'statistics', counter))
+				if pathFile != None:
+					files[counter] = pathFile
+			self.statisticsFiles[interface] = files
+		self.previous = None
+
+	def __readCounters(self):
+		counters = {
+			'stat': parseStat(self.statFile.read()),
+			'softirqs': parseSoftirqs(self.softirqsFile.read()),
+			'interrupts': parseInterrupts(self.interruptsFile.read(), self.interfaces) if self.interruptsFile != None else {},
+		}
+		txQueues = {}
+		for key, files in self.txQueueFiles.items():
+			values = {}
+			for counter, pathFile in files.items():
+				try:
+					values[counter] = int(pathFile.read().split()[0])
+				except (OSError, ValueError, IndexError):
+					pass
+			txQueues[key] = values
+		counters['txQueues'] = txQueues
+		statistics = {}
+		for interface, files in self.statisticsFiles.items():
+			# An interface going down or being removed between samples
+			# only drops that interface from this sample
+			try:
+				statistics[interface] = {counter: int(pathFile.read()) for counter, pathFile in files.items()}
+			except (OSError, ValueError):
+				pass
+		counters['statistics'] = statistics
+		return counters
+
+	def sample(self, now=None):
+		# Returns {'cpus': {cpu: {...}}, 'queues': {(interface, queue): {...}},
+		# 'interfaces': {interface: {...}}} with rates since the last call, or
+		# None on the first call
+		now = time.monotonic() if now == None else now
+		counters = self.__readCounters()
+		previous = self.previous
+		self.previous = (now, counters)
+		if previous == None:
+			return None
+		elapsed = now - previous[0]
+		if elapsed <= 0:
+			return None
+		before = previous[1]
+
+		cpus = {}
+		for cpu, (busy, softirq, total) in counters['stat'].items():
+			if cpu not in before['stat']:
+				continue
+			busyBefore, softirqBefore, totalBefore = before['stat'][cpu]
+			deltaTotal = total - totalBefore
+			entry = {
+				'busyPercent': round(100.0 * (busy - busyBefore) / deltaTotal, 1) if deltaTotal > 0 else 0.0,
+				'softirqPercent': round(100.0 * (softirq - softirqBefore) / deltaTotal, 1) if deltaTotal > 0 else 0.0,
+			}
+			for name, field in [('NET_RX', 'netRxPerSecond'), ('NET_TX', 'netTxPerSecond')]:
+				current = counters['softirqs'].get(name, {}).get(cpu)
+				prior = before['softirqs'].get(name, {}).get(cpu)
+				entry[field] = round((current - prior) / elapsed, 1) if (current != None) and (prior != None) else 0.0
+			cpus[cpu] = entry
+
+		queues = {}
+		for key in sorted(set(counters['txQueues']) | set(counters['interrupts'])):
+			entry = dict(counters['txQueues'].get(key, {}))
+			if 'timeouts' in entry:
+				entry['timeouts'] = entry['timeouts'] - before['txQueues'].get(key, {}).get('timeouts', entry['timeouts'])
+			perCPU = counters['interrupts'].get(key)
+			perCPUBefore = before['interrupts'].get(key)
+			if (perCPU != None) and (perCPUBefore != None):
+				deltas = {cpu: count - perCPUBefore.get(cpu, count) for cpu, count in perCPU.items()}
+				entry['interruptsPerSecond'] = round(sum(deltas.values()) / elapsed, 1)
+				# The CPU taking most of this queue's interrupts, which should
+				# be the CPU LibreQoS.py shapes the queue on
+				busiestCPU = max(deltas, key=deltas.get)
+				entry['interruptCPU'] = busiestCPU if deltas[busiestCPU] > 0 else None
+			queues[key] = entry
+
+		interfaces = {}
+		for interface, values in counters['statistics'].items():
+			interfaces[interface] = {interfaceCounters[counter]: round((value - before['statistics'].get(interface, {}).get(counter, value)) / elapsed, 1) for counter, value in values.items()}
+		return {'cpus': cpus, 'queues': queues, 'interfaces': interfaces}
+
+	def close(self):
+		for pathFile in [self.statFile, self.softirqsFile, self.interruptsFile]:
+			if pathFile != None:
+				pathFile.close()
+		for files in list(self.txQueueFiles.values()) + list(self.statisticsFiles.values()):
+			for pathFile in files.values():
+				pathFile.close()
+
+
+def correlateQueues(queues, hostSample, interfaces):
+	# Adds the host counters of each LibreQoS queue (see cpuLoad.py) as
+	# entry['host']: its CPU's softirq stats, and the NIC queue it is shaped
+	# on for each interface
+	for entry in queues:
+		host = dict(hostSample['cpus'].get(entry['cpu'], {}))
+		for interface in interfaces:
+			nicQueue = hostSample['queues'].get((interface, entry['queue'] - 1))
+			if nicQueue != None:
+				host[interface] = nicQueue
+		entry['host'] = host
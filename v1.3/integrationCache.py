@@ -0,0 +1,226 @@
+# On-disk cache of NMS/CRM responses.
+# Each response is saved under integrationCache/ with a digest of the
+# fields the integration builds the graph from (so counters and "last
+# seen" times that change on every fetch don't count as changes). After
+# an import has written ShapedDevices.csv, the digests of the responses it
+# used, and of its input files (ispConfig.py, ...), are recorded in
+# integrationCache/imports.json. The next import of the same kind is
+# skipped when none of them changed. With findIPv6usingMikrotik on, the
+# routers' IPv4 to IPv6 map counts as one of the responses and
+# mikrotikDHCPRouterList.csv as one of the inputs. A response younger than
+# integrationCacheSeconds is reused without asking the NMS/CRM, and when
+# the NMS/CRM can't be reached, responses up to
+# integrationCacheMaxStaleSeconds old are used instead, so an outage
+# doesn't stop the shapers being refreshed.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def projectFields(payload, fields):
+    # The parts of payload named by fields (dotted paths, e.g.
+    # 'identification.site.id'), applied to each item of a list payload
+    if fields == None:
+        return payload
+    if isinstance(payload, list):
+        return [projectFields(item, fields) for item in payload]
+    projected = {}
+    for field in fields:
+        value = payload
+        for name in field.split('.'):
+            if isinstance(value, list):
+                value = [item.get(name) if isinstance(item, dict) else None for item in value]
+            elif isinstance(value, dict):
+                value = value.get(name)
+            else:
+                value = None
+        projected[field] = value
+    return projected
+
+
+def keepFields(item, fields):
+    # A copy of item with only the parts named by fields (dotted paths, as
+    # for projectFields()), nested as they were, so the integration can use
+    # it in place of item. Lists along a path keep all their items, each
+    # cut down to the rest of the path.
+    if fields == None:
+        return item
+    kept = {}
+    for field in fields:
+        keepPath(item, kept, field.split('.'))
+    return kept
+
+
+def keepPath(value, kept, names):
+    if not isinstance(value, dict) or names[0] not in value:
+        return
+    value = value[names[0]]
+    if (len(names) == 1) or not isinstance(value, (dict, list)):
+        kept[names[0]] = value
+    elif isinstance(value, dict):
+        keepPath(value, kept.setdefault(names[0], {}), names[1:])
+    else:
+        keptItems = kept.setdefault(names[0], [{} if isinstance(item, dict) else item for item in value])
+        for item, keptItem in zip(value, keptItems):
+            keepPath(item, keptItem, names[1:])
+
+
+def payloadDigest(payload, fields=None):
+    return hashlib.sha256(json.dumps(projectFields(payload, fields), sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def fileDigest(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, directory='integrationCache', ttlSeconds=0, maxStaleSeconds=172800):
+        self.directory = directory
+        self.ttlSeconds = ttlSeconds
+        self.maxStaleSeconds = maxStaleSeconds
+        self.lock = threading.Lock()
+        # {key: digest} of the responses used since startImport()
+        self.used = {}
+        self.staleKeys = []
+
+    def __path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def __load(self, key):
+        with open(self.__path(key), 'r') as j:
+            return json.loads(j.read())
+
+    def startImport(self):
+        with self.lock:
+            self.used = {}
+            self.staleKeys = []
+
+    def get(self, key, fetch, fields=None, now=None):
+        # Returns the response for key: the cached one if it is younger
+        # than ttlSeconds, otherwise fetch()'s, falling back to a cached
+        # one up to maxStaleSeconds old if fetch() raises
+        now = time.time() if now == None else now
+        path = self.__path(key)
+        age = (now - os.stat(path).st_mtime) if os.path.isfile(path) else None
+        if (age != None) and (age < self.ttlSeconds):
+            entry = self.__load(key)
+        else:
+            try:
+                payload = fetch()
+            except Exception as e:
+                if (age == None) or (age > self.maxStaleSeconds):
+                    raise
+                print("Couldn't fetch " + key + " (" + str(e) + "), using the response from " + str(round(age / 60)) + " minutes ago")
+                entry = self.__load(key)
+                with self.lock:
+                    self.staleKeys.append(key)
+            else:
+                entry = {'key': key, 'digest': payloadDigest(payload, fields), 'payload': payload}
+                os.makedirs(self.directory, exist_ok=True)
+                temporaryPath = path + '.tmp.' + str(threading.get_ident())
+                with open(temporaryPath, 'w') as f:
+                    f.write(json.dumps(entry))
+                os.replace(temporaryPath, path)
+                os.utime(path, (now, now))
+        with self.lock:
+            self.used[key] = entry['digest']
+        return entry['payload']
+
+    def __importsPath(self):
+        return os.path.join(self.directory, 'imports.json')
+
+    def __loadImports(self):
+        if not os.path.isfile(self.__importsPath()):
+            return {}
+        with open(self.__importsPath(), 'r') as j:
+            return json.loads(j.read())
+
+    def unchangedSinceImport(self, name, inputs=(), outputs=('ShapedDevices.csv', 'network.json')):
+        # True if the responses used since startImport(), ispConfig.py and
+        # the inputs are the same as when the last import called name
+        # finished, and its outputs are still there. Deleting network.json
+        # is how it's asked to be rebuilt.
+        record = self.__loadImports().get(name)
+        if record == None:
+            return False
+        for path in outputs:
+            if not os.path.isfile(path):
+                return False
+        with self.lock:
+            used = dict(self.used)
+        return (record['responses'] == used) and (record['inputs'] == {path: fileDigest(path) for path in ('ispConfig.py',) + tuple(inputs)})
+
+    def markImported(self, name, inputs=()):
+        # Records the import called name as done, with the responses it
+        # used and its inputs as they are now
+        imports = self.__loadImports()
+        with self.lock:
+            imports[name] = {'responses': dict(self.used), 'inputs': {path: fileDigest(path) for path in ('ispConfig.py',) + tuple(inputs)}}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.__importsPath(), 'w') as f:
+            f.write(json.dumps(imports))
+
+
+sharedCache = None
+sharedCacheLock = threading.Lock()
+
+
+def integrationCache():
+    # The process wide cache, configured from ispConfig.py, or None if
+    # integrationCacheEnabled is off
+    global sharedCache
+    from ispConfig import integrationCacheEnabled, integrationCacheSeconds, integrationCacheMaxStaleSeconds
+    if not integrationCacheEnabled:
+        return None
+    with sharedCacheLock:
+        if sharedCache == None:
+            sharedCache = ResponseCache(ttlSeconds=integrationCacheSeconds, maxStaleSeconds=integrationCacheMaxStaleSeconds)
+        return sharedCache
+
+
+def cachedFetch(key, fetch, fields=None):
+    cache = integrationCache()
+    if cache == None:
+        return fetch()
+    return cache.get(key, fetch, fields)
+
+
+def startImport():
+    cache = integrationCache()
+    if cache != None:
+        cache.startImport()
+
+
+def mikrotikIPv6():
+    # {IPv4: IPv6} from the routers in mikrotikDHCPRouterList.csv, which
+    # NetworkGraph() adds to each device, as a response of the import
+    from mikrotikFindIPv6 import pullMikrotikIPv6
+    return cachedFetch('mikrotikIPv6', pullMikrotikIPv6)
+
+
+def mikrotikInputs():
+    from ispConfig import findIPv6usingMikrotik
+    return ('mikrotikDHCPRouterList.csv',) if findIPv6usingMikrotik else ()
+
+
+def unchangedSinceImport(name, inputs=()):
+    cache = integrationCache()
+    if cache == None:
+        return False
+    if len(mikrotikInputs()) > 0:
+        # Pulled before NetworkGraph() would, so a changed map isn't skipped
+        mikrotikIPv6()
+    return cache.unchangedSinceImport(name, tuple(inputs) + mikrotikInputs())
+
+
+def markImported(name, inputs=()):
+    cache = integrationCache()
+    if cache != None:
+        cache.markImported(name, tuple(inputs) + mikrotikInputs())
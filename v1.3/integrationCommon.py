@@ -5,28 +5,81 @@ from typing import List, Any
 from ispConfig import allowedSubnets, ignoreSubnets, generatedPNUploadMbps, generatedPNDownloadMbps
 import ipaddress
 import enum
+import bisect
+import functools
+import csv
+import hashlib
+import io
+import json
+import os
+
+
+@functools.lru_cache(maxsize=65536)
+def parseAddress(inputIP):
+    # "100.64.1.1" or "100.64.1.1/24" -> (IP version, address as an integer).
+    # Raises ValueError like ipaddress.ip_address() if it isn't an address.
+    if '/' in inputIP:
+        inputIP = inputIP.split('/')[0]
+    address = ipaddress.ip_address(inputIP)
+    return (address.version, int(address))
+
+
+class SubnetClassifier:
+    # Answers "is this IP in any of these subnets?" from sorted, merged
+    # integer intervals per IP version, built once, with a binary search
+    # per address
+
+    def __init__(self, subnets: List) -> None:
+        # Raises ValueError for a subnet with host bits set, as
+        # ipaddress.ip_network() does
+        self.empty = len(subnets) == 0
+        intervals = {4: [], 6: []}
+        for subnet in subnets:
+            network = ipaddress.ip_network(subnet)
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self.starts = {}
+        self.ends = {}
+        for version in intervals:
+            starts = []
+            ends = []
+            for start, end in sorted(intervals[version]):
+                if len(ends) > 0 and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[version] = starts
+            self.ends[version] = ends
+
+    def containsParsed(self, version: int, address: int) -> bool:
+        i = bisect.bisect_right(self.starts[version], address) - 1
+        return i >= 0 and address <= self.ends[version][i]
+
+    def contains(self, inputIP: str) -> bool:
+        # With no subnets, inputIP isn't even parsed
+        if self.empty:
+            return False
+        return self.containsParsed(*parseAddress(inputIP))
+
+    def containsAll(self, inputIPs: List) -> List:
+        # contains() for a whole list of addresses
+        return [self.contains(inputIP) for inputIP in inputIPs]
+
+
+@functools.lru_cache(maxsize=None)
+def subnetClassifiers():
+    # (allowedSubnets, ignoreSubnets) classifiers, built on first use
+    return (SubnetClassifier(allowedSubnets), SubnetClassifier(ignoreSubnets))
 
 
 def isInAllowedSubnets(inputIP):
     # Check whether an IP address occurs inside the allowedSubnets list
-    isAllowed = False
-    if '/' in inputIP:
-        inputIP = inputIP.split('/')[0]
-    for subnet in allowedSubnets:
-        if (ipaddress.ip_address(inputIP) in ipaddress.ip_network(subnet)):
-            isAllowed = True
-    return isAllowed
+    return subnetClassifiers()[0].contains(inputIP)
 
 
 def isInIgnoredSubnets(inputIP):
     # Check whether an IP address occurs within the ignoreSubnets list
-    isIgnored = False
-    if '/' in inputIP:
-        inputIP = inputIP.split('/')[0]
-    for subnet in ignoreSubnets:
-        if (ipaddress.ip_address(inputIP) in ipaddress.ip_network(subnet)):
-            isIgnored = True
-    return isIgnored
+    return subnetClassifiers()[1].contains(inputIP)
 
 
 def isIpv4Permitted(inputIP):
@@ -34,7 +87,14 @@ def isIpv4Permitted(inputIP):
     # If it is, check that it isn't in Ignored Subnets.
     # If it is allowed and not ignored, returns true.
     # Otherwise, returns false.
-    return isInIgnoredSubnets(inputIP) == False and isInAllowedSubnets(inputIP)
+    allowed, ignored = subnetClassifiers()
+    return ignored.contains(inputIP) == False and allowed.contains(inputIP)
+
+
+def permittedAddresses(inputIPs):
+    # isIpv4Permitted() for a whole list of addresses
+    allowed, ignored = subnetClassifiers()
+    return [ignored.contains(inputIP) == False and allowed.contains(inputIP) for inputIP in inputIPs]
 
 
 def fixSubnet(inputIP):
@@ -53,6 +113,82 @@ def fixSubnet(inputIP):
             return rawIp + "/32"
     return inputIP
 
+
+def contentDigest(content):
+    if content == None:
+        return None
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def readIfExists(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', newline='') as f:
+        return f.read()
+
+
+def writeIfChanged(path, content):
+    # Writes content to path unless it already holds exactly that, through
+    # a temporary file renamed over path, so LibreQoS.py never reads a half
+    # written file. Returns True if path was written.
+    if readIfExists(path) == content:
+        return False
+    temporaryPath = path + '.tmp.' + str(os.getpid())
+    with open(temporaryPath, 'w', newline='') as f:
+        f.write(content)
+    os.replace(temporaryPath, path)
+    return True
+
+
+def rowsByCircuit(content):
+    # {Circuit ID: [row without the Circuit ID, ...]} from the contents of
+    # a ShapedDevices.csv
+    circuits = {}
+    if content == None:
+        return circuits
+    reader = csv.reader(io.StringIO(content, newline=''))
+    next(reader, None)
+    for row in reader:
+        if len(row) > 0:
+            circuits.setdefault(row[0], []).append(row[1:])
+    return circuits
+
+
+def shapedDevicesChanges(oldContent, newContent):
+    # The circuits added, removed and modified between two versions of
+    # ShapedDevices.csv, keyed by Circuit ID like the partial reload in
+    # LibreQoS.py. "from" and "to" are digests of the two versions.
+    oldCircuits = rowsByCircuit(oldContent)
+    newCircuits = rowsByCircuit(newContent)
+    return {
+        "from": contentDigest(oldContent),
+        "to": contentDigest(newContent),
+        "added": [circuitID for circuitID in newCircuits if circuitID not in oldCircuits],
+        "removed": [circuitID for circuitID in oldCircuits if circuitID not in newCircuits],
+        "modified": [circuitID for circuitID in newCircuits if (circuitID in oldCircuits) and (oldCircuits[circuitID] != newCircuits[circuitID])],
+    }
+
+
+def loadShapedDevicesChanges(fromPath, toPath, changesPath='ShapedDevices.changes.json'):
+    # The change summary written by the last import, if it describes
+    # exactly the change from fromPath to toPath, otherwise None (e.g. when
+    # more than one import ran since fromPath was loaded, or the file was
+    # edited by hand)
+    fromDigest = contentDigest(readIfExists(fromPath))
+    toDigest = contentDigest(readIfExists(toPath))
+    if (fromDigest != None) and (fromDigest == toDigest):
+        return {"from": fromDigest, "to": toDigest, "added": [], "removed": [], "modified": []}
+    if not os.path.isfile(changesPath):
+        return None
+    try:
+        with open(changesPath, 'r') as j:
+            changes = json.loads(j.read())
+    except ValueError:
+        return None
+    if (changes.get("from") != fromDigest) or (changes.get("to") != toDigest):
+        return None
+    return changes
+
 class NodeType(enum.IntEnum):
     # Enumeration to define what type of node
     # a NetworkNode is.
@@ -83,14 +219,20 @@ class NetworkNode:
     mac: str
 
     def __init__(self, id: str, displayName: str = "", parentId: str = "", type: NodeType = NodeType.site, download: int = generatedPNDownloadMbps, upload: int = generatedPNUploadMbps, ipv4: List = [], ipv6: List = [], address: str = "", mac: str = "") -> None:
-        self.id = id
+        # The graph holding this node, and its index there, so that
+        # changes to id, displayName and parentIndex can update the
+        # graph's lookup indexes
+        self._graph = None
+        self._index = 0
+        self._id = id
+        self._parentIndex = 0
         self.parentIndex = 0
         self.type = type
         self.parentId = parentId
         if displayName == "":
-            self.displayName = id
+            self._displayName = id
         else:
-            self.displayName = displayName
+            self._displayName = displayName
         self.downloadMbps = download
         self.uploadMbps = upload
         self.ipv4 = ipv4
@@ -98,6 +240,36 @@ class NetworkNode:
         self.address = address
         self.mac = mac
 
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @id.setter
+    def id(self, id: str) -> None:
+        if self._graph != None:
+            self._graph._moveInIndex('id', self._id, id, self._index)
+        self._id = id
+
+    @property
+    def displayName(self) -> str:
+        return self._displayName
+
+    @displayName.setter
+    def displayName(self, displayName: str) -> None:
+        if self._graph != None:
+            self._graph._moveInIndex('name', self._displayName, displayName, self._index)
+        self._displayName = displayName
+
+    @property
+    def parentIndex(self) -> int:
+        return self._parentIndex
+
+    @parentIndex.setter
+    def parentIndex(self, parentIndex: int) -> None:
+        if self._graph != None:
+            self._graph._moveInIndex('parent', self._parentIndex, parentIndex, self._index)
+        self._parentIndex = parentIndex
+
 
 class NetworkGraph:
     # Defines a network as a graph topology
@@ -117,11 +289,17 @@ class NetworkGraph:
             NetworkNode("FakeRoot", type=NodeType.root,
                         parentId="", displayName="Shaper Root")
         ]
+        # Lookup indexes, kept current as nodes are added, renamed
+        # and reparented: id -> {indices}, displayName -> {indices}
+        # and parentIndex -> {child indices}
+        self.__indexes = {'id': {}, 'name': {}, 'parent': {}}
+        self.__indexedNodes = 0
+        self.__syncIndexes()
         self.excludeSites = excludeSites
         self.exceptionCPEs = exceptionCPEs
         if findIPv6usingMikrotik:
-            from mikrotikFindIPv6 import pullMikrotikIPv6  
-            self.ipv4ToIPv6 = pullMikrotikIPv6()
+            from integrationCache import mikrotikIPv6
+            self.ipv4ToIPv6 = mikrotikIPv6()
         else:
             self.ipv4ToIPv6 = {}
 
@@ -133,13 +311,17 @@ class NetworkGraph:
             if node.displayName in self.exceptionCPEs.keys():
                 node.parentId = self.exceptionCPEs[node.displayName]
             self.nodes.append(node)
+            self.__syncIndexes()
 
     def replaceRootNote(self, node: NetworkNode) -> None:
         # Replaces the automatically generated root node
         # with a new node. Useful when you have a top-level
         # node specified (e.g. "uispSite" in the UISP
         # integration)
+        self.__syncIndexes()
+        self.__detach(0, self.nodes[0])
         self.nodes[0] = node
+        self.__attach(0, node)
 
     def addNodeAsChild(self, parent: str, node: NetworkNode) -> None:
         # Searches the existing graph for a named parent,
@@ -150,48 +332,80 @@ class NetworkGraph:
         # specifying the parent - we're assuming you really
         # meant it.
         if node.displayName in self.excludeSites: return
-        parentIdx = 0
-        for (i, node) in enumerate(self.nodes):
-            if node.id == parent:
-                parentIdx = i
-        node.parentIndex = parentIdx
+        self.__syncIndexes()
+        parentIndices = self.__indexes['id'].get(parent)
+        node.parentIndex = max(parentIndices) if parentIndices else 0
         self.nodes.append(node)
+        self.__syncIndexes()
+
+    def __syncIndexes(self) -> None:
+        # Indexes nodes appended to self.nodes since the last call.
+        # Everything is reindexed if nodes were removed.
+        if len(self.nodes) < self.__indexedNodes:
+            for node in self.nodes:
+                node._graph = None
+            self.__indexes = {'id': {}, 'name': {}, 'parent': {}}
+            self.__indexedNodes = 0
+        for i in range(self.__indexedNodes, len(self.nodes)):
+            self.__attach(i, self.nodes[i])
+        self.__indexedNodes = len(self.nodes)
+
+    def __attach(self, i: int, node: NetworkNode) -> None:
+        node._graph = self
+        node._index = i
+        self.__indexes['id'].setdefault(node.id, set()).add(i)
+        self.__indexes['name'].setdefault(node.displayName, set()).add(i)
+        self.__indexes['parent'].setdefault(node.parentIndex, set()).add(i)
+
+    def __detach(self, i: int, node: NetworkNode) -> None:
+        for indexName, key in [('id', node.id), ('name', node.displayName), ('parent', node.parentIndex)]:
+            self._moveInIndex(indexName, key, None, i)
+        node._graph = None
+
+    def _moveInIndex(self, indexName: str, oldKey: Any, newKey: Any, i: int) -> None:
+        # Called by NetworkNode when an indexed field of node i
+        # changes. A newKey of None only removes the old entry.
+        index = self.__indexes[indexName]
+        indices = index[oldKey]
+        indices.discard(i)
+        if len(indices) == 0:
+            del index[oldKey]
+        if newKey != None:
+            index.setdefault(newKey, set()).add(i)
 
     def __reparentById(self) -> None:
         # Scans the entire node tree, searching for parents
         # by name. Entries are re-mapped to match the named
         # parents. You can use this to build a tree from a
         # blob of raw data.
+        self.__syncIndexes()
+        indexById = self.__indexes['id']
         for child in self.nodes:
             if child.parentId != "":
-                for (i, node) in enumerate(self.nodes):
-                    if node.id == child.parentId:
-                        child.parentIndex = i
+                parentIndices = indexById.get(child.parentId)
+                if parentIndices:
+                    # The last node with that id, as a scan would find
+                    child.parentIndex = max(parentIndices)
 
     def findNodeIndexById(self, id: str) -> int:
         # Finds a single node by identity(id)
         # Return -1 if not found
-        for (i, node) in enumerate(self.nodes):
-            if node.id == id:
-                return i
-        return -1
+        self.__syncIndexes()
+        indices = self.__indexes['id'].get(id)
+        return min(indices) if indices else -1
 
     def findNodeIndexByName(self, name: str) -> int:
         # Finds a single node by identity(name)
         # Return -1 if not found
-        for (i, node) in enumerate(self.nodes):
-            if node.displayName == name:
-                return i
-        return -1
+        self.__syncIndexes()
+        indices = self.__indexes['name'].get(name)
+        return min(indices) if indices else -1
 
     def findChildIndices(self, parentIndex: int) -> List:
         # Returns the indices of all nodes with a
         # parentIndex equal to the specified parameter
-        result = []
-        for (i, node) in enumerate(self.nodes):
-            if node.parentIndex == parentIndex:
-                result.append(i)
-        return result
+        self.__syncIndexes()
+        return sorted(self.__indexes['parent'].get(parentIndex, ()))
 
     def __promoteClientsWithChildren(self) -> None:
         # Searches for client sites that have children,
@@ -225,40 +439,50 @@ class NetworkGraph:
 
         self.__reparentById()
 
+    def __markReachable(self, reachable: bytearray, starts: List) -> None:
+        # Marks every node under the start nodes in the reachable
+        # bitmap (one byte per node index), skipping nodes that
+        # are already marked
+        next = [i for i in starts if not reachable[i]]
+        for i in next:
+            reachable[i] = 1
+        childIndices = self.__indexes['parent']
+        while len(next) > 0:
+            for idx in childIndices.get(next.pop(), ()):
+                if not reachable[idx]:
+                    reachable[idx] = 1
+                    next.append(idx)
+
     def __findUnconnectedNodes(self) -> List:
         # Performs a tree-traversal and finds any nodes that
         # aren't connected to the root. This is a "sanity check",
         # and also an easy way to handle "flat" topologies and
         # ensure that the unconnected nodes are re-connected to
         # the root.
-        visited = []
-        next = [0]
-
-        while len(next) > 0:
-            nextTraversal = next.pop()
-            visited.append(nextTraversal)
-            for idx in self.findChildIndices(nextTraversal):
-                if idx not in visited:
-                    next.append(idx)
+        self.__syncIndexes()
+        reachable = bytearray(len(self.nodes))
+        self.__markReachable(reachable, [0])
+        return [i for i in range(len(self.nodes)) if not reachable[i]]
 
-        result = []
-        for i, n in enumerate(self.nodes):
-            if i not in visited:
-                result.append(i)
-        return result
-
-    def __reconnectUnconnected(self):
+    def __reconnectUnconnected(self) -> List:
         # Finds any unconnected nodes and reconnects
-        # them to the root
-        for idx in self.__findUnconnectedNodes():
-            if self.nodes[idx].type == NodeType.site:
-                self.nodes[idx].parentIndex = 0
-        for idx in self.__findUnconnectedNodes():
-            if self.nodes[idx].type == NodeType.clientWithChildren:
-                self.nodes[idx].parentIndex = 0
-        for idx in self.__findUnconnectedNodes():
-            if self.nodes[idx].type == NodeType.client:
+        # them to the root: sites first, then clients with
+        # children, then clients, each type only if it is still
+        # unconnected after the previous ones. Reachability is
+        # worked out once, and extended from each reattached node.
+        # Returns the indices of the reattached nodes.
+        self.__syncIndexes()
+        reachable = bytearray(len(self.nodes))
+        self.__markReachable(reachable, [0])
+        unconnected = [i for i in range(len(self.nodes)) if not reachable[i]]
+        reattached = []
+        for nodeType in [NodeType.site, NodeType.clientWithChildren, NodeType.client]:
+            toAttach = [i for i in unconnected if not reachable[i] and self.nodes[i].type == nodeType]
+            for idx in toAttach:
                 self.nodes[idx].parentIndex = 0
+            self.__markReachable(reachable, toAttach)
+            reattached.extend(toAttach)
+        return reattached
 
     def prepareTree(self) -> None:
         # Helper function that calls all the cleanup and mapping
@@ -268,7 +492,12 @@ class NetworkGraph:
         self.__reparentById()
         self.__promoteClientsWithChildren()
         self.__clientsWithChildrenToSites()
-        self.__reconnectUnconnected()
+        reattached = self.__reconnectUnconnected()
+        if len(reattached) > 0:
+            counts = {}
+            for idx in reattached:
+                counts[self.nodes[idx].type.name] = counts.get(self.nodes[idx].type.name, 0) + 1
+            print("Reattached nodes that weren't connected to the root: " + ", ".join(nodeType + " " + str(count) for nodeType, count in counts.items()))
 
     def doesNetworkJsonExist(self):
         # Returns true if "network.json" exists, false otherwise
@@ -279,9 +508,8 @@ class NetworkGraph:
         return self.nodes[index].type == NodeType.ap or self.nodes[index].type == NodeType.site or self.nodes[index].type == NodeType.clientWithChildren
 
     def createNetworkJson(self):
-        import json
         topLevelNode = {}
-        self.__visited = []  # Protection against loops - never visit twice
+        self.__visited = set()  # Protection against loops - never visit twice
 
         for child in self.findChildIndices(0):
             if child > 0 and self.__isSite(child):
@@ -290,13 +518,13 @@ class NetworkGraph:
 
         del self.__visited
 
-        with open('network.json', 'w') as f:
-            json.dump(topLevelNode, f, indent=4)
+        if not writeIfChanged('network.json', json.dumps(topLevelNode, indent=4)):
+            print("network.json is unchanged")
 
     def __buildNetworkObject(self, idx):
         # Private: used to recurse down the network tree while building
         # network.json
-        self.__visited.append(idx)
+        self.__visited.add(idx)
         node = {
             "downloadBandwidthMbps": self.nodes[idx].downloadMbps,
             "uploadBandwidthMbps": self.nodes[idx].uploadMbps,
@@ -326,7 +554,6 @@ class NetworkGraph:
                 ipv6.append(self.ipv4ToIPv6[ip])
 
     def createShapedDevices(self):
-            import csv
             from ispConfig import bandwidthOverheadFactor
         # Builds ShapedDevices.csv from the network tree.
             circuits = []
@@ -360,31 +587,44 @@ class NetworkGraph:
                         circuits.append(circuit)
                         nextId += 1
 
-            with open('ShapedDevices.csv', 'w', newline='') as csvfile:
-                wr = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-                wr.writerow(['Circuit ID', 'Circuit Name', 'Device ID', 'Device Name', 'Parent Node', 'MAC',
-                             'IPv4', 'IPv6', 'Download Min', 'Upload Min', 'Download Max', 'Upload Max', 'Comment'])
-                for circuit in circuits:
-                    for device in circuit["devices"]:
-                        #Remove brackets and quotes of list so LibreQoS.py can parse it
-                        device["ipv4"] = str(device["ipv4"]).replace('[','').replace(']','').replace("'",'')
-                        device["ipv6"] = str(device["ipv6"]).replace('[','').replace(']','').replace("'",'')
-                        row = [
-                            circuit["id"],
-                            circuit["name"],
-                            device["id"],
-                            device["name"],
-                            circuit["parent"],
-                            device["mac"],
-                            device["ipv4"],
-                            device["ipv6"],
-                            int(circuit["download"] * 0.98),
-                            int(circuit["upload"] * 0.98),
-                            int(circuit["download"] * bandwidthOverheadFactor),
-                            int(circuit["upload"] * bandwidthOverheadFactor),
-                            ""
-                        ]
-                        wr.writerow(row)
+            csvfile = io.StringIO(newline='')
+            wr = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+            wr.writerow(['Circuit ID', 'Circuit Name', 'Device ID', 'Device Name', 'Parent Node', 'MAC',
+                         'IPv4', 'IPv6', 'Download Min', 'Upload Min', 'Download Max', 'Upload Max', 'Comment'])
+            for circuit in circuits:
+                for device in circuit["devices"]:
+                    #Remove brackets and quotes of list so LibreQoS.py can parse it
+                    device["ipv4"] = str(device["ipv4"]).replace('[','').replace(']','').replace("'",'')
+                    device["ipv6"] = str(device["ipv6"]).replace('[','').replace(']','').replace("'",'')
+                    row = [
+                        circuit["id"],
+                        circuit["name"],
+                        device["id"],
+                        device["name"],
+                        circuit["parent"],
+                        device["mac"],
+                        device["ipv4"],
+                        device["ipv6"],
+                        int(circuit["download"] * 0.98),
+                        int(circuit["upload"] * 0.98),
+                        int(circuit["download"] * bandwidthOverheadFactor),
+                        int(circuit["upload"] * bandwidthOverheadFactor),
+                        ""
+                    ]
+                    wr.writerow(row)
+
+            # ShapedDevices.csv is only rewritten when it changed, together
+            # with ShapedDevices.changes.json, which lists the circuits the
+            # partial reload in LibreQoS.py has to touch
+            content = csvfile.getvalue()
+            previousContent = readIfExists('ShapedDevices.csv')
+            if previousContent == content:
+                print("ShapedDevices.csv is unchanged")
+                return
+            changes = shapedDevicesChanges(previousContent, content)
+            writeIfChanged('ShapedDevices.changes.json', json.dumps(changes, indent=4))
+            writeIfChanged('ShapedDevices.csv', content)
+            print("ShapedDevices.csv: " + str(len(changes["added"])) + " circuits added, " + str(len(changes["removed"])) + " removed, " + str(len(changes["modified"])) + " modified")
 
     def plotNetworkGraph(self, showClients=False):
         # Requires `pip install graphviz` to function.
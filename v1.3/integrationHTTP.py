@@ -0,0 +1,176 @@
+# Shared HTTP client for the NMS/CRM integrations.
+# One requests.Session per process keeps connections to the NMS/CRM alive
+# and pooled, asks for gzip, puts a timeout on every request, and retries
+# connection errors, timeouts, 429 and 5xx responses with exponential
+# backoff (or the server's Retry-After, up to maxRetryAfterSeconds, so a
+# server asking for an hour doesn't hold up the reload). fetchInParallel() runs independent
+# fetches on a small thread pool sharing the session, e.g.
+#   sites, devices = fetchInParallel([lambda: uispRequest("sites"), lambda: uispRequest("devices")])
+# getJsonItems() decodes a JSON array response item by item as it arrives,
+# so a large export can be cut down to the fields an integration needs
+# without ever holding all of it in memory.
+
+import codecs
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses that are worth trying again
+retryStatusCodes = {429, 500, 502, 503, 504}
+
+
+class IntegrationHTTPClient:
+
+    def __init__(self, timeoutSeconds=30.0, retries=3, backoffSeconds=1.0, poolSize=8, maxRetryAfterSeconds=None):
+        self.timeoutSeconds = timeoutSeconds
+        self.retries = retries
+        self.backoffSeconds = backoffSeconds
+        # Longest Retry-After honoured, four timeouts unless given
+        self.maxRetryAfterSeconds = maxRetryAfterSeconds if maxRetryAfterSeconds != None else 4 * timeoutSeconds
+        self.poolSize = poolSize
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.lock = threading.Lock()
+        self.requestCount = 0
+        self.retryCount = 0
+
+    def getJson(self, url, headers=None, params=None):
+        # GETs url and returns the decoded JSON body. Raises the last
+        # error once the retries are used up.
+        return self.__get(url, headers, params, False, lambda r: r.json())
+
+    def getJsonItems(self, url, headers=None, params=None, keep=None):
+        # Like getJson() for a JSON array body, but the array is decoded
+        # one item at a time while it is downloaded, and only keep(item)
+        # is held on to
+        def read(r):
+            items = jsonArrayItems(r.iter_content(chunk_size=65536))
+            if keep == None:
+                return list(items)
+            return [keep(item) for item in items]
+        return self.__get(url, headers, params, True, read)
+
+    def __get(self, url, headers, params, stream, read):
+        for attempt in range(self.retries + 1):
+            delay = self.backoffSeconds * (2 ** attempt)
+            try:
+                with self.lock:
+                    self.requestCount += 1
+                with self.session.get(url, headers=headers, params=params, timeout=self.timeoutSeconds, stream=stream) as r:
+                    if r.status_code not in retryStatusCodes:
+                        r.raise_for_status()
+                        return read(r)
+                    retryAfter = r.headers.get('Retry-After', '')
+                    if retryAfter.isdigit():
+                        delay = float(retryAfter)
+                        if delay > self.maxRetryAfterSeconds:
+                            print(url + " asked to retry after " + retryAfter + " seconds, retrying after " + str(self.maxRetryAfterSeconds))
+                            delay = self.maxRetryAfterSeconds
+                    error = requests.HTTPError(str(r.status_code) + " from " + url, response=r)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+            if attempt < self.retries:
+                with self.lock:
+                    self.retryCount += 1
+                time.sleep(delay)
+        raise error
+
+    def fetchInParallel(self, functions, maxWorkers=None):
+        # Calls each function (taking no arguments) on the pool and
+        # returns their results in the same order. The first exception
+        # raised is re-raised.
+        if len(functions) == 0:
+            return []
+        workers = min(len(functions), maxWorkers if maxWorkers != None else self.poolSize)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda function: function(), functions))
+
+    def close(self):
+        self.session.close()
+
+
+def jsonArrayItems(chunks):
+    # Yields the items of a JSON array from an iterable of (UTF-8) byte
+    # chunks, decoding each item as soon as all of it has arrived. Raises
+    # ValueError if the body isn't a JSON array.
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    # 'start': before '[', 'first': before the first item or ']', 'item':
+    # before an item, 'next': before ',' or ']', 'end': after ']'
+    state = 'start'
+    finished = False
+    chunks = iter(chunks)
+    while not finished:
+        chunk = next(chunks, None)
+        if chunk == None:
+            finished = True
+            buffer = buffer[position:] + utf8.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + utf8.decode(chunk)
+        position = 0
+        while True:
+            while (position < len(buffer)) and buffer[position].isspace():
+                position += 1
+            if position == len(buffer):
+                break
+            if state == 'start':
+                if buffer[position] != '[':
+                    raise ValueError("Expected a JSON array, got " + repr(buffer[position:position + 20]))
+                position += 1
+                state = 'first'
+            elif state == 'next':
+                if buffer[position] == ',':
+                    position += 1
+                    state = 'item'
+                elif buffer[position] == ']':
+                    position += 1
+                    state = 'end'
+                else:
+                    raise ValueError("Expected ',' or ']' in JSON array at " + repr(buffer[position:position + 20]))
+            elif state in ('first', 'item'):
+                if (state == 'first') and (buffer[position] == ']'):
+                    position += 1
+                    state = 'end'
+                    continue # Nothing to decode
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if finished:
+                        raise
+                    break # The item hasn't all arrived yet
+                if ((end == len(buffer)) or (buffer[end] not in ' \t\r\n,]')) and not finished:
+                    break # A number could still be going on
+                position = end
+                state = 'next'
+                yield item
+            else:
+                raise ValueError("Unexpected data after JSON array: " + repr(buffer[position:position + 20]))
+    if state != 'end':
+        raise ValueError("JSON array ended early")
+
+
+sharedClient = None
+sharedClientLock = threading.Lock()
+
+
+def integrationClient():
+    # The process wide client, configured from ispConfig.py
+    global sharedClient
+    with sharedClientLock:
+        if sharedClient == None:
+            from ispConfig import integrationHTTPTimeoutSeconds, integrationHTTPRetries
+            sharedClient = IntegrationHTTPClient(timeoutSeconds=integrationHTTPTimeoutSeconds, retries=integrationHTTPRetries)
+        return sharedClient
+
+
+def fetchInParallel(functions, maxWorkers=None):
+    return integrationClient().fetchInParallel(functions, maxWorkers)
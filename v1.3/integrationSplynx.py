@@ -1,8 +1,9 @@
-import requests
 from ispConfig import excludeSites, findIPv6usingMikrotik, bandwidthOverheadFactor, exceptionCPEs, splynx_api_key, splynx_api_secret, splynx_api_url
 from integrationCommon import isIpv4Permitted
+from integrationHTTP import integrationClient, fetchInParallel
+from integrationCache import cachedFetch, startImport, unchangedSinceImport, markImported, keepFields
 import base64
-from requests.auth import HTTPBasicAuth
+import time
 if findIPv6usingMikrotik == True:
 	from mikrotikFindIPv6 import pullMikrotikIPv6  
 from integrationCommon import NetworkGraph, NetworkNode, NodeType
@@ -12,12 +13,22 @@ def buildHeaders():
 	credentials = base64.b64encode(credentials.encode()).decode()
 	return {'Authorization' : "Basic %s" % credentials}
 
+# The fields of each Splynx response that the graph is built from. Only
+# these are kept from each item as the response is downloaded, and only
+# changes to them make the next import rebuild the graph.
+splynxGraphFields = {
+	"admin/tariffs/internet": ['id', 'speed_download', 'speed_upload'],
+	"admin/customers/customer": ['id', 'name', 'street_1', 'city', 'zip_code'],
+	"admin/networking/routers": ['id', 'ip'],
+	"internet-services": ['id', 'customer_id', 'tariff_id', 'router_id', 'taking_ipv4', 'ipv4', 'taking_ipv6', 'ipv6', 'mac', 'description'],
+}
+
 def spylnxRequest(target, headers):
 	# Sends a REST GET request to Spylnx and returns the
 	# result in JSON
 	url = splynx_api_url + "/api/2.0/" + target
-	r = requests.get(url, headers=headers)
-	return r.json()
+	fields = splynxGraphFields["internet-services"] if target.endswith("/internet-services") else splynxGraphFields.get(target)
+	return cachedFetch("splynx/" + target, lambda: integrationClient().getJsonItems(url, headers=headers, keep=lambda item: keepFields(item, fields)), fields)
 
 def getTariffs(headers):
 	data = spylnxRequest("admin/tariffs/internet", headers)
@@ -57,20 +68,38 @@ def combineAddress(json):
 	else:
 		return json["street_1"] + " " + json["city"] + " " + json["zip_code"]
 
-def createShaper():
-	net = NetworkGraph()
+def getServicesByCustomer(headers, customers):
+	# Returns {customer id: [internet services]}. Every customer's
+	# services are listed in one request (customer 0 stands for all
+	# customers). If that fails, each customer's services are fetched on
+	# their own, splynxMaxConcurrentRequests at a time.
+	from ispConfig import splynxMaxConcurrentRequests
+	servicesByCustomer = {str(customerJson["id"]): [] for customerJson in customers}
+	try:
+		services = spylnxRequest("admin/customers/customer/0/internet-services", headers)
+	except Exception:
+		services = None
+	if isinstance(services, list):
+		for serviceJson in services:
+			customerID = str(serviceJson["customer_id"])
+			if customerID in servicesByCustomer:
+				servicesByCustomer[customerID].append(serviceJson)
+		return servicesByCustomer
+	print("Listing all internet services failed, fetching them per customer")
+	perCustomer = fetchInParallel([
+		lambda customerID=customerID: spylnxRequest("admin/customers/customer/" + customerID + "/internet-services", headers)
+		for customerID in servicesByCustomer
+	], splynxMaxConcurrentRequests)
+	return dict(zip(servicesByCustomer, perCustomer))
 
-	print("Fetching data from Spylnx")
-	headers = buildHeaders()
-	tariff, downloadForTariffID, uploadForTariffID = getTariffs(headers)
-	customers = getCustomers(headers)
-	ipForRouter = getRouters(headers)
+def graphFromSplynx(customers, servicesByCustomer, downloadForTariffID, uploadForTariffID, ipForRouter):
+	net = NetworkGraph()
 
 	# It's not very clear how a service is meant to handle multiple
 	# devices on a shared tariff. Creating each service as a combined
 	# entity including the customer, to be on the safe side.
 	for customerJson in customers:
-		services = spylnxRequest("admin/customers/customer/" + customerJson["id"] + "/internet-services", headers)
+		services = servicesByCustomer[str(customerJson["id"])]
 		for serviceJson in services:
 			combinedId = "c_" + str(customerJson["id"]) + "_s_" + str(serviceJson["id"])
 			tariff_id = serviceJson['tariff_id']
@@ -109,6 +138,27 @@ def createShaper():
 			)
 			net.addRawNode(device)
 
+	return net
+
+def createShaper():
+	print("Fetching data from Spylnx")
+	startTime = time.monotonic()
+	requestsBefore = integrationClient().requestCount
+	headers = buildHeaders()
+	startImport()
+	(tariff, downloadForTariffID, uploadForTariffID), customers, ipForRouter = fetchInParallel([
+		lambda: getTariffs(headers),
+		lambda: getCustomers(headers),
+		lambda: getRouters(headers),
+	])
+	servicesByCustomer = getServicesByCustomer(headers, customers)
+	print("Fetched " + str(sum(len(services) for services in servicesByCustomer.values())) + " services of " + str(len(customers)) + " customers in "
+		+ str(integrationClient().requestCount - requestsBefore) + " requests, " + str(round(time.monotonic() - startTime, 1)) + " seconds")
+	if unchangedSinceImport("splynx"):
+		print("Splynx data is unchanged since the last import. Leaving network.json and ShapedDevices.csv in-place.")
+		return
+
+	net = graphFromSplynx(customers, servicesByCustomer, downloadForTariffID, uploadForTariffID, ipForRouter)
 	net.prepareTree()
 	net.plotNetworkGraph(False)
 	if net.doesNetworkJsonExist():
@@ -116,6 +166,7 @@ def createShaper():
 	else:
 		net.createNetworkJson()
 	net.createShapedDevices()
+	markImported("splynx")
 
 def importFromSplynx():
 	#createNetworkJSON()
@@ -1,8 +1,20 @@
-import requests
 import os
 import csv
 from ispConfig import uispSite, uispStrategy
-from integrationCommon import isIpv4Permitted, fixSubnet
+from integrationCommon import permittedAddresses, fixSubnet
+from integrationHTTP import integrationClient, fetchInParallel
+from integrationCache import cachedFetch, startImport, unchangedSinceImport, markImported, keepFields
+
+# The fields of each UISP response that the graph is built from. Only
+# these are kept from each item as the response is downloaded, and only
+# changes to them make the next import rebuild the graph.
+uispGraphFields = {
+    "sites": ['identification.id', 'identification.name', 'identification.type', 'identification.parent.id',
+              'description.address', 'qos.downloadSpeed', 'qos.uploadSpeed'],
+    "devices": ['identification.id', 'identification.name', 'identification.role', 'identification.mac', 'identification.site.id',
+                'interfaces.addresses', 'overview.downlinkCapacity', 'overview.uplinkCapacity'],
+    "data-links": ['from.device.identification.id', 'from.site.identification.id', 'to.site.identification.id'],
+}
 
 def uispRequest(target):
     # Sends an HTTP request to UISP and returns the
@@ -11,23 +23,54 @@ def uispRequest(target):
     from ispConfig import UISPbaseURL, uispAuthToken
     url = UISPbaseURL + "/nms/api/v2.1/" + target
     headers = {'accept': 'application/json', 'x-auth-token': uispAuthToken}
-    r = requests.get(url, headers=headers)
-    return r.json()
+    fields = uispGraphFields.get(target.split('?')[0])
+    return cachedFetch("uisp/" + target, lambda: integrationClient().getJsonItems(url, headers=headers, keep=lambda item: keepFields(item, fields)), fields)
 
-def buildFlatGraph():
-    # Builds a high-performance (but lacking in site or AP bandwidth control)
-    # network.
+def devicesBySite(devices):
+    # Groups the devices by the ID of the site they are
+    # at, keeping UISP's order. Devices without a site are
+    # left out.
+    result = {}
+    for device in devices:
+        if device['identification']['site'] is not None:
+            result.setdefault(device['identification']['site']['id'], []).append(device)
+    return result
+
+def dataLinksByDevice(dataLinks):
+    # Groups the data-links by the ID of the device they
+    # start from, keeping UISP's order. Links without a
+    # "from" device are left out.
+    result = {}
+    for dl in dataLinks:
+        if dl['from']['device'] is not None:
+            result.setdefault(dl['from']['device']['identification']['id'], []).append(dl)
+    return result
+
+def deviceNode(device, siteId):
+    # Builds the NetworkNode for a device at a site
+    from integrationCommon import NetworkNode, NodeType
+    ipv4 = []
+    ipv6 = []
+
+    cidrs = [ip["cidr"] for interface in device["interfaces"] for ip in interface["addresses"]]
+    for ip, permitted in zip(cidrs, permittedAddresses(cidrs)):
+        if permitted:
+            ipv4.append(fixSubnet(ip))
+
+    # TODO: Figure out Mikrotik IPv6?
+    mac = device['identification']['mac']
+
+    return NetworkNode(id=device['identification']['id'], displayName=device['identification']
+        ['name'], parentId=siteId, type=NodeType.device, ipv4=ipv4, ipv6=ipv6, mac=mac)
+
+def flatGraphFromUISP(sites, devices):
+    # Builds the flat network graph from UISP's sites and
+    # devices, adding every client to the tree
     from integrationCommon import NetworkGraph, NetworkNode, NodeType
     from ispConfig import generatedPNUploadMbps, generatedPNDownloadMbps
 
-    # Load network sites
-    print("Loading Data from UISP")
-    sites = uispRequest("sites")
-    devices = uispRequest("devices?withInterfaces=true&authorized=true")
-
-    # Build a basic network adding every client to the tree
-    print("Building Flat Topology")
     net = NetworkGraph()
+    siteDevices = devicesBySite(devices)
 
     for site in sites:
         type = site['identification']['type']
@@ -44,23 +87,30 @@ def buildFlatGraph():
 
             node = NetworkNode(id=id, displayName=name, type=NodeType.client, download=download, upload=upload, address=address)
             net.addRawNode(node)
-            for device in devices:
-                if device['identification']['site'] is not None and device['identification']['site']['id'] == id:
-                    # The device is at this site, so add it
-                    ipv4 = []
-                    ipv6 = []
+            for device in siteDevices.get(id, []):
+                # The device is at this site, so add it
+                net.addRawNode(deviceNode(device, id))
 
-                    for interface in device["interfaces"]:
-                        for ip in interface["addresses"]:
-                            ip = ip["cidr"]
-                            if isIpv4Permitted(ip):
-                                ipv4.append(fixSubnet(ip))
+    return net
 
-                    # TODO: Figure out Mikrotik IPv6?
-                    mac = device['identification']['mac']
+def buildFlatGraph():
+    # Builds a high-performance (but lacking in site or AP bandwidth control)
+    # network.
 
-                    net.addRawNode(NetworkNode(id=device['identification']['id'], displayName=device['identification']
-                        ['name'], parentId=id, type=NodeType.device, ipv4=ipv4, ipv6=ipv6, mac=mac))
+    # Load network sites
+    print("Loading Data from UISP")
+    startImport()
+    sites, devices = fetchInParallel([
+        lambda: uispRequest("sites"),
+        lambda: uispRequest("devices?withInterfaces=true&authorized=true"),
+    ])
+    if unchangedSinceImport("uispFlat"):
+        print("UISP data is unchanged since the last import. Leaving network.json and ShapedDevices.csv in-place.")
+        return
+
+    # Build a basic network adding every client to the tree
+    print("Building Flat Topology")
+    net = flatGraphFromUISP(sites, devices)
 
     # Finish up
     net.prepareTree()
@@ -70,31 +120,16 @@ def buildFlatGraph():
     else:
         net.createNetworkJson()
     net.createShapedDevices()
+    markImported("uispFlat")
 
-def buildFullGraph():
-    # Attempts to build a full network graph, incorporating as much of the UISP
-    # hierarchy as possible.
+def fullGraphFromUISP(sites, devices, dataLinks, siteBandwidth):
+    # Builds the full network graph from UISP's sites, devices
+    # and data-links. siteBandwidth ({name: {"download", "upload"}},
+    # from integrationUISPbandwidths.csv) is used for site and AP
+    # capacities, and any sites or APs it lacks are added to it.
     from integrationCommon import NetworkGraph, NetworkNode, NodeType
     from ispConfig import generatedPNUploadMbps, generatedPNDownloadMbps
 
-    # Load network sites
-    print("Loading Data from UISP")
-    sites = uispRequest("sites")
-    devices = uispRequest("devices?withInterfaces=true&authorized=true")
-    dataLinks = uispRequest("data-links?siteLinksOnly=true")
-
-    # Do we already have a integrationUISPbandwidths.csv file?
-    siteBandwidth = {}
-    if os.path.isfile("integrationUISPbandwidths.csv"):
-        with open('integrationUISPbandwidths.csv') as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            next(csv_reader)
-            for row in csv_reader:
-                name, download, upload = row
-                download = int(download)
-                upload = int(upload)
-                siteBandwidth[name] = {"download": download, "upload": upload}
-
     # Find AP capacities from UISP
     for device in devices:
         if device['identification']['role'] == "ap":
@@ -106,8 +141,8 @@ def buildFullGraph():
                 siteBandwidth[device['identification']['name']] = {
                     "download": download, "upload": upload}
 
-    print("Building Topology")
     net = NetworkGraph()
+    siteDevices = devicesBySite(devices)
     # Add all sites and client sites
     for site in sites:
         id = site['identification']['id']
@@ -147,45 +182,64 @@ def buildFullGraph():
         else:
             net.addRawNode(node)
 
-        for device in devices:
-            if device['identification']['site'] is not None and device['identification']['site']['id'] == id:
-                # The device is at this site, so add it
-                ipv4 = []
-                ipv6 = []
-
-                for interface in device["interfaces"]:
-                    for ip in interface["addresses"]:
-                        ip = ip["cidr"]
-                        if isIpv4Permitted(ip):
-                            ipv4.append(fixSubnet(ip))
-
-                # TODO: Figure out Mikrotik IPv6?
-                mac = device['identification']['mac']
-
-                net.addRawNode(NetworkNode(id=device['identification']['id'], displayName=device['identification']
-                               ['name'], parentId=id, type=NodeType.device, ipv4=ipv4, ipv6=ipv6, mac=mac))
+        for device in siteDevices.get(id, []):
+            # The device is at this site, so add it
+            net.addRawNode(deviceNode(device, id))
 
     # Now iterate access points, and look for connections to sites
+    deviceLinks = dataLinksByDevice(dataLinks)
     for node in net.nodes:
         if node.type == NodeType.device:
-            for dl in dataLinks:
-                if dl['from']['device'] is not None and dl['from']['device']['identification']['id'] == node.id:
-                    if dl['to']['site'] is not None and dl['from']['site']['identification']['id'] != dl['to']['site']['identification']['id']:
-                        target = net.findNodeIndexById(
-                            dl['to']['site']['identification']['id'])
-                        if target > -1:
-                            # We found the site
-                            if net.nodes[target].type == NodeType.client or net.nodes[target].type == NodeType.clientWithChildren:
-                                net.nodes[target].parentId = node.id
-                                node.type = NodeType.ap
-                                if node.displayName in siteBandwidth:
-                                    # Use the bandwidth numbers from the CSV file
-                                    node.uploadMbps = siteBandwidth[node.displayName]["upload"]
-                                    node.downloadMbps = siteBandwidth[node.displayName]["download"]
-                                else:
-                                    # Add some defaults in case they want to change them
-                                    siteBandwidth[node.displayName] = {
-                                        "download": generatedPNDownloadMbps, "upload": generatedPNUploadMbps}
+            for dl in deviceLinks.get(node.id, []):
+                if dl['to']['site'] is not None and dl['from']['site']['identification']['id'] != dl['to']['site']['identification']['id']:
+                    target = net.findNodeIndexById(
+                        dl['to']['site']['identification']['id'])
+                    if target > -1:
+                        # We found the site
+                        if net.nodes[target].type == NodeType.client or net.nodes[target].type == NodeType.clientWithChildren:
+                            net.nodes[target].parentId = node.id
+                            node.type = NodeType.ap
+                            if node.displayName in siteBandwidth:
+                                # Use the bandwidth numbers from the CSV file
+                                node.uploadMbps = siteBandwidth[node.displayName]["upload"]
+                                node.downloadMbps = siteBandwidth[node.displayName]["download"]
+                            else:
+                                # Add some defaults in case they want to change them
+                                siteBandwidth[node.displayName] = {
+                                    "download": generatedPNDownloadMbps, "upload": generatedPNUploadMbps}
+
+    return net
+
+def buildFullGraph():
+    # Attempts to build a full network graph, incorporating as much of the UISP
+    # hierarchy as possible.
+
+    # Load network sites
+    print("Loading Data from UISP")
+    startImport()
+    sites, devices, dataLinks = fetchInParallel([
+        lambda: uispRequest("sites"),
+        lambda: uispRequest("devices?withInterfaces=true&authorized=true"),
+        lambda: uispRequest("data-links?siteLinksOnly=true"),
+    ])
+
+    # Do we already have a integrationUISPbandwidths.csv file?
+    siteBandwidth = {}
+    if os.path.isfile("integrationUISPbandwidths.csv"):
+        with open('integrationUISPbandwidths.csv') as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter=',')
+            next(csv_reader)
+            for row in csv_reader:
+                name, download, upload = row
+                download = int(download)
+                upload = int(upload)
+                siteBandwidth[name] = {"download": download, "upload": upload}
+    if unchangedSinceImport("uispFull", ["integrationUISPbandwidths.csv"]):
+        print("UISP data is unchanged since the last import. Leaving network.json and ShapedDevices.csv in-place.")
+        return
+
+    print("Building Topology")
+    net = fullGraphFromUISP(sites, devices, dataLinks, siteBandwidth)
 
     net.prepareTree()
     net.plotNetworkGraph(False)
@@ -204,6 +258,7 @@ def buildFullGraph():
             entry = (
                 device, siteBandwidth[device]["download"], siteBandwidth[device]["upload"])
             wr.writerow(entry)
+    markImported("uispFull", ["integrationUISPbandwidths.csv"])
 
 
 def importFromUISP():
@@ -35,13 +35,86 @@ queuesAvailableOverride = 0
 # By default, it balances the subscribers across CPU cores, factoring in their max bandwidth rates
 # Past 25,000 subsribers this algorithm becomes inefficient and is not advised
 useBinPackingToBalanceCPU = True
+# Balance by each circuit's measured throughput (the median of its daily 95th percentiles over the last
+# measuredTrafficHistoryDays, recorded by the stats collector) instead of its plan rate. Circuits without
+# history use their plan rate. Preview the result with: python3 usageWeights.py simulate
+useMeasuredTrafficForBinpacking = False
+measuredTrafficHistoryDays = 7
 
 # Bandwidth Graphing
 bandwidthGraphingEnabled = True
+influxDBEnabled = True
 influxDBurl = "http://localhost:8086"
 influxDBBucket = "libreqos"
 influxDBOrg = "Your ISP Name Here"
 influxDBtoken = ""
+# With 'cake diffserv4', per-tin drop and ECN mark percentages are graphed for the whole shaper ('global').
+# Set to 'node' to also graph them per parent node, or 'circuit' for parent nodes and every circuit.
+# 'circuit' adds up to 8 series per circuit.
+tinStatsGranularity = 'global'
+
+# Bandwidth graphs are refreshed every 10 seconds. If collecting stats uses more than this share
+# of a CPU core over that interval, the interval is stretched (up to 60 seconds) to stay within it.
+statsPollerCPUBudget = 0.25
+
+# Collect stats in separate processes: one per interface for tc, one for xdp_pping and one writing the results,
+# passing counters through shared memory, so one slow stage doesn't hold up the others. Workers that fail are
+# restarted. statsPipelineMaxCircuits sizes the shared memory (about 170 bytes per circuit per interface, and
+# 450 bytes per circuit for xdp_pping).
+statsPipelineEnabled = False
+statsPipelineMaxCircuits = 100000
+
+# Run xdp_pping every latencyReaderPollSeconds in the background and keep each circuit's recent results, so
+# latency refreshes summarize everything seen since the previous refresh rather than a single snapshot.
+latencyReaderEnabled = True
+latencyReaderPollSeconds = 2.0
+
+# Number of circuits kept in each top list of topK.json (by throughput, drops, overload and latency,
+# overall and per parent node). See them with: python3 topK.py throughput Download
+heavyHitterCount = 50
+
+# Writing every circuit's Bandwidth and Utilization every poll is most of the InfluxDB load. Set this to 60 or
+# 300 to write only parent nodes and the heavyHitterCount busiest circuits every poll, and every circuit as
+# min / mean / max over that many seconds ('Bandwidth Rollup' and 'Utilization Rollup'). 0 writes every poll.
+circuitRollupSeconds = 0
+
+# Each top level node is shaped by one CPU. The stats collector warns, and marks the queue in cpuLoad.json,
+# InfluxDB and Prometheus, when one MQ queue carries more than this share of all Download or Upload traffic.
+cpuQueueImbalanceShare = 0.5
+
+# Keep bytes used per circuit in usageLedger.bin: hourly for usageLedgerHourlyDays, then daily for
+# usageLedgerDailyDays, then monthly. Query with e.g. python3 usageLedger.py circuit 1234 --resolution day
+usageLedgerEnabled = True
+usageLedgerHourlyDays = 62
+usageLedgerDailyDays = 400
+
+# Collect per CPU softirq time and per NIC queue interrupts of interfaceA and interfaceB with the shaping stats
+hostTelemetryEnabled = True
+
+# How circuits and parent nodes are tagged in InfluxDB.
+# 'names' tags them by circuit name and parent node name. Renaming or moving a circuit starts new series.
+# 'ids' tags them by circuit ID and node ID (a node's "id" in network.json, or its name if it has none),
+# and writes names and network.json paths to 'Circuit Metadata' / 'Node Metadata' only when they change.
+# Estimate the series count of each with: python3 exportSchema.py cardinality
+influxDBTagSchema = 'names'
+
+# Local time-series history, usable without InfluxDB. Stats are kept at poll resolution (bandwidth and
+# latency each in their own ring) and at 1 minute resolution in fixed-size memory-mapped files. Disk use is about
+# timeSeriesMaxSeries * (timeSeriesPollSlots + timeSeriesLatencySlots + timeSeriesMinuteSlots) * 4 bytes
+# (500 MB with the defaults). Each circuit uses 5 series and each parent node 5. Series of circuits and
+# nodes that are gone are reused once timeSeriesMaxSeries is reached. Read it with: python3 timeSeriesStore.py list
+timeSeriesEnabled = False
+timeSeriesDirectory = '/var/lib/libreqos/timeseries'
+timeSeriesMaxSeries = 65536
+timeSeriesPollSlots = 360		# 1 hour of 10 second polls
+timeSeriesLatencySlots = 120	# 1 hour of 30 second latency polls
+timeSeriesMinuteSlots = 1440	# 24 hours
+
+# Prometheus metrics endpoint, served by scheduler.py at http://<address>:<port>/metrics
+# Usable with or without InfluxDB. 0.0.0.0 listens on every interface.
+prometheusEnabled = False
+prometheusListenAddress = '0.0.0.0'
+prometheusPort = 9156
 
 # Latency Graphing
 latencyGraphingEnabled = False
@@ -49,6 +122,18 @@ ppingLocation = "pping"
 
 # NMS/CRM Integration
 
+# Requests to the NMS/CRM time out after this many seconds, and are retried this many times
+# (with increasing waits) after connection errors, timeouts, 429 and 5xx responses
+integrationHTTPTimeoutSeconds = 30
+integrationHTTPRetries = 3
+# Responses from the NMS/CRM are kept in integrationCache/. An import is skipped when nothing it
+# builds from has changed since the last one. Responses younger than integrationCacheSeconds are
+# reused without asking the NMS/CRM again. If the NMS/CRM can't be reached, responses up to
+# integrationCacheMaxStaleSeconds old are used instead.
+integrationCacheEnabled = True
+integrationCacheSeconds = 0
+integrationCacheMaxStaleSeconds = 172800
+
 # If a device shows a WAN IP within these subnets, assume they are behind NAT / un-shapable, and ignore them
 ignoreSubnets = ['192.168.0.0/16']
 allowedSubnets = ['100.64.0.0/10']
@@ -59,12 +144,18 @@ splynx_api_key = ''
 splynx_api_secret = ''
 # Everything before /api/2.0/ on your Splynx instance
 splynx_api_url = 'https://YOUR_URL.splynx.app'
+# If Splynx won't list every customer's internet services at once, they are fetched
+# per customer, with at most this many requests at a time
+splynxMaxConcurrentRequests = 8
 
 # UISP integration
 automaticImportUISP = False
 uispAuthToken = ''
 # Everything before /nms/ on your UISP instance
 UISPbaseURL = 'https://examplesite.com'
+# Name of the UISP site to use as the root of the tree ("full" strategy only).
+# Leave blank to put the top level sites directly under the shaper.
+uispSite = ''
 # Strategy:
 # * "flat" - create all client sites directly off the top of the tree,
 #   provides maximum performance - at the expense of not offering AP,
@@ -75,6 +166,10 @@ uispStrategy = "full"
 excludeSites = []
 # If you use IPv6, this can be used to find associated IPv6 prefixes for your clients' IPv4 addresses, and match them to those devices
 findIPv6usingMikrotik = False
+# Each router's IPv4 to IPv6 map is reused for this long before the router is polled again,
+# and a router that doesn't answer within findIPv6TimeoutSeconds keeps its last map
+findIPv6CacheSeconds = 1800
+findIPv6TimeoutSeconds = 10
 # If you want to provide a safe cushion for speed test results to prevent customer complains, you can set this to 1.15 (15% above plan rate).
 # If not, you can leave as 1.0
 bandwidthOverheadFactor = 1.0
@@ -0,0 +1,189 @@
+# Continuous collection of xdp_pping latency.
+# Rather than one xdp_pping snapshot per latency refresh, a background
+# thread runs it every few seconds and keeps each circuit's summaries in a
+# fixed-size ring (timestamps as float64, avg / min / max / median /
+# samples as float32), keyed by the decimal tc handle xdp_pping reports.
+# A refresh reads every summary of the window back as xdp_pping style
+# entries, oldest first, which getCircuitLatencyStats() sketches one by one
+# (so the spread within the window survives) and merges into one average
+# per circuit. Rings of circuits xdp_pping stops reporting are dropped once
+# everything in them is older than the ring covers.
+
+import threading
+import time
+from array import array
+
+# Fields of a ring row
+ringFields = ['avg', 'min', 'max', 'median', 'samples']
+
+# xdp_pping names circuits by decimal tc handle ('1:26'), the shaper by
+# hex classid ('0x1:0x1a'). Conversions are kept here, so each handle is
+# parsed once for the life of the process.
+classIDForTcHandle = {}
+
+
+def tcHandleToClassID(tc):
+	classID = classIDForTcHandle.get(tc)
+	if classID == None:
+		major, minor = tc.split(':')
+		classID = classIDForTcHandle[tc] = hex(int(major)) + ':' + hex(int(minor))
+	return classID
+
+
+def preloadClassIDs(classIDs):
+	# Fills the lookup table from the shaper's classids ('0x1:0x1a'), e.g.
+	# from statsByCircuit.json, so the first reads don't parse handles
+	for classID in classIDs:
+		major, minor = classID.split(':')
+		classIDForTcHandle[str(int(major, 16)) + ':' + str(int(minor, 16))] = classID
+
+
+def mergeEntries(listOfEntries):
+	# One entry per tc handle, in the order first seen: averages weighted by
+	# samples, the lowest min and highest max. The median of the merged
+	# summaries isn't known, so the samples-weighted mean of their medians
+	# stands in for it.
+	mergedForTc = {}
+	for entry in listOfEntries:
+		if 'tc' not in entry:
+			continue
+		samples = max(int(entry.get('samples', 1)), 1)
+		merged = mergedForTc.get(entry['tc'])
+		if merged == None:
+			mergedForTc[entry['tc']] = [entry['avg'] * samples, entry.get('min', entry['avg']), entry.get('max', entry['avg']), entry.get('median', entry['avg']) * samples, samples]
+		else:
+			merged[0] += entry['avg'] * samples
+			merged[1] = min(merged[1], entry.get('min', entry['avg']))
+			merged[2] = max(merged[2], entry.get('max', entry['avg']))
+			merged[3] += entry.get('median', entry['avg']) * samples
+			merged[4] += samples
+	return [{'tc': tc, 'avg': weightedAvg / samples, 'min': low, 'max': high, 'median': weightedMedian / samples, 'samples': samples}
+		for tc, (weightedAvg, low, high, weightedMedian, samples) in mergedForTc.items()]
+
+
+def thinEntries(listOfEntries, maxEntries):
+	# listOfEntries if it has at most maxEntries, otherwise each circuit's
+	# consecutive entries merged into as many as fit (at least one each)
+	if len(listOfEntries) <= maxEntries:
+		return listOfEntries
+	entriesForTc = {}
+	for entry in listOfEntries:
+		if 'tc' in entry:
+			entriesForTc.setdefault(entry['tc'], []).append(entry)
+	perCircuit = max(maxEntries // max(len(entriesForTc), 1), 1)
+	thinned = []
+	for entries in entriesForTc.values():
+		groups = min(perCircuit, len(entries))
+		for group in range(groups):
+			thinned.extend(mergeEntries(entries[(len(entries) * group) // groups:(len(entries) * (group + 1)) // groups]))
+	return thinned
+
+
+class LatencyRing:
+	# The last ringSize summaries of one circuit
+
+	__slots__ = ('times', 'values', 'next', 'count')
+
+	def __init__(self, ringSize):
+		self.times = array('d', [0.0]) * ringSize
+		self.values = array('f', [0.0]) * (ringSize * len(ringFields))
+		self.next = 0
+		self.count = 0
+
+	def add(self, timestamp, entry):
+		ringSize = len(self.times)
+		row = self.next
+		self.times[row] = timestamp
+		offset = row * len(ringFields)
+		self.values[offset] = entry['avg']
+		self.values[offset + 1] = entry.get('min', entry['avg'])
+		self.values[offset + 2] = entry.get('max', entry['avg'])
+		self.values[offset + 3] = entry.get('median', entry['avg'])
+		self.values[offset + 4] = entry.get('samples', 1)
+		self.next = (row + 1) % ringSize
+		self.count = min(self.count + 1, ringSize)
+
+	def newest(self):
+		# Timestamp of the newest summary, 0.0 if there is none
+		return self.times[(self.next - 1) % len(self.times)] if self.count > 0 else 0.0
+
+	def rows(self, since):
+		# Yields (timestamp, [avg, min, max, median, samples]) newer than since
+		ringSize = len(self.times)
+		for age in range(self.count):
+			row = (self.next - 1 - age) % ringSize
+			if self.times[row] <= since:
+				break
+			offset = row * len(ringFields)
+			yield self.times[row], self.values[offset:offset + len(ringFields)]
+
+
+class LatencyReader:
+
+	def __init__(self, ppingReader, pollSeconds=2.0, ringSize=64):
+		# ppingReader is called like getPpingEntries() in graphInfluxDB.py
+		self.ppingReader = ppingReader
+		self.pollSeconds = pollSeconds
+		self.ringSize = ringSize
+		self.rings = {}
+		self.lock = threading.Lock()
+		self.lastRead = 0.0
+		self.failures = 0
+		self.thread = None
+
+	def ingest(self, listOfEntries, timestamp):
+		with self.lock:
+			for entry in listOfEntries:
+				if 'tc' not in entry:
+					continue
+				ring = self.rings.get(entry['tc'])
+				if ring == None:
+					ring = self.rings[entry['tc']] = LatencyRing(self.ringSize)
+				ring.add(timestamp, entry)
+
+	def pollOnce(self):
+		listOfEntries, sampleTimeNs = self.ppingReader()
+		self.ingest(listOfEntries, sampleTimeNs / 1000000000.0)
+
+	def __run(self):
+		nextPoll = time.monotonic()
+		while True:
+			try:
+				self.pollOnce()
+			except Exception:
+				self.failures += 1
+			nextPoll += self.pollSeconds
+			time.sleep(max(nextPoll - time.monotonic(), 0.0))
+			nextPoll = max(nextPoll, time.monotonic() - self.pollSeconds)
+
+	def start(self):
+		self.thread = threading.Thread(target=self.__run, name='xdp_pping reader', daemon=True)
+		self.thread.start()
+		return self
+
+	def entries(self, windowSeconds=None, now=None):
+		# Every summary of the last windowSeconds, or since the previous
+		# call when windowSeconds is None, as xdp_pping entries. A circuit
+		# has one entry per summary, oldest first.
+		now = time.time() if now == None else now
+		since = (now - windowSeconds) if windowSeconds != None else self.lastRead
+		expired = now - (self.ringSize * self.pollSeconds)
+		listOfEntries = []
+		with self.lock:
+			for tc, ring in list(self.rings.items()):
+				if ring.newest() < expired:
+					del self.rings[tc]
+					continue
+				for timestamp, values in reversed(list(ring.rows(since))):
+					entry = dict(zip(ringFields, values))
+					entry['samples'] = int(entry['samples'])
+					entry['tc'] = tc
+					listOfEntries.append(entry)
+			if windowSeconds == None:
+				self.lastRead = now
+		return listOfEntries
+
+	def readPpingEntries(self):
+		# Drop-in ppingReader for refreshLatencyGraphs()
+		now = time.time()
+		return self.entries(now=now), round(now * 1000000000)
@@ -0,0 +1,115 @@
+# Mergeable latency sketches (log-bucketed histograms, DDSketch style).
+# A latency lands in bucket ceil(log(ms / minLatency) / log(gamma)), so any
+# quantile read back is within relativeAccuracy of the true value. Buckets
+# are kept sparsely, so a sketch never holds more than bucketCount entries,
+# and two sketches merge by adding counts bucket by bucket - no lists of
+# latencies are kept or sorted.
+# xdp_pping only reports a summary (min / median / avg / max) of each
+# circuit's RTTs per poll, so percentiles built from it are estimates: the
+# quantiles between min, median and max are interpolated (see
+# addPpingEntry()). They show the tail within each poll and across polls,
+# but aren't exact RTT percentiles.
+
+import math
+
+minLatency = 0.1		# ms, anything lower lands in the first bucket
+maxLatency = 10000.0	# ms, anything higher lands in the last bucket
+relativeAccuracy = 0.02
+gamma = (1.0 + relativeAccuracy) / (1.0 - relativeAccuracy)
+logGamma = math.log(gamma)
+bucketCount = int(math.ceil(math.log(maxLatency / minLatency) / logGamma)) + 1
+
+reportedPercentiles = [50, 95, 99]
+# Points an xdp_pping summary is spread over, min, median and max included
+interpolationPoints = 21
+
+
+def bucketIndex(latency):
+	if latency <= minLatency:
+		return 0
+	return min(int(math.ceil(math.log(latency / minLatency) / logGamma)), bucketCount - 1)
+
+
+def bucketValue(index):
+	# Bucket i covers (minLatency * gamma^(i-1), minLatency * gamma^i]. This
+	# returns the point with the same relative error to both ends.
+	if index == 0:
+		return minLatency
+	return (2.0 * minLatency * (gamma ** index)) / (gamma + 1.0)
+
+
+class LatencySketch:
+
+	__slots__ = ('counts', 'total')
+
+	def __init__(self):
+		self.counts = {}
+		self.total = 0
+
+	def add(self, latency, count=1):
+		if count <= 0:
+			return
+		index = bucketIndex(latency)
+		self.counts[index] = self.counts.get(index, 0) + count
+		self.total += count
+
+	def addPpingEntry(self, entry):
+		# xdp_pping reports a summary per circuit rather than each RTT. Its
+		# samples are spread evenly by rank from min to median and from
+		# median to max, i.e. the quantiles in between are taken to be
+		# linear, so a poll's tail reaches p95 / p99 rather than only its max.
+		samples = max(int(entry.get('samples', 1)), 1)
+		if (samples < 3) or ('median' not in entry) or ('min' not in entry) or ('max' not in entry):
+			self.add(entry['avg'], samples)
+			return
+		points = min(samples, interpolationPoints)
+		for point in range(points):
+			rank = point / (points - 1)
+			if rank <= 0.5:
+				latency = entry['min'] + ((entry['median'] - entry['min']) * rank * 2.0)
+			else:
+				latency = entry['median'] + ((entry['max'] - entry['median']) * ((rank * 2.0) - 1.0))
+			self.add(latency, ((samples * (point + 1)) // points) - ((samples * point) // points))
+
+	def merge(self, other):
+		counts = self.counts
+		for index, count in other.counts.items():
+			counts[index] = counts.get(index, 0) + count
+		self.total += other.total
+		return self
+
+	def quantile(self, q):
+		# Returns the latency (ms) at quantile q (0.0 - 1.0), or None if empty
+		if self.total == 0:
+			return None
+		rank = q * (self.total - 1)
+		seen = 0
+		for index in sorted(self.counts):
+			seen += self.counts[index]
+			if seen > rank:
+				return round(bucketValue(index), 2)
+		return round(bucketValue(max(self.counts)), 2)
+
+	def percentiles(self):
+		# {'p50': ms, 'p95': ms, 'p99': ms}
+		return {'p' + str(p): self.quantile(p / 100.0) for p in reportedPercentiles}
+
+
+def rollUpSketches(sketchForNode, parentNodeNameDict):
+	# Merges every node's sketch into each of its ancestors, deepest nodes
+	# first. sketchForNode holds the sketch of the circuits attached
+	# directly to each node, and gains an entry for any ancestor that has
+	# none. parentNodeNameDict maps child node name -> parent node name.
+	def depth(node):
+		levels = 0
+		while node in parentNodeNameDict:
+			node = parentNodeNameDict[node]
+			levels += 1
+		return levels
+	for node in sorted(parentNodeNameDict, key=depth, reverse=True):
+		if node in sketchForNode:
+			parent = parentNodeNameDict[node]
+			if parent not in sketchForNode:
+				sketchForNode[parent] = LatencySketch()
+			sketchForNode[parent].merge(sketchForNode[node])
+	return sketchForNode
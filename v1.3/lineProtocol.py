@@ -0,0 +1,140 @@
+# Writes InfluxDB line protocol directly into a reusable buffer, instead of
+# building an influxdb_client Point per measurement and serializing it later.
+# Tag sets for circuits and nodes rarely change between polls, so their
+# escaped form is cached per circuit / node and only the numeric fields are
+# formatted each time. Output matches Point.to_line_protocol() byte for byte.
+
+import math
+
+_escapeMeasurement = str.maketrans({
+	',': r'\,',
+	' ': r'\ ',
+	'\n': r'\n',
+	'\t': r'\t',
+	'\r': r'\r',
+})
+
+_escapeKey = str.maketrans({
+	',': r'\,',
+	'=': r'\=',
+	' ': r'\ ',
+	'\n': r'\n',
+	'\t': r'\t',
+	'\r': r'\r',
+})
+
+_escapeString = str.maketrans({
+	'"': r'\"',
+	'\\': r'\\',
+})
+
+
+def escapeMeasurement(measurement):
+	return str(measurement).translate(_escapeMeasurement)
+
+
+def escapeKey(key):
+	return str(key).translate(_escapeKey)
+
+
+def escapeTagValue(value):
+	escaped = str(value).translate(_escapeKey)
+	# A trailing backslash would escape the separator that follows it
+	if escaped.endswith('\\'):
+		escaped += ' '
+	return escaped
+
+
+def formatFieldValue(value):
+	# Returns the line protocol representation of a field value, or None if
+	# the value cannot be written (None, NaN, infinity)
+	if value is None:
+		return None
+	if isinstance(value, bool):
+		return 'true' if value else 'false'
+	if isinstance(value, float):
+		if not math.isfinite(value):
+			return None
+		formatted = str(value)
+		if formatted.endswith('.0'):
+			formatted = formatted[:-2]
+		return formatted
+	if isinstance(value, int):
+		return str(value) + 'i'
+	if isinstance(value, str):
+		return '"' + value.translate(_escapeString) + '"'
+	raise ValueError('Type: "' + str(type(value)) + '" of field value is not supported.')
+
+
+class LineProtocolSerializer:
+	# Accumulates line protocol for one write in self.lines. The list is
+	# reused between writes (call reset() after each flush), and escaped
+	# measurement names, field keys and tag sets are kept across polls.
+
+	def __init__(self):
+		self.lines = []
+		self.tagSetCache = {}
+		self.measurementCache = {}
+		self.fieldKeyCache = {}
+
+	def tagSet(self, cacheKey, tags):
+		# Returns the escaped ",key=value,..." string for a circuit or node.
+		# tags is a tuple of (key, value) pairs. The cached string is reused
+		# as long as the tag values for cacheKey are unchanged, so a rename or
+		# re-parent is picked up on the next poll.
+		cached = self.tagSetCache.get(cacheKey)
+		if (cached is not None) and (cached[0] == tags):
+			return cached[1]
+		escaped = ''
+		for key, value in sorted(tags):
+			if value is None:
+				continue
+			escapedKey = escapeKey(key)
+			escapedValue = escapeTagValue(value)
+			if escapedKey != '' and escapedValue != '':
+				escaped += ',' + escapedKey + '=' + escapedValue
+		self.tagSetCache[cacheKey] = (tags, escaped)
+		return escaped
+
+	def add(self, measurement, tagSet, fields, timestamp=None):
+		# Appends one line. tagSet comes from tagSet(); fields is a tuple of
+		# (key, value) pairs; timestamp, if given, is an integer in the write
+		# precision of the bucket (nanoseconds by default).
+		escapedMeasurement = self.measurementCache.get(measurement)
+		if escapedMeasurement is None:
+			escapedMeasurement = escapeMeasurement(measurement)
+			self.measurementCache[measurement] = escapedMeasurement
+		formattedFields = []
+		for key, value in sorted(fields):
+			if type(value) is float:
+				# Fast path for the common case of a finite float metric
+				if value - value != 0.0:
+					continue
+				formatted = str(value)
+				if formatted.endswith('.0'):
+					formatted = formatted[:-2]
+			else:
+				formatted = formatFieldValue(value)
+				if formatted is None:
+					continue
+			escapedKey = self.fieldKeyCache.get(key)
+			if escapedKey is None:
+				escapedKey = escapeKey(key)
+				self.fieldKeyCache[key] = escapedKey
+			formattedFields.append(escapedKey + '=' + formatted)
+		if not formattedFields:
+			return
+		line = escapedMeasurement + tagSet + ' ' + ','.join(formattedFields)
+		if timestamp is not None:
+			line += ' ' + str(int(timestamp))
+		self.lines.append(line)
+
+	def __len__(self):
+		return len(self.lines)
+
+	def getvalue(self):
+		# Returns the buffered lines as a single body for write_api.write()
+		return '\n'.join(self.lines)
+
+	def reset(self):
+		self.lines.clear()
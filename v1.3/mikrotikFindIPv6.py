@@ -1,51 +1,140 @@
 #!/usr/bin/python3
-import routeros_api
+# Finds the IPv6 prefix delegated to each IPv4 DHCP client on the Mikrotik
+# routers in mikrotikDHCPRouterList.csv, by joining DHCPv4 leases, DHCPv6
+# bindings and the IPv6 neighbor table on MAC address. Routers are polled
+# concurrently, each with its own timeout, over API connections kept open
+# between polls. Each router's map is cached in mikrotikIPv6Cache.json for
+# findIPv6CacheSeconds, and a router that can't be reached contributes its
+# last cached map instead.
+
 import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def pullMikrotikIPv6():
-	ipv4ToIPv6 = {}
+# {(IP, port, username): RouterOsApiPool}, reused between polls
+connectionPools = {}
+connectionPoolsLock = threading.Lock()
+
+
+def readRouterList(path='mikrotikDHCPRouterList.csv'):
+	# [(RouterName, IP, Username, Password, apiPort)], apiPort defaulting
+	# to 8728 for rows without one
 	routerList = []
-	with open('mikrotikDHCPRouterList.csv') as csv_file:
-			csv_reader = csv.reader(csv_file, delimiter=',')
-			next(csv_reader)
-			for row in csv_reader:
-				RouterName, IP, Username, Password, apiPort = row
-				routerList.append((RouterName, IP, Username, Password, apiPort))
-	for router in routerList:
-		RouterName, IP, inputUsername, inputPassword = router
-		connection = routeros_api.RouterOsApiPool(IP, username=inputUsername, password=inputPassword, port=apiPort, use_ssl=False, ssl_verify=False, ssl_verify_hostname=False, plaintext_login=True)
-		api = connection.get_api()
-		macToIPv4 = {}
-		macToIPv6 = {}
-		clientAddressToIPv6 = {}
-		list_dhcp = api.get_resource('/ip/dhcp-server/lease')
-		entries = list_dhcp.get()
-		for entry in entries:
-			try:
-				macToIPv4[entry['mac-address']] = entry['address']
-			except:
-				pass
-		list_dhcp = api.get_resource('/ipv6/dhcp-server/binding')
-		entries = list_dhcp.get()
-		for entry in entries:
-			try:
-				clientAddressToIPv6[entry['client-address']] = entry['address']
-			except:
-				pass
-		list_dhcp = api.get_resource('/ipv6/neighbor')
-		entries = list_dhcp.get()
-		for entry in entries:
-			try:
-				realIPv6 = clientAddressToIPv6[entry['address']]
-				macToIPv6[entry['mac-address']] = realIPv6
-			except:
-				pass
-		for mac, ipv6 in macToIPv6.items():
+	with open(path) as csv_file:
+		csv_reader = csv.reader(csv_file, delimiter=',')
+		next(csv_reader)
+		for row in csv_reader:
+			if len(row) < 4:
+				continue
+			RouterName, IP, Username, Password = [value.strip() for value in row[:4]]
+			apiPort = int(row[4]) if (len(row) > 4) and (row[4].strip() != '') else 8728
+			routerList.append((RouterName, IP, Username, Password, apiPort))
+	return routerList
+
+
+def routerIPv4ToIPv6(api):
+	# {IPv4: IPv6} for one router, from a routeros_api API object
+	macToIPv4 = {}
+	for entry in api.get_resource('/ip/dhcp-server/lease').get():
+		if ('mac-address' in entry) and ('address' in entry):
+			macToIPv4[entry['mac-address']] = entry['address']
+	clientAddressToIPv6 = {}
+	for entry in api.get_resource('/ipv6/dhcp-server/binding').get():
+		if ('client-address' in entry) and ('address' in entry):
+			clientAddressToIPv6[entry['client-address']] = entry['address']
+	macToIPv6 = {}
+	for entry in api.get_resource('/ipv6/neighbor').get():
+		if ('mac-address' in entry) and (entry.get('address') in clientAddressToIPv6):
+			macToIPv6[entry['mac-address']] = clientAddressToIPv6[entry['address']]
+	ipv4ToIPv6 = {}
+	for mac, ipv6 in macToIPv6.items():
+		if mac in macToIPv4:
+			ipv4ToIPv6[macToIPv4[mac]] = ipv6
+		else:
+			print('Failed to find associated IPv4 for ' + ipv6)
+	return ipv4ToIPv6
+
+
+def routerOsApi(router, timeoutSeconds):
+	# An API object for router, from a connection pool kept between polls
+	import routeros_api
+	RouterName, IP, Username, Password, apiPort = router
+	key = (IP, apiPort, Username)
+	with connectionPoolsLock:
+		connection = connectionPools.get(key)
+		if connection == None:
+			connection = routeros_api.RouterOsApiPool(IP, username=Username, password=Password, port=apiPort, use_ssl=False, ssl_verify=False, ssl_verify_hostname=False, plaintext_login=True)
+			connection.socket_timeout = timeoutSeconds
+			connectionPools[key] = connection
+	return connection.get_api()
+
+
+def dropConnection(router):
+	RouterName, IP, Username, Password, apiPort = router
+	with connectionPoolsLock:
+		connection = connectionPools.pop((IP, apiPort, Username), None)
+	if connection != None:
+		try:
+			connection.disconnect()
+		except Exception:
+			pass
+
+
+def pollRouter(router, connect, timeoutSeconds):
+	# Tries a kept connection first, then a new one
+	try:
+		return routerIPv4ToIPv6(connect(router, timeoutSeconds))
+	except Exception:
+		dropConnection(router)
+		return routerIPv4ToIPv6(connect(router, timeoutSeconds))
+
+
+def loadCache(path):
+	if not os.path.isfile(path):
+		return {}
+	with open(path, 'r') as j:
+		return json.loads(j.read())
+
+
+def pullMikrotikIPv6(routerListPath='mikrotikDHCPRouterList.csv', cachePath='mikrotikIPv6Cache.json', cacheSeconds=None, timeoutSeconds=None, maxWorkers=8, connect=routerOsApi, now=None):
+	# {IPv4: IPv6} across every router. Where two routers know the same
+	# IPv4 address, the one later in the router list wins.
+	if (cacheSeconds == None) or (timeoutSeconds == None):
+		from ispConfig import findIPv6CacheSeconds, findIPv6TimeoutSeconds
+		cacheSeconds = findIPv6CacheSeconds if cacheSeconds == None else cacheSeconds
+		timeoutSeconds = findIPv6TimeoutSeconds if timeoutSeconds == None else timeoutSeconds
+	now = time.time() if now == None else now
+	routerList = readRouterList(routerListPath)
+	# {RouterName: {'fetched': time, 'ipv4ToIPv6': {...}}}
+	cache = loadCache(cachePath)
+	toPoll = [router for router in routerList if (router[0] not in cache) or ((now - cache[router[0]]['fetched']) >= cacheSeconds)]
+	if len(toPoll) > 0:
+		workers = min(len(toPoll), maxWorkers)
+		executor = ThreadPoolExecutor(max_workers=workers)
+		futures = [(router, executor.submit(pollRouter, router, connect, timeoutSeconds)) for router in toPoll]
+		# Each router has timeoutSeconds once a worker picks it up
+		rounds = (len(toPoll) + workers - 1) // workers
+		deadline = time.monotonic() + (timeoutSeconds * rounds)
+		for router, future in futures:
 			try:
-				ipv4 = macToIPv4[mac]
-				ipv4ToIPv6[ipv4] = ipv6
-			except:
-				print('Failed to find associated IPv4 for ' + ipv6)
+				cache[router[0]] = {'fetched': now, 'ipv4ToIPv6': future.result(timeout=max(deadline - time.monotonic(), 0.0))}
+			except Exception as e:
+				reason = "timed out" if not future.done() else str(e)
+				if router[0] in cache:
+					print("Couldn't poll " + router[0] + " (" + reason + "), using its IPv6 map from " + str(round((now - cache[router[0]]['fetched']) / 60)) + " minutes ago")
+				else:
+					print("Couldn't poll " + router[0] + " (" + reason + ")")
+		# Routers that timed out are left to finish in the background
+		executor.shutdown(wait=False)
+		with open(cachePath, 'w') as f:
+			f.write(json.dumps(cache))
+	ipv4ToIPv6 = {}
+	for router in routerList:
+		if router[0] in cache:
+			ipv4ToIPv6.update(cache[router[0]]['ipv4ToIPv6'])
 	return ipv4ToIPv6
 
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+# Schedules the stats collection cycles on the monotonic clock.
+# Cycles start on a fixed grid (start + n * interval), so the time spent
+# collecting doesn't stretch the sampling interval the way a plain
+# time.sleep() between collections does. The CPU time used by each cycle
+# (including the tc / xdp_pping child processes) is measured, and the
+# interval is stretched when a cycle uses more than its share of CPU.
+
+import os
+import time
+from contextlib import contextmanager
+
+
+def cpuSeconds():
+	# CPU time used by this process and any finished child processes
+	times = os.times()
+	return times.user + times.system + times.children_user + times.children_system
+
+
+class Poller:
+
+	def __init__(self, intervalSeconds, cpuBudget=0.25, maxIntervalSeconds=None, lateToleranceSeconds=1.0):
+		# intervalSeconds is the preferred time between cycles. cpuBudget is
+		# the largest share of each interval that collection may spend on CPU
+		# before the interval is stretched, up to maxIntervalSeconds.
+		self.baseIntervalSeconds = intervalSeconds
+		self.intervalSeconds = intervalSeconds
+		self.cpuBudget = cpuBudget
+		self.maxIntervalSeconds = maxIntervalSeconds if maxIntervalSeconds is not None else intervalSeconds * 6
+		self.lateToleranceSeconds = lateToleranceSeconds
+		self.nextDeadline = None
+		self.cycle = 0
+		self.skippedCycles = 0
+		self.lateCycles = 0
+		self.lastLatenessSeconds = 0.0
+		self.lastDurationSeconds = 0.0
+		self.lastCPUSeconds = 0.0
+
+	def waitForNextCycle(self, sleep=time.sleep, clock=time.monotonic):
+		# Sleeps until the next deadline on the grid and returns the cycle
+		# number. If one or more deadlines were missed entirely (a slow
+		# collection, or a queue reload in between), they are counted as
+		# skipped and the cycle runs immediately; a cycle that starts more
+		# than lateToleranceSeconds after its deadline is counted as late.
+		now = clock()
+		if self.nextDeadline is None:
+			self.nextDeadline = now
+		elif now < self.nextDeadline:
+			sleep(self.nextDeadline - now)
+			now = clock()
+		else:
+			missed = int((now - self.nextDeadline) // self.intervalSeconds)
+			if missed > 0:
+				self.skippedCycles += missed
+				self.nextDeadline += missed * self.intervalSeconds
+		self.lastLatenessSeconds = max(now - self.nextDeadline, 0.0)
+		if self.lastLatenessSeconds > self.lateToleranceSeconds:
+			self.lateCycles += 1
+		self.nextDeadline += self.intervalSeconds
+		self.cycle += 1
+		return self.cycle
+
+	@contextmanager
+	def measure(self, clock=time.monotonic, cpuClock=cpuSeconds):
+		# Wrap the collection work of a cycle with this to record its
+		# duration and CPU time, and to adapt the interval to the budget.
+		startTime = clock()
+		startCPU = cpuClock()
+		try:
+			yield
+		finally:
+			self.lastDurationSeconds = clock() - startTime
+			self.lastCPUSeconds = cpuClock() - startCPU
+			self.__adaptInterval()
+
+	def __adaptInterval(self):
+		# Stretch the interval so that the last cycle's CPU time fits the
+		# budget, or ease back towards the preferred interval once it does.
+		budgetSeconds = self.intervalSeconds * self.cpuBudget
+		if self.lastCPUSeconds > budgetSeconds:
+			newInterval = min(self.lastCPUSeconds / self.cpuBudget, self.maxIntervalSeconds)
+		elif self.lastCPUSeconds < (budgetSeconds / 2.0):
+			newInterval = max(self.intervalSeconds * 0.9, self.baseIntervalSeconds)
+		else:
+			newInterval = self.intervalSeconds
+		if newInterval != self.intervalSeconds:
+			if self.nextDeadline is not None:
+				# Keep the grid anchored on the last deadline
+				self.nextDeadline += newInterval - self.intervalSeconds
+			self.intervalSeconds = newInterval
+
+	def metrics(self):
+		return {
+			'cycles': self.cycle,
+			'skippedCycles': self.skippedCycles,
+			'lateCycles': self.lateCycles,
+			'latenessSeconds': round(self.lastLatenessSeconds, 3),
+			'collectionSeconds': round(self.lastDurationSeconds, 3),
+			'collectionCPUSeconds': round(self.lastCPUSeconds, 3),
+			'intervalSeconds': round(self.intervalSeconds, 3),
+		}
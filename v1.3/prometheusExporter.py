@@ -0,0 +1,264 @@
+# Prometheus / OpenMetrics endpoint for the shaper's stats.
+# The text exposition is rebuilt once per poll from the collector's stats,
+# in sections (bandwidth, latency) so a latency poll doesn't re-render the
+# bandwidth series. Escaped label sets are cached per circuit and node, and
+# scrapes only ever send the cached body (gzipped once, on first request).
+
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tinStats import tinNames, directions
+
+contentType = 'text/plain; version=0.0.4; charset=utf-8'
+sectionOrder = ['bandwidth', 'queues', 'host', 'tins', 'latency']
+
+
+def escapeLabelValue(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labelSet(labels):
+	# (("name", value), ...) -> '{name="value",...}'
+	return '{' + ','.join(name + '="' + escapeLabelValue(value) + '"' for name, value in labels) + '}'
+
+
+def formatValue(value):
+	# repr() gives the shortest exact form of finite values
+	if value - value == 0.0:
+		return repr(value)
+	if value != value:
+		return 'NaN'
+	return '+Inf' if value > 0 else '-Inf'
+
+
+def cpuForClassID(classid):
+	# Circuits are placed in the HTB tree of CPU n with major n+1
+	return int(classid.split(':')[0], 16) - 1
+
+
+class MetricsExporter:
+
+	def __init__(self):
+		self.labelSetCache = {}
+		self.sections = {}
+		self.lock = threading.Lock()
+		self.body = b''
+		self.gzippedBody = None
+
+	def __labels(self, cacheKey, labels):
+		# Cached while the labels (e.g. a circuit's name or parent) stay the same
+		cached = self.labelSetCache.get(cacheKey)
+		if (cached == None) or (cached[0] != labels):
+			cached = (labels, labelSet(labels))
+			self.labelSetCache[cacheKey] = cached
+		return cached[1]
+
+	def __family(self, lines, name, metricType, helpText, samples):
+		# samples is a list of (labelSet, value), with value None to skip
+		lines.append('# HELP ' + name + ' ' + helpText)
+		lines.append('# TYPE ' + name + ' ' + metricType)
+		lines.extend([name + labels + ' ' + formatValue(value) for labels, value in samples if value != None])
+
+	def __circuitLabels(self, circuit, direction):
+		return self.__labels((circuit['classid'], direction), (("circuit_id", circuit['circuitID']), ("circuit", circuit['circuitName']), ("parent_node", circuit['ParentNode']), ("direction", direction.lower())))
+
+	def __nodeLabels(self, nodeName, direction=None):
+		if direction == None:
+			return self.__labels(('node', nodeName), (("node", nodeName),))
+		return self.__labels(('node', nodeName, direction), (("node", nodeName), ("direction", direction.lower())))
+
+	def updateBandwidth(self, subscriberCircuits, parentNodes):
+		# Call after getCircuitBandwidthStats() / getParentNodeBandwidthStats()
+		lines = []
+		circuitFamilies = [
+			('libreqos_circuit_bits_per_second', 'gauge', "Circuit throughput over the last poll", 'sinceLastQuery', 'bits'),
+			('libreqos_circuit_bytes_total', 'counter', "Bytes sent by the circuit's qdisc", 'currentQuery', 'bytesSent'),
+			('libreqos_circuit_packets_total', 'counter', "Packets sent by the circuit's qdisc", 'currentQuery', 'packetsSent'),
+			('libreqos_circuit_drops_total', 'counter', "Packets dropped by the circuit's qdisc", 'currentQuery', 'packetDrops'),
+		]
+		circuitLabels = [(self.__circuitLabels(circuit, 'Download'), self.__circuitLabels(circuit, 'Upload')) for circuit in subscriberCircuits]
+		for name, metricType, helpText, query, prefix in circuitFamilies:
+			keyDownload = prefix + 'Download'
+			keyUpload = prefix + 'Upload'
+			samples = []
+			for circuit, (labelsDownload, labelsUpload) in zip(subscriberCircuits, circuitLabels):
+				stats = circuit['stats'][query]
+				samples.append((labelsDownload, stats.get(keyDownload)))
+				samples.append((labelsUpload, stats.get(keyUpload)))
+			self.__family(lines, name, metricType, helpText, samples)
+
+		samples = []
+		for parentNode in parentNodes:
+			for direction in directions:
+				samples.append((self.__nodeLabels(parentNode['parentNodeName'], direction), parentNode['stats']['sinceLastQuery']['bits' + direction]))
+		self.__family(lines, 'libreqos_node_bits_per_second', 'gauge', "Parent node throughput over the last poll", samples)
+		samples = [(self.__nodeLabels(parentNode['parentNodeName']), parentNode['stats']['sinceLastQuery']['packetDropsTotal']) for parentNode in parentNodes]
+		self.__family(lines, 'libreqos_node_drops', 'gauge', "Packets dropped under the parent node over the last poll", samples)
+		samples = [(self.__nodeLabels(parentNode['parentNodeName']), parentNode['stats']['sinceLastQuery']['overloadFactorTotal']) for parentNode in parentNodes]
+		self.__family(lines, 'libreqos_node_overload_percent', 'gauge', "Share of packets dropped under the parent node over the last poll", samples)
+
+		# Per CPU (HTB major) totals
+		bitsForCPU = {}
+		circuitsForCPU = {}
+		for circuit in subscriberCircuits:
+			cpu = cpuForClassID(circuit['classid'])
+			if cpu not in bitsForCPU:
+				bitsForCPU[cpu] = [0.0, 0.0]
+				circuitsForCPU[cpu] = 0
+			for index, direction in enumerate(directions):
+				bitsForCPU[cpu][index] += circuit['stats']['sinceLastQuery'].get('bits' + direction, 0.0)
+			circuitsForCPU[cpu] += 1
+		samples = []
+		for cpu in sorted(bitsForCPU):
+			for index, direction in enumerate(directions):
+				samples.append((self.__labels(('cpu', cpu, direction), (("cpu", cpu), ("direction", direction.lower()))), bitsForCPU[cpu][index]))
+		self.__family(lines, 'libreqos_cpu_bits_per_second', 'gauge', "Throughput of the circuits shaped on each CPU over the last poll", samples)
+		samples = [(self.__labels(('cpu', cpu), (("cpu", cpu),)), circuitsForCPU[cpu]) for cpu in sorted(circuitsForCPU)]
+		self.__family(lines, 'libreqos_cpu_circuits', 'gauge', "Circuits shaped on each CPU", samples)
+		self.__setSection('bandwidth', lines)
+
+	def updateQueueLoad(self, queueLoad):
+		# Call after QueueLoad.update() (see cpuLoad.py)
+		lines = []
+		queueLabels = [(self.__queueLabels(entry, 'Download'), self.__queueLabels(entry, 'Upload')) for entry in queueLoad.queues]
+		for name, helpText, prefix in [
+			('libreqos_queue_bits_per_second', "Throughput of the circuits in each MQ queue over the last poll", 'bits'),
+			('libreqos_queue_packets', "Packets sent by the circuits in each MQ queue over the last poll", 'packets'),
+			('libreqos_queue_share', "Share of the total throughput carried by each MQ queue over the last poll", 'share'),
+		]:
+			samples = []
+			for entry, (labelsDownload, labelsUpload) in zip(queueLoad.queues, queueLabels):
+				samples.append((labelsDownload, entry[prefix + 'Download']))
+				samples.append((labelsUpload, entry[prefix + 'Upload']))
+			self.__family(lines, name, 'gauge', helpText, samples)
+		samples = []
+		for entry, (labelsDownload, labelsUpload) in zip(queueLoad.queues, queueLabels):
+			samples.append((labelsDownload, 1 if 'Download' in entry['imbalanced'] else 0))
+			samples.append((labelsUpload, 1 if 'Upload' in entry['imbalanced'] else 0))
+		self.__family(lines, 'libreqos_queue_imbalanced', 'gauge', "1 when the MQ queue carries more than its allowed share of the throughput", samples)
+		self.__setSection('queues', lines)
+
+	def __queueLabels(self, entry, direction):
+		return self.__labels(('queue', entry['queue'], direction), (("queue", hex(entry['queue'])), ("cpu", entry['cpu']), ("direction", direction.lower())))
+
+	def updateHost(self, hostSample):
+		# Call with HostTelemetry.sample() (see hostTelemetry.py)
+		lines = []
+		cpus = sorted(hostSample['cpus'])
+		for name, helpText, field in [
+			('libreqos_cpu_busy_percent', "Share of time the CPU was busy over the last poll", 'busyPercent'),
+			('libreqos_cpu_softirq_percent', "Share of time the CPU spent in softirqs over the last poll", 'softirqPercent'),
+			('libreqos_cpu_net_rx_softirqs_per_second', "NET_RX softirqs run on the CPU", 'netRxPerSecond'),
+			('libreqos_cpu_net_tx_softirqs_per_second', "NET_TX softirqs run on the CPU", 'netTxPerSecond'),
+		]:
+			self.__family(lines, name, 'gauge', helpText, [(self.__labels(('cpu', cpu), (("cpu", cpu),)), hostSample['cpus'][cpu][field]) for cpu in cpus])
+		queues = sorted(hostSample['queues'])
+		for name, helpText, field in [
+			('libreqos_nic_queue_interrupts_per_second', "Interrupts raised by the NIC queue", 'interruptsPerSecond'),
+			('libreqos_nic_queue_inflight_bytes', "Bytes queued to the NIC queue (byte queue limits)", 'inflightBytes'),
+			('libreqos_nic_queue_tx_timeouts', "Transmit timeouts of the NIC queue over the last poll", 'timeouts'),
+		]:
+			samples = [(self.__labels(('nic queue', interface, queue), (("interface", interface), ("queue", hex(queue + 1)), ("cpu", queue))), hostSample['queues'][(interface, queue)].get(field)) for interface, queue in queues]
+			self.__family(lines, name, 'gauge', helpText, samples)
+		for name, helpText, field in [
+			('libreqos_nic_rx_packets_per_second', "Packets received by the interface", 'rxPacketsPerSecond'),
+			('libreqos_nic_tx_packets_per_second', "Packets sent by the interface", 'txPacketsPerSecond'),
+			('libreqos_nic_rx_dropped_per_second', "Received packets dropped by the kernel", 'rxDroppedPerSecond'),
+			('libreqos_nic_rx_missed_per_second', "Packets dropped by the NIC because a receive ring was full", 'rxMissedPerSecond'),
+		]:
+			samples = [(self.__labels(('nic', interface), (("interface", interface),)), entry.get(field)) for interface, entry in sorted(hostSample['interfaces'].items())]
+			self.__family(lines, name, 'gauge', helpText, samples)
+		self.__setSection('host', lines)
+
+	def updateTins(self, tinsStats, tinStats=None):
+		# Global CAKE tin stats, plus per node / circuit when tinStats
+		# (see tinStats.py) was collected at that granularity
+		lines = []
+		for name, field, helpText in [
+			('libreqos_tin_sent_packets', 'sent_packets', "Packets sent in each CAKE tin over the last poll"),
+			('libreqos_tin_drop_percent', 'dropPercentage', "Dropped or ECN marked share of each CAKE tin over the last poll"),
+			('libreqos_tin_mark_percent', 'markPercentage', "ECN marked share of each CAKE tin over the last poll"),
+		]:
+			samples = []
+			for tin in tinNames:
+				for direction in directions:
+					samples.append((self.__labels(('tin', tin, direction), (("tin", tin), ("direction", direction.lower()))), tinsStats['sinceLastQuery'][tin][direction][field]))
+			self.__family(lines, name, 'gauge', helpText, samples)
+		if tinStats != None:
+			for name, rows, percentages, keyForRow, labelsForRow in [
+				('libreqos_node_tin_drop_percent', tinStats.nodeNames, tinStats.nodePercentages, lambda row: ('node', tinStats.nodeNames[row]), lambda row: (("node", tinStats.nodeNames[row]),)),
+				('libreqos_circuit_tin_drop_percent', tinStats.circuits, tinStats.circuitPercentages, lambda row: tinStats.circuits[row]['classid'], lambda row: (("circuit_id", tinStats.circuits[row]['circuitID']), ("parent_node", tinStats.circuits[row]['ParentNode']))),
+			]:
+				if len(percentages) == 0:
+					continue
+				samples = []
+				for (direction, tin), (sent, drops, marks) in sorted(percentages.items()):
+					tinLabels = (("tin", tinNames[tin]), ("direction", directions[direction].lower()))
+					for row in range(len(rows)):
+						if sent[row] > 0:
+							samples.append((self.__labels((keyForRow(row), 'tin', tin, direction), labelsForRow(row) + tinLabels), drops[row]))
+				self.__family(lines, name, 'gauge', "Dropped or ECN marked share of each CAKE tin over the last poll", samples)
+		self.__setSection('tins', lines)
+
+	def updateLatency(self, subscriberCircuits, parentNodes):
+		# Call after getCircuitLatencyStats() / getParentNodeLatencyStats()
+		lines = []
+		samples = []
+		for circuit in subscriberCircuits:
+			percentiles = circuit['stats']['sinceLastQuery'].get('tcpLatencyPercentiles')
+			if percentiles != None:
+				for percentile, value in percentiles.items():
+					samples.append((self.__labels((circuit['classid'], percentile), (("circuit_id", circuit['circuitID']), ("circuit", circuit['circuitName']), ("parent_node", circuit['ParentNode']), ("quantile", '0.' + percentile[1:]))), value))
+		self.__family(lines, 'libreqos_circuit_tcp_latency_ms', 'gauge', "TCP round trip time seen by xdp_pping, quantiles estimated from its per-poll summaries", samples)
+		samples = []
+		for parentNode in parentNodes:
+			percentiles = parentNode['stats']['sinceLastQuery'].get('tcpLatencyPercentiles')
+			if percentiles != None:
+				for percentile, value in percentiles.items():
+					samples.append((self.__labels(('node', parentNode['parentNodeName'], percentile), (("node", parentNode['parentNodeName']), ("quantile", '0.' + percentile[1:]))), value))
+		self.__family(lines, 'libreqos_node_tcp_latency_ms', 'gauge', "TCP round trip time of every circuit under the parent node, quantiles estimated from xdp_pping's per-poll summaries", samples)
+		self.__setSection('latency', lines)
+
+	def __setSection(self, section, lines):
+		lines.append('')
+		self.sections[section] = '\n'.join(lines).encode('utf-8')
+		body = b''.join(self.sections[name] for name in sectionOrder if name in self.sections)
+		with self.lock:
+			self.body = body
+			self.gzippedBody = None
+
+	def render(self, acceptGzip=False):
+		# Returns (body, contentEncoding)
+		with self.lock:
+			if not acceptGzip:
+				return self.body, None
+			if self.gzippedBody == None:
+				self.gzippedBody = gzip.compress(self.body, compresslevel=1)
+			return self.gzippedBody, 'gzip'
+
+
+def serveMetrics(exporter, address='0.0.0.0', port=9156):
+	# Serves /metrics from a background thread. Returns the server.
+	class MetricsHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path.split('?')[0] != '/metrics':
+				self.send_error(404)
+				return
+			body, contentEncoding = exporter.render('gzip' in self.headers.get('Accept-Encoding', ''))
+			self.send_response(200)
+			self.send_header('Content-Type', contentType)
+			if contentEncoding != None:
+				self.send_header('Content-Encoding', contentEncoding)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = ThreadingHTTPServer((address, port), MetricsHandler)
+	server.daemon_threads = True
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	return server
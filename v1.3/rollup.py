@@ -0,0 +1,81 @@
+# Local downsampling of circuit bandwidth before it is written to InfluxDB.
+# Each poll folds every circuit's rate into a row of running min / max /
+# sum counters; when a poll lands in a new window (aligned to the wall
+# clock), the finished window is returned as min / mean / max per circuit
+# and the counters start over.
+
+import math
+from array import array
+
+# Columns of a row
+minDownload, maxDownload, sumDownload, minUpload, maxUpload, sumUpload, sampleCount = range(7)
+columnsPerRow = 7
+emptyRow = array('d', [math.inf, -math.inf, 0.0, math.inf, -math.inf, 0.0, 0.0])
+
+
+class CircuitRollup:
+
+	def __init__(self, windowSeconds):
+		if windowSeconds <= 0:
+			raise ValueError("Rollup window must be a positive number of seconds")
+		self.windowSeconds = windowSeconds
+		self.windowStart = None
+		self.__reset()
+
+	def __reset(self):
+		self.rowForClassID = {}
+		self.circuitForRow = []
+		self.table = array('d')
+
+	def add(self, subscriberCircuits, timestamp):
+		# timestamp is the poll's time in seconds since the epoch. Returns
+		# (windowStart, [(circuit, (min, mean, max) download, (min, mean, max) upload)])
+		# when this poll closed a window, otherwise None.
+		window = math.floor(timestamp / self.windowSeconds) * self.windowSeconds
+		finished = None
+		if (self.windowStart != None) and (window != self.windowStart):
+			finished = self.__finish()
+		self.windowStart = window
+
+		table = self.table
+		for circuit in subscriberCircuits:
+			row = self.rowForClassID.get(circuit['classid'])
+			if row == None:
+				row = len(self.circuitForRow)
+				self.rowForClassID[circuit['classid']] = row
+				self.circuitForRow.append(circuit)
+				table.extend(emptyRow)
+			else:
+				# Keep the latest name / parent / plan for the tags
+				self.circuitForRow[row] = circuit
+			offset = row * columnsPerRow
+			bitsDownload = circuit['stats']['sinceLastQuery']['bitsDownload']
+			bitsUpload = circuit['stats']['sinceLastQuery']['bitsUpload']
+			if bitsDownload < table[offset + minDownload]:
+				table[offset + minDownload] = bitsDownload
+			if bitsDownload > table[offset + maxDownload]:
+				table[offset + maxDownload] = bitsDownload
+			table[offset + sumDownload] += bitsDownload
+			if bitsUpload < table[offset + minUpload]:
+				table[offset + minUpload] = bitsUpload
+			if bitsUpload > table[offset + maxUpload]:
+				table[offset + maxUpload] = bitsUpload
+			table[offset + sumUpload] += bitsUpload
+			table[offset + sampleCount] += 1.0
+		return finished
+
+	def __finish(self):
+		results = []
+		table = self.table
+		for row, circuit in enumerate(self.circuitForRow):
+			offset = row * columnsPerRow
+			count = table[offset + sampleCount]
+			if count > 0:
+				results.append((
+					circuit,
+					(table[offset + minDownload], table[offset + sumDownload] / count, table[offset + maxDownload]),
+					(table[offset + minUpload], table[offset + sumUpload] / count, table[offset + maxUpload]),
+				))
+		windowStart = self.windowStart
+		self.__reset()
+		return windowStart, results
@@ -1,8 +1,13 @@
+import json
 import time
 import schedule
 from LibreQoS import refreshShapers, refreshShapersUpdateOnly
-from graphInfluxDB import refreshBandwidthGraphs, refreshLatencyGraphs
-from ispConfig import influxDBEnabled, automaticImportUISP, automaticImportSplynx
+from graphInfluxDB import refreshBandwidthGraphs, refreshLatencyGraphs, metricsExporter, getPpingEntries
+from prometheusExporter import serveMetrics
+from statsPipeline import createStatsSupervisor
+from poller import Poller
+from latencyReader import LatencyReader, preloadClassIDs
+from ispConfig import influxDBEnabled, timeSeriesEnabled, prometheusEnabled, prometheusListenAddress, prometheusPort, automaticImportUISP, automaticImportSplynx, statsPollerCPUBudget, statsPipelineEnabled, statsPipelineMaxCircuits, interfaceA, interfaceB, fqOrCAKE, latencyReaderEnabled, latencyReaderPollSeconds
 if automaticImportUISP:
 	from integrationUISP import importFromUISP
 if automaticImportSplynx:
@@ -33,16 +38,39 @@ if __name__ == '__main__':
 	schedule.every().day.at("04:00").do(importAndShapeFullReload)
 	schedule.every(30).minutes.do(importAndShapePartialReload)
 	secondsBetweenGraphRefreshes = 10
+	cyclesBetweenLatencyRefreshes = 3
+	statsEnabled = influxDBEnabled or timeSeriesEnabled or prometheusEnabled
+	supervisor = None
+	if statsEnabled and statsPipelineEnabled:
+		# Stats are collected by worker processes (see statsPipeline.py), this
+		# process only reloads queues and keeps the workers running
+		supervisor = createStatsSupervisor([interfaceA, interfaceB], secondsBetweenGraphRefreshes, statsPollerCPUBudget, statsPipelineMaxCircuits,
+			'cake diffserv4' in fqOrCAKE, True, cyclesBetweenLatencyRefreshes)
+		supervisor.start()
+	elif prometheusEnabled:
+		serveMetrics(metricsExporter, prometheusListenAddress, prometheusPort)
+	latencyReader = None
+	if statsEnabled and (supervisor == None) and latencyReaderEnabled:
+		try:
+			with open('statsByCircuit.json', 'r') as j:
+				preloadClassIDs([circuit['classid'] for circuit in json.loads(j.read())])
+		except:
+			pass
+		latencyReader = LatencyReader(getPpingEntries, latencyReaderPollSeconds).start()
+	poller = Poller(secondsBetweenGraphRefreshes, cpuBudget=statsPollerCPUBudget)
 	while True:
 		schedule.run_pending()
-		if influxDBEnabled:
-			try:
-				for i in range(3):
-					refreshBandwidthGraphs()
-					time.sleep(secondsBetweenGraphRefreshes)
-				refreshLatencyGraphs()
-				time.sleep(secondsBetweenGraphRefreshes)
-			except:
-				print("Failed to update graphs")
+		if supervisor != None:
+			supervisor.check()
+			time.sleep(1)
+		elif statsEnabled:
+			cycle = poller.waitForNextCycle()
+			with poller.measure():
+				try:
+					refreshBandwidthGraphs(poller.metrics())
+					if cycle % cyclesBetweenLatencyRefreshes == 0:
+						refreshLatencyGraphs(latencyReader.readPpingEntries if latencyReader != None else getPpingEntries)
+				except:
+					print("Failed to update graphs")
 		else:
 			time.sleep(60)
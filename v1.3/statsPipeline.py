@@ -0,0 +1,331 @@
+# Multi-process stats collection.
+# One worker per interface runs the tc dump, one runs xdp_pping, and one
+# (the exporter) computes deltas and writes InfluxDB / time series /
+# Prometheus output. Readers publish their latest sample as a flat array
+# of counters in shared memory, guarded by a sequence number (seqlock), so
+# the exporter always works from the most recent complete sample and a
+# slow stage only delays itself. A supervisor, run from scheduler.py,
+# restarts workers that exit or stop reporting. The exporter rewrites
+# statsByCircuit.json and statsByParentNode.json under statsFilesLock(),
+# which LibreQoS.py also takes to save a reload's circuits, so the two
+# can't overwrite each other.
+
+import fcntl
+import multiprocessing
+import struct
+import time
+from array import array
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+from poller import Poller
+from tinStats import tinNames
+
+# sequence (odd while a write is in progress), rows, sample time
+headerFormat = '<QQd'
+headerSize = 64
+# Sequence of the last write a reader marked as read, after the header fields
+readFormat = '<Q'
+readOffset = struct.calcsize(headerFormat)
+
+# classid major, classid minor, bytes, packets, drops, then per tin:
+# sent_packets, drops, ack_drops, ecn_mark
+tinCounterNames = ['sent_packets', 'drops', 'ack_drops', 'ecn_mark']
+interfaceRowWidth = 5 + (len(tinNames) * len(tinCounterNames))
+# tc major, tc minor, avg, min, max, median, samples
+latencyFieldNames = ['avg', 'min', 'max', 'median', 'samples']
+latencyRowWidth = 2 + len(latencyFieldNames)
+# Rows of xdp_pping summaries kept per circuit for each latency refresh
+# (more are merged down to this many, see thinEntries())
+latencyRowsPerCircuit = 8
+
+
+@contextmanager
+def statsFilesLock(path='statsFiles.lock'):
+	# An exclusive flock() held while the stats files are read and rewritten
+	with open(path, 'a') as lockFile:
+		fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+		yield
+
+
+def warnIfTruncated(name, written, rowCount, dropped):
+	# Reports rows past statsPipelineMaxCircuits when their number changes,
+	# and returns the new number
+	if (rowCount - written) not in (dropped, 0):
+		print(name + ": " + str(rowCount - written) + " of " + str(rowCount) + " rows don't fit in statsPipelineMaxCircuits (" + str(written) + ") and are not graphed")
+	return rowCount - written
+
+
+class CounterBlock:
+	# A shared memory block holding rows of float64 counters
+
+	def __init__(self, name, rowWidth, capacity, create=False):
+		self.rowWidth = rowWidth
+		self.capacity = capacity
+		size = headerSize + (8 * rowWidth * capacity)
+		if create:
+			try:
+				# Left over from a collector that didn't shut down cleanly
+				stale = shared_memory.SharedMemory(name=name)
+				stale.close()
+				stale.unlink()
+			except FileNotFoundError:
+				pass
+			self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+			struct.pack_into(headerFormat, self.memory.buf, 0, 0, 0, 0.0)
+			struct.pack_into(readFormat, self.memory.buf, readOffset, 0)
+		else:
+			self.memory = shared_memory.SharedMemory(name=name)
+
+	def write(self, rows, sampleTime):
+		# rows is a flat array('d'), rowWidth values per row. Rows past
+		# the capacity are dropped.
+		rowCount = min(len(rows) // self.rowWidth, self.capacity)
+		buffer = self.memory.buf
+		sequence = struct.unpack_from(headerFormat, buffer, 0)[0]
+		struct.pack_into(headerFormat, buffer, 0, sequence + 1, rowCount, sampleTime)
+		end = headerSize + (8 * self.rowWidth * rowCount)
+		buffer[headerSize:end] = memoryview(rows).cast('B')[0:end - headerSize]
+		struct.pack_into(headerFormat, buffer, 0, sequence + 2, rowCount, sampleTime)
+		return rowCount
+
+	def snapshot(self, attempts=100):
+		# Returns (sequence, rows, sampleTime) of the last complete write,
+		# or None if nothing has been written yet
+		buffer = self.memory.buf
+		for attempt in range(attempts):
+			sequence, rowCount, sampleTime = struct.unpack_from(headerFormat, buffer, 0)
+			if sequence == 0:
+				return None
+			if sequence % 2 == 0:
+				rows = array('d')
+				rows.frombytes(buffer[headerSize:headerSize + (8 * self.rowWidth * rowCount)])
+				if struct.unpack_from(headerFormat, buffer, 0)[0] == sequence:
+					return sequence, rows, sampleTime
+			time.sleep(0.001)
+		raise TimeoutError("Shared counter block is being rewritten continuously")
+
+	def markRead(self, sequence):
+		struct.pack_into(readFormat, self.memory.buf, readOffset, sequence)
+
+	def unread(self):
+		# True when the last complete write hasn't been marked as read
+		sequence = struct.unpack_from(headerFormat, self.memory.buf, 0)[0]
+		return (sequence != 0) and (struct.unpack_from(readFormat, self.memory.buf, readOffset)[0] != sequence)
+
+	def close(self, unlink=False):
+		self.memory.close()
+		if unlink:
+			self.memory.unlink()
+
+
+def classIDParts(classid):
+	major, minor = classid.split(':')
+	return float(int(major, 16)), float(int(minor, 16))
+
+
+def interfaceRows(jsonDict):
+	# getInterfaceStats() output -> flat counter rows
+	rows = array('d')
+	for classid, element in jsonDict.items():
+		major, minor = classIDParts(classid)
+		rows.extend((major, minor, float(element['bytes']), float(element['packets']), float(element['drops'])))
+		tins = element.get('tins', [])[:len(tinNames)]
+		for tin in tins:
+			rows.extend(float(tin.get(counter, 0)) for counter in tinCounterNames)
+		rows.extend([0.0] * (len(tinCounterNames) * (len(tinNames) - len(tins))))
+	return rows
+
+
+def interfaceDict(rows, hasTins):
+	# Flat counter rows -> the {classid: element} layout of getInterfaceStats()
+	jsonDict = {}
+	for offset in range(0, len(rows), interfaceRowWidth):
+		classid = hex(int(rows[offset])) + ':' + hex(int(rows[offset + 1]))
+		element = {'bytes': rows[offset + 2], 'packets': rows[offset + 3], 'drops': rows[offset + 4]}
+		if hasTins:
+			element['tins'] = [dict(zip(tinCounterNames, rows[tinOffset:tinOffset + len(tinCounterNames)])) for tinOffset in range(offset + 5, offset + interfaceRowWidth, len(tinCounterNames))]
+		jsonDict[classid] = element
+	return jsonDict
+
+
+def latencyRows(listOfEntries):
+	rows = array('d')
+	for entry in listOfEntries:
+		if 'tc' in entry:
+			major, minor = entry['tc'].split(':')
+			rows.extend((float(major), float(minor)))
+			rows.extend(float(entry.get(field, entry['avg'] if field != 'samples' else 1)) for field in latencyFieldNames)
+	return rows
+
+
+def latencyEntries(rows):
+	listOfEntries = []
+	for offset in range(0, len(rows), latencyRowWidth):
+		entry = dict(zip(latencyFieldNames, rows[offset + 2:offset + latencyRowWidth]))
+		entry['tc'] = str(int(rows[offset])) + ':' + str(int(rows[offset + 1]))
+		entry['samples'] = int(entry['samples'])
+		listOfEntries.append(entry)
+	return listOfEntries
+
+
+class SnapshotReader:
+	# Used by the exporter in place of running tc / xdp_pping itself
+
+	def __init__(self, interfaceBlocks, latencyBlock, hasTins):
+		self.interfaceBlocks = interfaceBlocks
+		self.latencyBlock = latencyBlock
+		self.hasTins = hasTins
+		self.lastSequences = {}
+
+	def hasNewSamples(self):
+		# True when every interface has a sample the exporter hasn't used yet
+		for interface, block in self.interfaceBlocks.items():
+			header = struct.unpack_from(headerFormat, block.memory.buf, 0)
+			if (header[0] == 0) or (header[0] == self.lastSequences.get(interface)):
+				return False
+		return True
+
+	def readInterfaceStats(self, interface):
+		sequence, rows, sampleTime = self.interfaceBlocks[interface].snapshot()
+		self.lastSequences[interface] = sequence
+		return interfaceDict(rows, self.hasTins), sampleTime
+
+	def readPpingEntries(self):
+		snapshot = self.latencyBlock.snapshot()
+		if snapshot == None:
+			return [], time.time_ns()
+		sequence, rows, sampleTime = snapshot
+		self.latencyBlock.markRead(sequence)
+		return latencyEntries(rows), round(sampleTime * 1000000000)
+
+
+def interfaceReaderWorker(block, interface, intervalSeconds, heartbeat):
+	from graphInfluxDB import getInterfaceStats
+	poller = Poller(intervalSeconds)
+	dropped = 0
+	while True:
+		poller.waitForNextCycle()
+		jsonDict, sampleTime = getInterfaceStats(interface)
+		dropped = warnIfTruncated('tc ' + interface, block.write(interfaceRows(jsonDict), sampleTime), len(jsonDict), dropped)
+		heartbeat.value = time.monotonic()
+
+
+def latencyReaderWorker(block, intervalSeconds, heartbeat):
+	from graphInfluxDB import getPpingEntries
+	from ispConfig import latencyReaderEnabled, latencyReaderPollSeconds
+	from latencyReader import thinEntries
+	ppingReader = getPpingEntries
+	if latencyReaderEnabled:
+		from latencyReader import LatencyReader
+		ppingReader = LatencyReader(getPpingEntries, latencyReaderPollSeconds).start().readPpingEntries
+	poller = Poller(intervalSeconds)
+	dropped = 0
+	while True:
+		poller.waitForNextCycle()
+		listOfEntries, sampleTimeNs = ppingReader()
+		# The exporter hasn't read the previous window yet (it runs on its
+		# own clock), so carry it into this one rather than overwrite it
+		if block.unread():
+			snapshot = block.snapshot()
+			if snapshot != None:
+				listOfEntries = latencyEntries(snapshot[1]) + listOfEntries
+		# Each poll's summary is kept while they fit, so the exporter can
+		# sketch the spread within the window
+		listOfEntries = thinEntries(listOfEntries, block.capacity)
+		dropped = warnIfTruncated('xdp_pping', block.write(latencyRows(listOfEntries), sampleTimeNs / 1000000000.0), len(listOfEntries), dropped)
+		heartbeat.value = time.monotonic()
+
+
+def exporterWorker(reader, intervalSeconds, cpuBudget, cyclesBetweenLatencyRefreshes, heartbeat):
+	from graphInfluxDB import refreshBandwidthGraphs, refreshLatencyGraphs, metricsExporter
+	from ispConfig import prometheusEnabled, prometheusListenAddress, prometheusPort
+	if prometheusEnabled:
+		from prometheusExporter import serveMetrics
+		serveMetrics(metricsExporter, prometheusListenAddress, prometheusPort)
+	# Run half an interval behind the readers, so each cycle finds a fresh sample
+	time.sleep(intervalSeconds / 2.0)
+	poller = Poller(intervalSeconds, cpuBudget=cpuBudget)
+	while True:
+		cycle = poller.waitForNextCycle()
+		heartbeat.value = time.monotonic()
+		with poller.measure():
+			try:
+				if reader.hasNewSamples():
+					refreshBandwidthGraphs(poller.metrics(), reader.readInterfaceStats)
+				if (cycle % cyclesBetweenLatencyRefreshes == 0) and (reader.latencyBlock != None):
+					refreshLatencyGraphs(reader.readPpingEntries)
+			except:
+				print("Failed to update graphs")
+
+
+class Supervisor:
+	# Keeps one process per worker running. Each worker is called with its
+	# args plus a shared heartbeat value, which it should set to
+	# time.monotonic() every cycle.
+
+	def __init__(self, hungAfterSeconds=60.0):
+		self.context = multiprocessing.get_context('fork')
+		# A worker that hasn't finished a cycle in this long is restarted
+		self.hungAfterSeconds = hungAfterSeconds
+		self.workers = {}
+		# Shared memory blocks to unlink on stop()
+		self.blocks = []
+
+	def addWorker(self, name, target, args):
+		self.workers[name] = {'target': target, 'args': args, 'process': None, 'heartbeat': self.context.Value('d', 0.0), 'startTime': None, 'restarts': 0}
+
+	def __start(self, name):
+		worker = self.workers[name]
+		worker['heartbeat'].value = 0.0
+		worker['process'] = self.context.Process(target=worker['target'], args=worker['args'] + (worker['heartbeat'],), name='LibreQoS ' + name, daemon=True)
+		worker['process'].start()
+		worker['startTime'] = time.monotonic()
+
+	def start(self):
+		for name in self.workers:
+			self.__start(name)
+
+	def check(self):
+		# Restarts workers that have exited or stopped reporting. Call
+		# this every second or so.
+		now = time.monotonic()
+		for name, worker in self.workers.items():
+			process = worker['process']
+			lastSeen = max(worker['heartbeat'].value, worker['startTime'])
+			if not process.is_alive():
+				print("Stats worker '" + name + "' exited (" + str(process.exitcode) + "), restarting it")
+			elif (now - lastSeen) > self.hungAfterSeconds:
+				print("Stats worker '" + name + "' stopped responding, restarting it")
+				process.kill()
+				process.join(5)
+			else:
+				continue
+			worker['restarts'] += 1
+			self.__start(name)
+
+	def metrics(self):
+		return {name: {'alive': worker['process'].is_alive(), 'restarts': worker['restarts']} for name, worker in self.workers.items()}
+
+	def stop(self):
+		for worker in self.workers.values():
+			if worker['process'] != None:
+				worker['process'].kill()
+				worker['process'].join(5)
+		for block in self.blocks:
+			block.close(unlink=True)
+
+
+def createStatsSupervisor(interfaces, intervalSeconds, cpuBudget, capacity, hasTins, latencyEnabled, cyclesBetweenLatencyRefreshes=3):
+	# Sets up the shared memory and the tc, xdp_pping and exporter workers
+	supervisor = Supervisor(hungAfterSeconds=max(60.0, intervalSeconds * 6))
+	interfaceBlocks = {interface: CounterBlock('libreqos_' + interface, interfaceRowWidth, capacity, create=True) for interface in interfaces}
+	latencyBlock = CounterBlock('libreqos_latency', latencyRowWidth, capacity * latencyRowsPerCircuit, create=True) if latencyEnabled else None
+	supervisor.blocks = list(interfaceBlocks.values()) + ([latencyBlock] if latencyBlock != None else [])
+	for interface, block in interfaceBlocks.items():
+		supervisor.addWorker('tc ' + interface, interfaceReaderWorker, (block, interface, intervalSeconds))
+	if latencyEnabled:
+		supervisor.addWorker('xdp_pping', latencyReaderWorker, (latencyBlock, intervalSeconds * cyclesBetweenLatencyRefreshes))
+	reader = SnapshotReader(interfaceBlocks, latencyBlock, hasTins)
+	supervisor.addWorker('exporter', exporterWorker, (reader, intervalSeconds, cpuBudget, cyclesBetweenLatencyRefreshes))
+	return supervisor
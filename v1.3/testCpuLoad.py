@@ -0,0 +1,59 @@
+import unittest
+
+def makeCircuit(classid, bitsDownload, bitsUpload):
+    return {'classid': classid, 'stats': {'sinceLastQuery': {'bitsDownload': bitsDownload, 'bitsUpload': bitsUpload,
+        'packetsSentDownload': bitsDownload / 12000, 'packetsSentUpload': bitsUpload / 12000, 'packetDropsDownload': 0.0, 'packetDropsUpload': 1.0}}}
+
+queuingStructure = {'Network': {
+    'Site_1': {'classMajor': '0x1', 'cpuNum': '0x0', 'downloadBandwidthMbps': 1000, 'uploadBandwidthMbps': 1000,
+        'children': {'AP_A': {'classMajor': '0x1', 'cpuNum': '0x0', 'downloadBandwidthMbps': 500, 'uploadBandwidthMbps': 500, 'circuits': [{}, {}]}}},
+    'Site_2': {'classMajor': '0x2', 'cpuNum': '0x1', 'downloadBandwidthMbps': 1000, 'uploadBandwidthMbps': 1000, 'circuits': [{}]},
+    'Site_3': {'classMajor': '0x3', 'cpuNum': '0x2', 'downloadBandwidthMbps': 200, 'uploadBandwidthMbps': 200},
+}}
+
+class TestCpuLoad(unittest.TestCase):
+    def test_queue_plan(self):
+        """
+        Test reading the queue / CPU layout of top level nodes from queuingStructure.json
+        """
+        from cpuLoad import queuePlan
+        plan = queuePlan(queuingStructure)
+        self.assertEqual(sorted(plan), [1, 2, 3])
+        self.assertEqual(plan[1], {'cpu': 0, 'nodes': ['Site_1'], 'circuits': 2, 'downloadMbps': 1000, 'uploadMbps': 1000})
+        self.assertEqual(plan[2]['circuits'], 1)
+
+    def test_imbalance(self):
+        """
+        Test per queue and per CPU totals, and that a queue over its share is flagged
+        """
+        from cpuLoad import QueueLoad, queuePlan
+        queueLoad = QueueLoad(imbalanceShare=0.6)
+        queueLoad.plan = queuePlan(queuingStructure)
+        queues = queueLoad.update([makeCircuit('0x1:0x5', 80000000.0, 5000000.0), makeCircuit('0x1:0x6', 10000000.0, 5000000.0), makeCircuit('0x2:0x3', 10000000.0, 10000000.0)])
+        self.assertEqual([entry['queue'] for entry in queues], [1, 2, 3])
+        self.assertEqual(queues[0]['bitsDownload'], 90000000.0)
+        self.assertEqual(queues[0]['activeCircuits'], 2)
+        self.assertEqual(queues[0]['shareDownload'], 0.9)
+        self.assertEqual(queues[0]['imbalanced'], ['Download'])
+        self.assertEqual(queues[1]['imbalanced'], [])
+        # Planned but idle queues are still reported
+        self.assertEqual(queues[2]['bitsDownload'], 0.0)
+        self.assertEqual([entry['queue'] for entry in queueLoad.imbalanced()], [1])
+        cpus = queueLoad.cpus()
+        self.assertEqual(cpus[0]['queues'], [1])
+        self.assertEqual(cpus[0]['bits'], 100000000.0)
+        self.assertAlmostEqual(cpus[0]['packets'], 100000000.0 / 12000)
+        self.assertEqual(cpus[0]['drops'], 2.0)
+
+    def test_low_traffic(self):
+        """
+        Test that shares are not flagged while there is little traffic
+        """
+        from cpuLoad import QueueLoad
+        queueLoad = QueueLoad(imbalanceShare=0.5)
+        queueLoad.update([makeCircuit('0x1:0x3', 1000000.0, 0.0), makeCircuit('0x2:0x3', 0.0, 0.0)])
+        self.assertEqual(queueLoad.imbalanced(), [])
+        self.assertEqual(queueLoad.queues[1]['cpu'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+class TestExportSchema(unittest.TestCase):
+    def test_tag_pairs(self):
+        """
+        Test circuit and node tags under each schema
+        """
+        from exportSchema import circuitTagPairs, nodeTagPairs, getNodeDetails
+        circuit = {'circuitID': '17', 'circuitName': '1 Main St', 'ParentNode': 'AP_A'}
+        self.assertEqual(circuitTagPairs(circuit, 'names'), (("Circuit", "1 Main St"), ("ParentNode", "AP_A"), ("Type", "Circuit")))
+        self.assertEqual(circuitTagPairs(circuit, 'ids'), (("CircuitID", "17"), ("Type", "Circuit")))
+        nodeDetails = getNodeDetails({'Site_1': {'id': 42, 'children': {'AP_A': {}}}})
+        self.assertEqual(nodeDetails['AP_A'], {'id': 'AP_A', 'path': 'Site_1/AP_A'})
+        self.assertEqual(nodeTagPairs('Site_1', nodeDetails, 'ids'), (("NodeID", "42"), ("Type", "Parent Node")))
+        self.assertEqual(nodeTagPairs('Site_1', nodeDetails, 'names'), (("Device", "Site_1"), ("ParentNode", "Site_1"), ("Type", "Parent Node")))
+
+    def test_metadata_only_when_changed(self):
+        """
+        Test that metadata is written for new and changed circuits, and for
+        everything once the refresh interval has passed
+        """
+        from exportSchema import MetadataPublisher, getNodeDetails
+        nodeDetails = getNodeDetails({'Site_1': {'children': {'AP_A': {}, 'AP_B': {}}}})
+        circuits = [{'circuitID': str(i), 'circuitName': 'C' + str(i), 'ParentNode': 'AP_A', 'maxDownload': 100, 'maxUpload': 20} for i in range(3)]
+        parentNodes = [{'parentNodeName': 'AP_A', 'maxDownload': 500, 'maxUpload': 500}]
+        publisher = MetadataPublisher(refreshSeconds=3600)
+        circuitRows, nodeRows = publisher.pending(circuits, parentNodes, nodeDetails, 1000.0)
+        self.assertEqual((len(circuitRows), len(nodeRows)), (3, 1))
+        self.assertIn(("Path", "Site_1/AP_A"), circuitRows[0][1])
+        self.assertEqual(publisher.pending(circuits, parentNodes, nodeDetails, 1010.0), ([], []))
+        circuits[1]['ParentNode'] = 'AP_B'
+        circuitRows, nodeRows = publisher.pending(circuits, parentNodes, nodeDetails, 1020.0)
+        self.assertEqual([row[0] for row in circuitRows], [(("CircuitID", "1"), ("Type", "Circuit"))])
+        circuitRows, nodeRows = publisher.pending(circuits, parentNodes, nodeDetails, 4600.0)
+        self.assertEqual((len(circuitRows), len(nodeRows)), (3, 1))
+
+    def test_cardinality_estimate(self):
+        """
+        Test counting queuingStructure.json and estimating series
+        """
+        from exportSchema import countQueuingStructure, estimateSeries
+        queuingStructure = {'Network': {
+            'Site_1': {'circuits': [{}], 'children': {'AP_A': {'circuits': [{}, {}]}, 'AP_B': {}}},
+            'Site_2': {'circuits': [{}]},
+        }}
+        self.assertEqual(countQueuingStructure(queuingStructure), (4, 4))
+        names = estimateSeries(4, 4, 'names')
+        self.assertEqual(names['Bandwidth'], 4 * 2 + 4 * 2)
+        self.assertEqual(names['Tins'], 24)
+        ids = estimateSeries(4, 4, 'ids', tinStatsGranularity='circuit')
+        self.assertEqual(ids['Circuit Metadata'], 24)
+        self.assertEqual(ids['Tin Drop/Mark Percentage'], 8 * 16)
+        rolledUp = estimateSeries(1000, 100000, 'ids', circuitRollupSeconds=300, heavyHitterCount=50)
+        self.assertEqual(rolledUp['Utilization'], 100 * 2 + 1000 * 2)
+        self.assertEqual(rolledUp['Bandwidth Rollup'], 600000)
+
+if __name__ == '__main__':
+    unittest.main()
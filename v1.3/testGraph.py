@@ -129,6 +129,37 @@ class TestGraph(unittest.TestCase):
         self.assertEqual(graph.findChildIndices(2), [5])
         self.assertEqual(graph.findChildIndices(3), [])
 
+    def test_indexes_follow_changes(self):
+        """
+        Tests that the id, name and child lookups stay
+        correct when nodes are renamed, reparented directly
+        or appended to graph.nodes without addRawNode.
+        """
+        from integrationCommon import NetworkGraph, NetworkNode, NodeType
+        graph = NetworkGraph()
+        graph.addRawNode(NetworkNode("Site 1"))
+        graph.addRawNode(NetworkNode("Site 2"))
+        graph.addRawNode(NetworkNode("Client 1", parentId="Site 1", type=NodeType.client))
+        graph.addRawNode(NetworkNode("Site 1", "Duplicate"))
+        self.assertEqual(graph.findNodeIndexById("Site 1"), 1) # First match
+        graph._NetworkGraph__reparentById()
+        self.assertEqual(graph.findChildIndices(4), [3]) # Reparenting takes the last match
+        self.assertEqual(graph.findChildIndices(1), [])
+        graph.nodes[3].parentIndex = 2
+        self.assertEqual(graph.findChildIndices(2), [3])
+        self.assertEqual(graph.findChildIndices(4), [])
+        graph.nodes[2].id = "Site 3"
+        graph.nodes[2].displayName = "Site Three"
+        self.assertEqual(graph.findNodeIndexById("Site 2"), -1)
+        self.assertEqual(graph.findNodeIndexById("Site 3"), 2)
+        self.assertEqual(graph.findNodeIndexByName("Site Three"), 2)
+        graph.nodes.append(NetworkNode("Client 2", parentId="Site 3", type=NodeType.client))
+        self.assertEqual(graph.findNodeIndexById("Client 2"), 5)
+        graph.replaceRootNote(NetworkNode("Root", type=NodeType.root))
+        self.assertEqual(graph.findNodeIndexById("FakeRoot"), -1)
+        self.assertEqual(graph.findNodeIndexById("Root"), 0)
+        self.assertEqual(graph.findChildIndices(0), [0, 1, 2, 4, 5])
+
     def test_clients_with_children(self):
         """
         Tests handling cases where a client site
@@ -215,6 +246,26 @@ class TestGraph(unittest.TestCase):
         self.assertEqual(len(unconnected), 0)
         self.assertEqual(graph.nodes[6].parentIndex, 0)
 
+    def test_reconnect_in_priority_order(self):
+        """
+        Tests that orphaned sites are reattached before
+        clients, so clients under an orphaned site stay
+        under it, and that the reattached nodes are reported.
+        """
+        from integrationCommon import NetworkGraph, NetworkNode, NodeType
+        graph = NetworkGraph()
+        graph.addRawNode(NetworkNode("Site 1"))
+        graph.addRawNode(NetworkNode("Site 2", parentId="Site 3"))
+        graph.addRawNode(NetworkNode("Site 3", parentId="Site 2"))
+        graph.addRawNode(NetworkNode("Client 1", parentId="Site 2", type=NodeType.client))
+        graph.addRawNode(NetworkNode("Client 2", parentId="Client 3", type=NodeType.client))
+        graph.addRawNode(NetworkNode("Client 3", parentId="Client 2", type=NodeType.client))
+        graph._NetworkGraph__reparentById()
+        reattached = graph._NetworkGraph__reconnectUnconnected()
+        self.assertEqual(reattached, [2, 3, 5, 6]) # Both sites of the loop, then both clients of the loop
+        self.assertEqual(graph.nodes[4].parentIndex, 2) # Client 1 stays under Site 2
+        self.assertEqual(graph._NetworkGraph__findUnconnectedNodes(), [])
+
     def test_network_json_exists(self):
         from integrationCommon import NetworkGraph
         import os
@@ -278,6 +329,52 @@ class TestGraph(unittest.TestCase):
         self.assertEqual(len(ipv6), 1)
         self.assertEqual(ipv6[0], "dead::beef/64")
 
+    def test_shaped_devices_changes(self):
+        """
+        Tests that ShapedDevices.csv is only rewritten when it
+        changes, and that the change summary lists the circuits
+        added, removed and modified
+        """
+        from integrationCommon import NetworkGraph, NetworkNode, NodeType, loadShapedDevicesChanges
+        import json
+        import os
+        import shutil
+        import tempfile
+        def build(plans):
+            net = NetworkGraph()
+            net.addRawNode(NetworkNode("Site_1", "Site_1", "", NodeType.site, 1000, 1000))
+            for n, download in enumerate(plans):
+                net.addRawNode(NetworkNode("Client_" + str(n), "Client_" + str(n), "Site_1", NodeType.client, download, 20, address=str(n) + " Main St"))
+                net.addRawNode(NetworkNode("Device_" + str(n), "Device_" + str(n), "Client_" + str(n), NodeType.device, ipv4=["100.64.0." + str(n)]))
+            net.prepareTree()
+            net.createShapedDevices()
+        workingDirectory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                build([100, 100, 100])
+                with open('ShapedDevices.changes.json') as file:
+                    changes = json.load(file)
+                self.assertEqual((changes["added"], changes["removed"], changes["modified"]), (["0", "1", "2"], [], []))
+                shutil.copyfile('ShapedDevices.csv', 'ShapedDevices.lastLoaded.csv')
+                self.assertEqual(loadShapedDevicesChanges('ShapedDevices.lastLoaded.csv', 'ShapedDevices.csv')["modified"], [])
+
+                os.utime('ShapedDevices.csv', (0, 0))
+                build([100, 100, 100])
+                self.assertEqual(os.stat('ShapedDevices.csv').st_mtime, 0) # Not rewritten
+
+                build([100, 250])
+                changes = loadShapedDevicesChanges('ShapedDevices.lastLoaded.csv', 'ShapedDevices.csv')
+                self.assertEqual((changes["added"], changes["removed"], changes["modified"]), ([], ["2"], ["1"]))
+                self.assertEqual([name for name in os.listdir('.') if '.tmp.' in name], [])
+
+                # Two imports without a reload in between can't be
+                # described by the last summary
+                build([100, 250, 100, 100])
+                self.assertEqual(loadShapedDevicesChanges('ShapedDevices.lastLoaded.csv', 'ShapedDevices.csv'), None)
+            finally:
+                os.chdir(workingDirectory)
+
     def test_site_exclusion(self):
         from integrationCommon import NetworkGraph, NetworkNode, NodeType
         net = NetworkGraph()
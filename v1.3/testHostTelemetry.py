@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+def writeHost(root, statJiffies, netRx, interrupts, txTimeouts, rxPackets):
+    # A minimal /proc and /sys/class/net for two CPUs and eth1
+    proc = os.path.join(root, 'proc')
+    queue = os.path.join(root, 'net', 'eth1', 'queues', 'tx-1')
+    statistics = os.path.join(root, 'net', 'eth1', 'statistics')
+    for path in [proc, os.path.join(queue, 'byte_queue_limits'), statistics]:
+        os.makedirs(path, exist_ok=True)
+    with open(os.path.join(proc, 'stat'), 'w') as f:
+        f.write('cpu  0 0 0 0 0 0 0 0 0 0\n')
+        for cpu, (busy, idle, softirq) in enumerate(statJiffies):
+            f.write('cpu' + str(cpu) + ' ' + str(busy) + ' 0 0 ' + str(idle) + ' 0 0 ' + str(softirq) + ' 0 0 0\n')
+        f.write('intr 0\n')
+    with open(os.path.join(proc, 'softirqs'), 'w') as f:
+        f.write('                    CPU0       CPU1\n          HI:          0          0\n')
+        f.write('      NET_TX:          1          2\n      NET_RX:  ' + '  '.join(str(value) for value in netRx) + '\n')
+    with open(os.path.join(proc, 'interrupts'), 'w') as f:
+        f.write('           CPU0       CPU1\n')
+        f.write(' 40:  ' + '  '.join(str(value) for value in interrupts) + '  PCI-MSI 1-edge  eth1-TxRx-1\n')
+        f.write(' 41:  5  5  PCI-MSI 2-edge  other-TxRx-1\n')
+        f.write('NMI:  0  0  Non-maskable interrupts\n')
+    with open(os.path.join(queue, 'tx_timeout'), 'w') as f:
+        f.write(str(txTimeouts) + '\n')
+    with open(os.path.join(queue, 'byte_queue_limits', 'inflight'), 'w') as f:
+        f.write('3000\n')
+    with open(os.path.join(statistics, 'rx_packets'), 'w') as f:
+        f.write(str(rxPackets) + '\n')
+
+class TestHostTelemetry(unittest.TestCase):
+    def test_sample(self):
+        """
+        Test CPU, softirq, NIC queue and interface rates between two samples
+        """
+        from hostTelemetry import HostTelemetry, correlateQueues
+        with tempfile.TemporaryDirectory() as root:
+            writeHost(root, [(100, 100, 10), (100, 100, 10)], [1000, 2000], [50, 0], 1, 10)
+            telemetry = HostTelemetry(['eth1'], os.path.join(root, 'proc'), os.path.join(root, 'net'))
+            try:
+                self.assertIsNone(telemetry.sample(now=10.0))
+                writeHost(root, [(150, 150, 30), (110, 190, 10)], [1500, 2000], [50, 400], 3, 210)
+                sample = telemetry.sample(now=12.0)
+            finally:
+                telemetry.close()
+        self.assertEqual(sample['cpus'][0], {'busyPercent': 58.3, 'softirqPercent': 16.7, 'netRxPerSecond': 250.0, 'netTxPerSecond': 0.0})
+        self.assertEqual(sample['cpus'][1]['busyPercent'], 10.0)
+        self.assertEqual(sample['queues'][('eth1', 1)], {'inflightBytes': 3000, 'timeouts': 2, 'interruptsPerSecond': 200.0, 'interruptCPU': 1})
+        self.assertEqual(sample['interfaces']['eth1'], {'rxPacketsPerSecond': 100.0})
+        # LibreQoS queue 0x2 is shaped on NIC queue 1 and CPU 1
+        queues = [{'queue': 2, 'cpu': 1}]
+        correlateQueues(queues, sample, ['eth1', 'eth2'])
+        self.assertEqual(queues[0]['host']['softirqPercent'], 0.0)
+        self.assertEqual(queues[0]['host']['eth1']['interruptCPU'], 1)
+        self.assertNotIn('eth2', queues[0]['host'])
+
+    def test_unreadable_statistics(self):
+        """
+        Test that an interface whose statistics can't be read is
+        left out of that sample instead of failing it
+        """
+        from hostTelemetry import HostTelemetry
+        with tempfile.TemporaryDirectory() as root:
+            writeHost(root, [(100, 100, 10), (100, 100, 10)], [1000, 2000], [50, 0], 1, 10)
+            telemetry = HostTelemetry(['eth1'], os.path.join(root, 'proc'), os.path.join(root, 'net'))
+            try:
+                telemetry.sample(now=10.0)
+                with open(os.path.join(root, 'net', 'eth1', 'statistics', 'rx_packets'), 'w') as f:
+                    f.write('')
+                sample = telemetry.sample(now=12.0)
+                self.assertEqual(sample['interfaces'], {})
+                self.assertEqual(sample['cpus'][0]['busyPercent'], 0.0)
+                writeHost(root, [(100, 100, 10), (100, 100, 10)], [1000, 2000], [50, 0], 1, 30)
+                sample = telemetry.sample(now=14.0)
+            finally:
+                telemetry.close()
+        self.assertEqual(sample['interfaces']['eth1'], {'rxPacketsPerSecond': 0.0})
+
+if __name__ == '__main__':
+    unittest.main()
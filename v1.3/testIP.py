@@ -50,5 +50,59 @@ class TestIP(unittest.TestCase):
         from integrationCommon import isIpv4Permitted
         self.assertEqual(isIpv4Permitted("101.64.1.1"),False)
 
+    def test_batch(self):
+        """
+        Test that the batch API gives the same answers as
+        the single address functions
+        """
+        sys.path.append('testdata/')
+        from integrationCommon import isIpv4Permitted, permittedAddresses
+        addresses = ["100.64.1.1", "100.64.1.1/24", "101.64.1.1", "192.168.1.1", "10.0.0.1", "2001:db8::1"]
+        self.assertEqual(permittedAddresses(addresses), [isIpv4Permitted(ip) for ip in addresses])
+        self.assertEqual(permittedAddresses(addresses), [True, True, False, False, False, False])
+
+    def test_classifier_matches_ipaddress(self):
+        """
+        Property test: for random subnet lists (overlapping,
+        nested and adjacent, IPv4 and IPv6) the classifier
+        agrees with checking each ipaddress.ip_network
+        """
+        import ipaddress
+        import random
+        from integrationCommon import SubnetClassifier
+        rng = random.Random(1234)
+        def randomAddress(version):
+            if version == 4:
+                return str(ipaddress.IPv4Address(rng.getrandbits(32)))
+            return str(ipaddress.IPv6Address(rng.getrandbits(128)))
+        for trial in range(200):
+            subnets = []
+            for s in range(rng.randint(0, 8)):
+                version = rng.choice([4, 6])
+                prefix = rng.randint(0, 32) if version == 4 else rng.randint(0, 128)
+                subnets.append(str(ipaddress.ip_network(randomAddress(version) + "/" + str(prefix), strict=False)))
+            networks = [ipaddress.ip_network(subnet) for subnet in subnets]
+            classifier = SubnetClassifier(subnets)
+            addresses = [randomAddress(rng.choice([4, 6])) for i in range(50)]
+            for network in networks:
+                # Edges of each subnet and just outside them
+                for edge in [int(network.network_address) - 1, int(network.network_address), int(network.broadcast_address), int(network.broadcast_address) + 1]:
+                    if 0 <= edge < 2 ** network.max_prefixlen:
+                        addresses.append(str(type(network.network_address)(edge)))
+            expected = [any(ipaddress.ip_address(address) in network for network in networks) for address in addresses]
+            self.assertEqual(classifier.containsAll(addresses), expected, subnets)
+
+    def test_classifier_errors(self):
+        """
+        Test that malformed subnets and addresses raise
+        ValueError as ipaddress does
+        """
+        from integrationCommon import SubnetClassifier
+        with self.assertRaises(ValueError):
+            SubnetClassifier(['100.64.0.1/10'])
+        with self.assertRaises(ValueError):
+            SubnetClassifier(['100.64.0.0/10']).contains("not an address")
+        self.assertEqual(SubnetClassifier([]).contains("not an address"), False)
+
 if __name__ == '__main__':
         unittest.main()
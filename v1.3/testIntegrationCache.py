@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+
+class TestIntegrationCache(unittest.TestCase):
+    def setUp(self):
+        self.workingDirectory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.workingDirectory)
+        self.directory.cleanup()
+
+    def test_project_fields(self):
+        """
+        Tests picking the graph fields out of a response
+        """
+        from integrationCache import projectFields, payloadDigest
+        devices = [
+            {'identification': {'id': 'a', 'site': {'id': 's1'}}, 'interfaces': [{'addresses': [{'cidr': '100.64.0.1/32'}]}], 'overview': {'uptime': 1}},
+            {'identification': {'id': 'b', 'site': None}, 'interfaces': [], 'overview': {'uptime': 2}},
+        ]
+        fields = ['identification.id', 'identification.site.id', 'interfaces.addresses']
+        self.assertEqual(projectFields(devices, fields), [
+            {'identification.id': 'a', 'identification.site.id': 's1', 'interfaces.addresses': [[{'cidr': '100.64.0.1/32'}]]},
+            {'identification.id': 'b', 'identification.site.id': None, 'interfaces.addresses': []},
+        ])
+        devices[0]['overview']['uptime'] = 100
+        changedUptime = payloadDigest(devices, fields)
+        devices[0]['overview']['uptime'] = 1
+        self.assertEqual(payloadDigest(devices, fields), changedUptime)
+        devices[1]['identification']['id'] = 'c'
+        self.assertNotEqual(payloadDigest(devices, fields), changedUptime)
+
+    def test_keep_fields(self):
+        """
+        Tests cutting a response item down to the graph fields,
+        nested as they were
+        """
+        from integrationCache import keepFields, projectFields
+        device = {'identification': {'id': 'a', 'name': 'AP', 'site': None, 'model': 'x'},
+            'interfaces': [{'addresses': [{'cidr': '100.64.0.1/32'}], 'statistics': {'rx': 1}}, {'addresses': []}],
+            'overview': {'uptime': 1}}
+        fields = ['identification.id', 'identification.site.id', 'interfaces.addresses', 'description.address']
+        self.assertEqual(keepFields(device, fields), {'identification': {'id': 'a', 'site': None},
+            'interfaces': [{'addresses': [{'cidr': '100.64.0.1/32'}]}, {'addresses': []}]})
+        self.assertEqual(projectFields(keepFields(device, fields), fields), projectFields(device, fields))
+        self.assertIs(keepFields(device, None), device)
+
+    def test_ttl_and_stale(self):
+        """
+        Tests that fresh responses are reused, old ones are
+        refetched, and old ones are served when fetching fails
+        until they are too old
+        """
+        from integrationCache import ResponseCache
+        cache = ResponseCache('cache', ttlSeconds=600, maxStaleSeconds=3600)
+        fetches = []
+        def fetch(value):
+            def f():
+                fetches.append(value)
+                return value
+            return f
+        def fail():
+            raise ConnectionError("unreachable")
+        self.assertEqual(cache.get('sites', fetch([1]), now=1000000), [1])
+        self.assertEqual(cache.get('sites', fetch([2]), now=1000300), [1]) # Within the TTL
+        self.assertEqual(fetches, [[1]])
+        self.assertEqual(cache.get('sites', fetch([2]), now=1000700), [2])
+        self.assertEqual(cache.get('sites', fail, now=1002000), [2]) # Stale
+        self.assertEqual(cache.staleKeys, ['sites'])
+        with self.assertRaises(ConnectionError):
+            cache.get('sites', fail, now=1005000) # Too stale
+        with self.assertRaises(ConnectionError):
+            cache.get('devices', fail, now=1005000) # Never fetched
+
+    def test_unchanged_since_import(self):
+        """
+        Tests that an import is only skipped when its
+        responses, ispConfig.py and inputs are unchanged and
+        its outputs exist
+        """
+        from integrationCache import ResponseCache
+        cache = ResponseCache('cache')
+        for path in ['ispConfig.py', 'bandwidths.csv', 'ShapedDevices.csv', 'network.json']:
+            with open(path, 'w') as f:
+                f.write(path)
+        def run(sites, devices):
+            cache.startImport()
+            cache.get('sites', lambda: sites, ['id'])
+            cache.get('devices', lambda: devices, ['id'])
+            return cache.unchangedSinceImport('test', ['bandwidths.csv'])
+        self.assertFalse(run([{'id': 1}], [{'id': 2}])) # Never imported
+        cache.markImported('test', ['bandwidths.csv'])
+        self.assertTrue(run([{'id': 1}], [{'id': 2, 'uptime': 5}]))
+        self.assertFalse(run([{'id': 1}], [{'id': 3}]))
+        cache.markImported('test', ['bandwidths.csv'])
+        self.assertTrue(run([{'id': 1}], [{'id': 3}]))
+        with open('bandwidths.csv', 'w') as f:
+            f.write('edited')
+        self.assertFalse(run([{'id': 1}], [{'id': 3}]))
+        cache.markImported('test', ['bandwidths.csv'])
+        os.remove('network.json')
+        self.assertFalse(run([{'id': 1}], [{'id': 3}]))
+        with open('network.json', 'w') as f:
+            f.write('{}')
+        self.assertTrue(run([{'id': 1}], [{'id': 3}]))
+        os.remove('ShapedDevices.csv')
+        self.assertFalse(run([{'id': 1}], [{'id': 3}]))
+        self.assertFalse(ResponseCache('cache').unchangedSinceImport('other'))
+
+    def test_mikrotik_ipv6_since_import(self):
+        """
+        Tests that with findIPv6usingMikrotik on, a changed IPv6
+        map or router list means the import isn't skipped
+        """
+        import json
+        import time
+        import ispConfig
+        import integrationCache
+        from integrationCache import startImport, cachedFetch, unchangedSinceImport, markImported
+        for path in ['ispConfig.py', 'ShapedDevices.csv', 'network.json']:
+            with open(path, 'w') as f:
+                f.write(path)
+        def writeRouters(routers, ipv4ToIPv6):
+            # Maps fetched just now, so pullMikrotikIPv6() doesn't poll the routers
+            with open('mikrotikDHCPRouterList.csv', 'w') as f:
+                f.write('Router Name,IP,Username,Password,API Port\n')
+                for router in routers:
+                    f.write(router + ',10.0.0.1,admin,secret,8728\n')
+            with open('mikrotikIPv6Cache.json', 'w') as f:
+                f.write(json.dumps({router: {'fetched': time.time(), 'ipv4ToIPv6': ipv4ToIPv6} for router in routers}))
+        def run():
+            startImport()
+            cachedFetch('sites', lambda: [{'id': 1}], ['id'])
+            return unchangedSinceImport('test')
+        findIPv6usingMikrotik = ispConfig.findIPv6usingMikrotik
+        sharedCache = integrationCache.sharedCache
+        ispConfig.findIPv6usingMikrotik = True
+        integrationCache.sharedCache = None
+        try:
+            writeRouters(['R1'], {'100.64.0.1': '2001:db8::/56'})
+            self.assertFalse(run())
+            markImported('test')
+            self.assertTrue(run())
+            writeRouters(['R1'], {'100.64.0.1': '2001:db8:1::/56'})
+            self.assertFalse(run())
+            markImported('test')
+            writeRouters(['R1', 'R2'], {'100.64.0.1': '2001:db8:1::/56'})
+            self.assertFalse(run())
+        finally:
+            ispConfig.findIPv6usingMikrotik = findIPv6usingMikrotik
+            integrationCache.sharedCache = sharedCache
+
+if __name__ == '__main__':
+    unittest.main()
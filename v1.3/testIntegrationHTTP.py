@@ -0,0 +1,189 @@
+import gzip
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Stands in for an NMS/CRM API. Paths:
+    #   /json/<n>     returns {"n": n}
+    #   /array        returns server.arrayBody, a JSON array, as it is
+    #   /flaky/<n>    fails with 503 n times, then returns {"ok": true}
+    #   /later/<n>    fails with 429 and Retry-After: n once, then returns {"ok": true}
+    #   /slow         sleeps longer than the client's timeout
+    #   /missing      404
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1], self.headers.get('Accept-Encoding', '')))
+        if self.path.startswith('/json/'):
+            self.__reply(200, {'n': int(self.path[6:])})
+        elif self.path == '/array':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(server.arrayBody)))
+            self.end_headers()
+            self.wfile.write(server.arrayBody)
+        elif self.path.startswith('/flaky/'):
+            with server.lock:
+                failures = server.failures.get(self.path, 0)
+                server.failures[self.path] = failures + 1
+            if failures < int(self.path[7:]):
+                self.__reply(503, {'error': 'busy'})
+            else:
+                self.__reply(200, {'ok': True})
+        elif self.path.startswith('/later/'):
+            with server.lock:
+                failures = server.failures.get(self.path, 0)
+                server.failures[self.path] = failures + 1
+            if failures == 0:
+                self.__reply(429, {'error': 'slow down'}, [('Retry-After', self.path[7:])])
+            else:
+                self.__reply(200, {'ok': True})
+        elif self.path == '/slow':
+            server.release.wait(5)
+            self.__reply(200, {})
+        else:
+            self.__reply(404, {'error': 'not found'})
+
+    def __reply(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestIntegrationHTTP(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_gzip_and_keep_alive(self):
+        """
+        Tests that responses are requested gzipped and that
+        sequential requests reuse one connection
+        """
+        from integrationHTTP import IntegrationHTTPClient
+        client = IntegrationHTTPClient(timeoutSeconds=5, retries=0)
+        for n in range(3):
+            self.assertEqual(client.getJson(self.url + '/json/' + str(n)), {'n': n})
+        client.close()
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(set(port for path, port, encoding in self.server.requests)), 1)
+        for path, port, encoding in self.server.requests:
+            self.assertIn('gzip', encoding)
+
+    def test_retry_with_backoff(self):
+        """
+        Tests that 503 responses are retried until one
+        succeeds, and that a request is given up after the
+        configured retries
+        """
+        import requests
+        from integrationHTTP import IntegrationHTTPClient
+        client = IntegrationHTTPClient(timeoutSeconds=5, retries=2, backoffSeconds=0.01)
+        self.assertEqual(client.getJson(self.url + '/flaky/2'), {'ok': True})
+        self.assertEqual(client.requestCount, 3)
+        self.assertEqual(client.retryCount, 2)
+        with self.assertRaises(requests.HTTPError):
+            client.getJson(self.url + '/flaky/5')
+        with self.assertRaises(requests.HTTPError):
+            client.getJson(self.url + '/missing') # Not retried
+        self.assertEqual(client.requestCount, 7)
+        client.close()
+
+    def test_retry_after_limit(self):
+        """
+        Tests that a long Retry-After is cut down to
+        maxRetryAfterSeconds rather than blocking the import
+        """
+        import contextlib
+        import io
+        import time
+        from integrationHTTP import IntegrationHTTPClient
+        client = IntegrationHTTPClient(timeoutSeconds=5, retries=1, maxRetryAfterSeconds=0.1)
+        startTime = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(client.getJson(self.url + '/later/3600'), {'ok': True})
+        self.assertLess(time.monotonic() - startTime, 2.0)
+        self.assertIn('3600', output.getvalue())
+        client.close()
+
+    def test_timeout(self):
+        """
+        Tests that a request that takes too long raises
+        instead of blocking the import
+        """
+        import requests
+        from integrationHTTP import IntegrationHTTPClient
+        client = IntegrationHTTPClient(timeoutSeconds=0.2, retries=1, backoffSeconds=0.01)
+        with self.assertRaises(requests.Timeout):
+            client.getJson(self.url + '/slow')
+        self.assertEqual(client.requestCount, 2)
+        client.close()
+
+    def test_json_items(self):
+        """
+        Tests that an array is decoded item by item as it
+        arrives, however it is split, and that only the kept
+        parts of a large response are held in memory
+        """
+        import tracemalloc
+        from integrationHTTP import IntegrationHTTPClient, jsonArrayItems
+        items = [{'a': 'x],"[,', 'b': [1, 2, {'c': None}]}, 12345, -1.5e3, 'str', [], {}, True, None, 'é€', 7]
+        data = json.dumps(items, ensure_ascii=False).encode()
+        for size in [1, 2, 3, 7, 64]:
+            self.assertEqual(list(jsonArrayItems(data[i:i + size] for i in range(0, len(data), size))), items)
+        self.assertEqual(list(jsonArrayItems([b' [ ] '])), [])
+        for body in [b'{"a": 1}', b'[1, 2', b'[1 2]', b'[1, ]', b'[1] x', b'']:
+            with self.assertRaises(ValueError):
+                list(jsonArrayItems([body]))
+
+        devices = [{'id': n, 'name': 'Device ' + str(n), 'overview': {'log': 'x' * 2000}} for n in range(2000)]
+        self.server.arrayBody = json.dumps(devices).encode()
+        del devices
+        client = IntegrationHTTPClient(timeoutSeconds=5, retries=0)
+        tracemalloc.start()
+        kept = client.getJsonItems(self.url + '/array', keep=lambda device: {'id': device['id']})
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        client.close()
+        self.assertEqual(kept, [{'id': n} for n in range(2000)])
+        self.assertLess(peak, len(self.server.arrayBody) / 4)
+
+    def test_fetch_in_parallel(self):
+        """
+        Tests that independent fetches run concurrently and
+        their results come back in order
+        """
+        from integrationHTTP import IntegrationHTTPClient
+        client = IntegrationHTTPClient(timeoutSeconds=5, retries=0)
+        results = client.fetchInParallel([lambda n=n: client.getJson(self.url + '/json/' + str(n)) for n in range(10)], maxWorkers=4)
+        self.assertEqual(results, [{'n': n} for n in range(10)])
+        self.assertLessEqual(len(set(port for path, port, encoding in self.server.requests)), 4)
+        self.assertEqual(client.fetchInParallel([]), [])
+        client.close()
+
+if __name__ == '__main__':
+    unittest.main()
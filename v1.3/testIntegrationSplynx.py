@@ -0,0 +1,69 @@
+import unittest
+
+def fakeSplynx(customerCount, bulkListing=True):
+    # Returns (customers, spylnxRequest stand-in, requested targets).
+    # Customer n has n % 3 internet services.
+    customers = [{"id": str(n), "name": "Customer " + str(n), "street_1": str(n) + " Main St", "city": "Town", "zip_code": "12345"} for n in range(1, customerCount + 1)]
+    services = []
+    for customer in customers:
+        for s in range(int(customer["id"]) % 3):
+            serviceID = len(services) + 1
+            services.append({"id": serviceID, "customer_id": int(customer["id"]), "tariff_id": 1 + (serviceID % 2), "router_id": 1,
+                "taking_ipv4": 1, "ipv4": "100.64.0." + str(serviceID), "taking_ipv6": 0, "ipv6": "",
+                "mac": "00:00:00:00:00:" + format(serviceID % 256, '02x'), "description": "Service " + str(serviceID)})
+    # A service of a customer that isn't listed
+    services.append(dict(services[0], id=len(services) + 1, customer_id=customerCount + 1))
+    requested = []
+    def request(target, headers):
+        requested.append(target)
+        if target == "admin/customers/customer/0/internet-services":
+            if not bulkListing:
+                import requests
+                raise requests.HTTPError("405 from " + target)
+            return services
+        customerID = int(target.split("/")[3])
+        return [service for service in services if service["customer_id"] == customerID]
+    return customers, request, requested
+
+class TestIntegrationSplynx(unittest.TestCase):
+    def buildGraph(self, bulkListing):
+        import integrationSplynx
+        customers, request, requested = fakeSplynx(30, bulkListing)
+        original = integrationSplynx.spylnxRequest
+        integrationSplynx.spylnxRequest = request
+        try:
+            servicesByCustomer = integrationSplynx.getServicesByCustomer({}, customers)
+        finally:
+            integrationSplynx.spylnxRequest = original
+        net = integrationSplynx.graphFromSplynx(customers, servicesByCustomer, {1: 100, 2: 250}, {1: 20, 2: 50}, {1: "100.64.1.1"})
+        return net, requested
+
+    def test_bulk_services(self):
+        """
+        Tests that every customer's services are fetched in
+        one request and joined to the customers
+        """
+        from integrationCommon import NodeType
+        net, requested = self.buildGraph(True)
+        self.assertEqual(requested, ["admin/customers/customer/0/internet-services"])
+        clients = [node for node in net.nodes if node.type == NodeType.client]
+        self.assertEqual(len(clients), 30) # 10 customers have no services, 10 have 1, 10 have 2
+        self.assertEqual(clients[0].id, "c_1_s_1")
+        self.assertEqual(clients[0].displayName, "Customer 1")
+        self.assertEqual(clients[0].downloadMbps, 250)
+        devices = [node for node in net.nodes if node.type == NodeType.device]
+        self.assertEqual(devices[0].parentId, "c_1_s_1")
+        self.assertEqual(devices[0].ipv4, ["100.64.0.1"])
+
+    def test_per_customer_fallback(self):
+        """
+        Tests that services are fetched per customer when
+        they can't be listed at once, with the same result
+        """
+        bulkNet, bulkRequested = self.buildGraph(True)
+        net, requested = self.buildGraph(False)
+        self.assertEqual(len(requested), 31)
+        self.assertEqual([(node.id, node.parentId, node.ipv4) for node in net.nodes], [(node.id, node.parentId, node.ipv4) for node in bulkNet.nodes])
+
+if __name__ == '__main__':
+    unittest.main()
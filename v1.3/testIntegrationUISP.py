@@ -0,0 +1,104 @@
+import json
+import os
+import unittest
+
+fixturePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'uisp')
+
+def loadFixture(name):
+    # Generated responses in the shape of UISP's /nms/api/v2.1 sites, devices and
+    # data-links endpoints: 600 sites, 915 devices, 573 data-links
+    with open(os.path.join(fixturePath, name + '.json'), 'r') as j:
+        return json.loads(j.read())
+
+class TestIntegrationUISP(unittest.TestCase):
+    def test_grouping(self):
+        """
+        Tests that devices are grouped by site and data-links
+        by "from" device, in UISP's order
+        """
+        from integrationUISP import devicesBySite, dataLinksByDevice
+        devices = loadFixture('devices')
+        dataLinks = loadFixture('dataLinks')
+        bySite = devicesBySite(devices)
+        self.assertEqual(sum(len(siteDevices) for siteDevices in bySite.values()), len([d for d in devices if d['identification']['site'] is not None]))
+        for siteId, siteDevices in list(bySite.items())[:20]:
+            self.assertEqual(siteDevices, [d for d in devices if d['identification']['site'] is not None and d['identification']['site']['id'] == siteId])
+        byDevice = dataLinksByDevice(dataLinks)
+        self.assertEqual(sum(len(links) for links in byDevice.values()), len([dl for dl in dataLinks if dl['from']['device'] is not None]))
+        for deviceId, links in list(byDevice.items())[:20]:
+            self.assertEqual(links, [dl for dl in dataLinks if dl['from']['device'] is not None and dl['from']['device']['identification']['id'] == deviceId])
+
+    def test_flat_graph(self):
+        """
+        Tests that the flat graph has every client site, each
+        followed by the devices at that site
+        """
+        from integrationUISP import flatGraphFromUISP
+        from integrationCommon import NodeType
+        sites = loadFixture('sites')
+        devices = loadFixture('devices')
+        net = flatGraphFromUISP(sites, devices)
+        endpoints = [site for site in sites if site['identification']['type'] == "endpoint"]
+        self.assertEqual(len([node for node in net.nodes if node.type == NodeType.client]), len(endpoints))
+        for site in endpoints[:50]:
+            idx = net.findNodeIndexById(site['identification']['id'])
+            expected = [d['identification']['id'] for d in devices if d['identification']['site'] is not None and d['identification']['site']['id'] == site['identification']['id']]
+            self.assertEqual([net.nodes[i].id for i in range(idx + 1, idx + 1 + len(expected))], expected)
+            for i in range(idx + 1, idx + 1 + len(expected)):
+                self.assertEqual(net.nodes[i].parentId, site['identification']['id'])
+                self.assertEqual(net.nodes[i].type, NodeType.device)
+
+    def test_full_graph(self):
+        """
+        Tests that the full graph finds APs from the data-links,
+        hangs client sites under them, and is fully connected
+        """
+        from integrationUISP import fullGraphFromUISP
+        from integrationCommon import NodeType
+        sites = loadFixture('sites')
+        devices = loadFixture('devices')
+        dataLinks = loadFixture('dataLinks')
+        siteBandwidth = {}
+        net = fullGraphFromUISP(sites, devices, dataLinks, siteBandwidth)
+        siteType = {site['identification']['id']: site['identification']['type'] for site in sites}
+        deviceIds = set(d['identification']['id'] for d in devices if d['identification']['site'] is not None)
+        apLinks = [dl for dl in dataLinks if dl['from']['device'] is not None and dl['to']['site'] is not None
+            and dl['from']['device']['identification']['id'] in deviceIds
+            and dl['from']['site']['identification']['id'] != dl['to']['site']['identification']['id']
+            and siteType[dl['to']['site']['identification']['id']] == "endpoint"]
+        aps = set(dl['from']['device']['identification']['id'] for dl in apLinks)
+        self.assertEqual(set(node.id for node in net.nodes if node.type == NodeType.ap), aps)
+        for dl in apLinks:
+            client = net.nodes[net.findNodeIndexById(dl['to']['site']['identification']['id'])]
+            self.assertIn(client.parentId, aps)
+        for site in sites:
+            if site['identification']['type'] == "site":
+                self.assertIn(site['identification']['name'], siteBandwidth)
+        for node in net.nodes:
+            if node.type == NodeType.ap:
+                self.assertIn(node.displayName, siteBandwidth)
+        net.prepareTree()
+        self.assertEqual(net._NetworkGraph__findUnconnectedNodes(), [])
+
+    def test_kept_fields(self):
+        """
+        Tests that keeping only uispGraphFields of each item
+        builds the same graphs as the full responses
+        """
+        from integrationUISP import uispGraphFields, flatGraphFromUISP, fullGraphFromUISP
+        from integrationCache import keepFields
+        full = {name: loadFixture(name) for name in ['sites', 'devices', 'dataLinks']}
+        kept = {name: [keepFields(item, uispGraphFields[target]) for item in full[name]]
+            for name, target in [('sites', 'sites'), ('devices', 'devices'), ('dataLinks', 'data-links')]}
+        self.assertLess(len(json.dumps(kept['devices'])), len(json.dumps(full['devices'])))
+        def describe(net):
+            return [(node.id, node.displayName, node.parentId, node.type, node.downloadMbps, node.uploadMbps, node.ipv4, node.address, node.mac) for node in net.nodes]
+        self.assertEqual(describe(flatGraphFromUISP(kept['sites'], kept['devices'])), describe(flatGraphFromUISP(full['sites'], full['devices'])))
+        keptBandwidth = {}
+        fullBandwidth = {}
+        self.assertEqual(describe(fullGraphFromUISP(kept['sites'], kept['devices'], kept['dataLinks'], keptBandwidth)),
+            describe(fullGraphFromUISP(full['sites'], full['devices'], full['dataLinks'], fullBandwidth)))
+        self.assertEqual(keptBandwidth, fullBandwidth)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+class TestLatencyReader(unittest.TestCase):
+    def test_tc_handles(self):
+        """
+        Test converting xdp_pping's decimal tc handles to hex classids
+        """
+        from latencyReader import tcHandleToClassID, preloadClassIDs, classIDForTcHandle
+        self.assertEqual(tcHandleToClassID('1:26'), '0x1:0x1a')
+        preloadClassIDs(['0x10:0xff'])
+        self.assertEqual(classIDForTcHandle['16:255'], '0x10:0xff')
+
+    def test_ring(self):
+        """
+        Test that a ring keeps the newest summaries, newest first
+        """
+        from latencyReader import LatencyRing
+        ring = LatencyRing(3)
+        for second in range(5):
+            ring.add(float(second), {'avg': 10.0 + second, 'samples': 2})
+        rows = list(ring.rows(0.0))
+        self.assertEqual([timestamp for timestamp, values in rows], [4.0, 3.0, 2.0])
+        self.assertEqual(list(rows[0][1]), [14.0, 14.0, 14.0, 14.0, 2.0])
+        self.assertEqual(len(list(ring.rows(2.5))), 2)
+
+    def test_windows(self):
+        """
+        Test that each read returns the summaries polled since the previous one
+        """
+        from latencyReader import LatencyReader
+        polls = [([{'tc': '1:3', 'avg': 12.0, 'min': 3.0, 'max': 40.0, 'median': 10.0, 'samples': 6}, {}], 100000000000),
+            ([{'tc': '1:3', 'avg': 20.0, 'samples': 2}, {'tc': '2:3', 'avg': 5.0, 'samples': 1}], 102000000000),
+            ([{'tc': '2:3', 'avg': 6.0, 'samples': 1}], 104000000000)]
+        reader = LatencyReader(lambda: polls.pop(0), pollSeconds=2.0, ringSize=8)
+        reader.pollOnce()
+        reader.pollOnce()
+        entries = reader.entries(now=103.0)
+        # One entry per poll, so the spread within the window can be sketched
+        self.assertEqual([(entry['tc'], entry['avg'], entry['samples']) for entry in entries], [('1:3', 12.0, 6), ('1:3', 20.0, 2), ('2:3', 5.0, 1)])
+        reader.pollOnce()
+        self.assertEqual([(entry['tc'], entry['avg']) for entry in reader.entries(now=105.0)], [('2:3', 6.0)])
+        # A fixed window doesn't move the start of the next read
+        self.assertEqual(len(reader.entries(windowSeconds=10.0, now=105.0)), 4)
+        self.assertEqual(reader.entries(now=106.0), [])
+        # Circuits that stop being reported are forgotten once their ring is out of date
+        self.assertEqual(sorted(reader.rings), ['1:3', '2:3'])
+        reader.entries(now=119.0)
+        self.assertEqual(sorted(reader.rings), ['2:3'])
+
+    def test_merge_entries(self):
+        """
+        Test that summaries of a circuit merge into one, weighted by samples
+        """
+        from latencyReader import mergeEntries
+        merged = mergeEntries([{'tc': '1:3', 'avg': 10.0, 'min': 2.0, 'max': 30.0, 'median': 8.0, 'samples': 3},
+            {'tc': '2:3', 'avg': 50.0},
+            {'tc': '1:3', 'avg': 20.0, 'min': 5.0, 'max': 60.0, 'median': 12.0, 'samples': 1},
+            {}])
+        self.assertEqual(merged, [{'tc': '1:3', 'avg': 12.5, 'min': 2.0, 'max': 60.0, 'median': 9.0, 'samples': 4},
+            {'tc': '2:3', 'avg': 50.0, 'min': 50.0, 'max': 50.0, 'median': 50.0, 'samples': 1}])
+
+    def test_thin_entries(self):
+        """
+        Test that a window with more entries than fit keeps as
+        many per circuit as it can, and at least one each
+        """
+        from latencyReader import thinEntries
+        listOfEntries = [{'tc': '1:3', 'avg': float(poll), 'samples': 1} for poll in range(6)] + [{'tc': '2:3', 'avg': 50.0}]
+        self.assertIs(thinEntries(listOfEntries, 7), listOfEntries)
+        thinned = thinEntries(listOfEntries, 5)
+        self.assertEqual([(entry['tc'], entry['avg'], entry['samples']) for entry in thinned], [('1:3', 1.0, 3), ('1:3', 4.0, 3), ('2:3', 50.0, 1)])
+        self.assertEqual(len(thinEntries(listOfEntries, 1)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+class TestLatencySketch(unittest.TestCase):
+    def test_relative_accuracy(self):
+        """
+        Test that quantiles are within the sketch's relative accuracy
+        """
+        from latencySketch import LatencySketch, relativeAccuracy
+        sketch = LatencySketch()
+        for latency in range(1, 1001):
+            sketch.add(float(latency))
+        for q, expected in [(0.5, 500.5), (0.95, 950.05), (0.99, 990.01)]:
+            self.assertLessEqual(abs(sketch.quantile(q) - expected) / expected, relativeAccuracy + 0.001)
+        self.assertIsNone(LatencySketch().quantile(0.5))
+
+    def test_merge(self):
+        """
+        Test that merging sketches gives the same result as one sketch fed
+        every value, and keeps memory bounded by the bucket count
+        """
+        from latencySketch import LatencySketch, bucketCount
+        merged = LatencySketch()
+        combined = LatencySketch()
+        for part in range(10):
+            sketch = LatencySketch()
+            for latency in range(part * 100, (part + 1) * 100):
+                sketch.add(latency / 10.0)
+                combined.add(latency / 10.0)
+            merged.merge(sketch)
+        self.assertEqual(merged.counts, combined.counts)
+        self.assertEqual(merged.total, 1000)
+        self.assertLessEqual(len(merged.counts), bucketCount)
+        merged.add(1000000.0)
+        self.assertLess(max(merged.counts), bucketCount)
+
+    def test_pping_entry_and_rollup(self):
+        """
+        Test building circuit sketches from xdp_pping entries and rolling
+        them up the network.json tree
+        """
+        from latencySketch import LatencySketch, rollUpSketches
+        fast = LatencySketch()
+        fast.addPpingEntry({'tc': '1:3', 'avg': 10.0, 'min': 5.0, 'max': 20.0, 'median': 9.0, 'samples': 100})
+        self.assertEqual(fast.total, 100)
+        self.assertAlmostEqual(fast.quantile(0.5), 9.0, delta=0.2)
+        # The tail between median and max is interpolated, not folded into max(avg, median)
+        self.assertAlmostEqual(fast.quantile(0.95), 18.9, delta=0.4)
+        self.assertLess(fast.quantile(0.95), fast.quantile(0.99))
+        self.assertAlmostEqual(fast.quantile(0.0), 5.0, delta=0.1)
+        slow = LatencySketch()
+        slow.addPpingEntry({'tc': '1:4', 'avg': 80.0, 'samples': 2})
+        sketchForNode = {'AP_A': fast, 'AP_B': slow}
+        parentNodeNameDict = {'AP_A': 'Site_1', 'AP_B': 'Site_1', 'Site_1': 'Region'}
+        rollUpSketches(sketchForNode, parentNodeNameDict)
+        self.assertEqual(sketchForNode['Site_1'].total, 102)
+        self.assertEqual(sketchForNode['Region'].total, 102)
+        self.assertAlmostEqual(sketchForNode['Region'].quantile(1.0), 80.0, delta=1.6)
+        self.assertEqual(sketchForNode['AP_A'].total, 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+class TestLineProtocol(unittest.TestCase):
+    def test_simple_line(self):
+        """
+        Test that a point with tags and fields serializes as expected
+        """
+        from lineProtocol import LineProtocolSerializer
+        serializer = LineProtocolSerializer()
+        tags = serializer.tagSet("0x1:0x3", (("Type", "Circuit"), ("Circuit", "1 Main St"), ("ParentNode", "AP_1")))
+        serializer.add("Bandwidth", tags, (("Upload", 20.0), ("Download", 150.5)))
+        self.assertEqual(serializer.getvalue(), "Bandwidth,Circuit=1\\ Main\\ St,ParentNode=AP_1,Type=Circuit Download=150.5,Upload=20")
+
+    def test_escaping(self):
+        """
+        Test escaping of measurement names, tag keys/values and string fields
+        """
+        from lineProtocol import LineProtocolSerializer
+        serializer = LineProtocolSerializer()
+        tags = serializer.tagSet("x", (("Circuit", "a,b=c d\\"),))
+        serializer.add("TCP Latency", tags, (("Note", 'say "hi"'), ("Count", 3), ("Flag", True)))
+        self.assertEqual(serializer.getvalue(), 'TCP\\ Latency,Circuit=a\\,b\\=c\\ d\\  Count=3i,Flag=true,Note="say \\"hi\\""')
+
+    def test_skips_unwritable_fields(self):
+        """
+        Test that None / NaN fields are dropped, and a line with no
+        fields left is not written at all
+        """
+        from lineProtocol import LineProtocolSerializer
+        serializer = LineProtocolSerializer()
+        tags = serializer.tagSet("x", (("Type", "Tin"),))
+        serializer.add("Tins", tags, (("Download", float('nan')), ("Upload", None)))
+        self.assertEqual(len(serializer), 0)
+        serializer.add("Tins", tags, (("Download", float('inf')), ("Upload", 1.25)))
+        self.assertEqual(serializer.getvalue(), "Tins,Type=Tin Upload=1.25")
+
+    def test_tag_cache_follows_renames(self):
+        """
+        Test that a cached tag set is rebuilt when the circuit is renamed
+        or re-parented
+        """
+        from lineProtocol import LineProtocolSerializer
+        serializer = LineProtocolSerializer()
+        first = serializer.tagSet("0x1:0x3", (("Circuit", "Old Name"), ("ParentNode", "AP_1")))
+        self.assertIs(serializer.tagSet("0x1:0x3", (("Circuit", "Old Name"), ("ParentNode", "AP_1"))), first)
+        renamed = serializer.tagSet("0x1:0x3", (("Circuit", "New Name"), ("ParentNode", "AP_2")))
+        self.assertEqual(renamed, ",Circuit=New\\ Name,ParentNode=AP_2")
+
+    def test_buffer_reuse(self):
+        """
+        Test that reset() empties the buffer so it can be reused
+        """
+        from lineProtocol import LineProtocolSerializer
+        serializer = LineProtocolSerializer()
+        tags = serializer.tagSet("n", (("Device", "Site_1"),))
+        serializer.add("Overload", tags, (("Overload", 0.5),), timestamp=1700000000000000000)
+        self.assertEqual(serializer.getvalue(), "Overload,Device=Site_1 Overload=0.5 1700000000000000000")
+        serializer.reset()
+        self.assertEqual(len(serializer), 0)
+        self.assertEqual(serializer.getvalue(), "")
+
+    def test_matches_point(self):
+        """
+        Requires influxdb_client. Test that the serializer produces
+        exactly what influxdb_client.Point produces.
+        """
+        import importlib.util
+        if importlib.util.find_spec('influxdb_client') is None:
+            self.skipTest("influxdb_client not installed")
+
+        from influxdb_client import Point
+        from lineProtocol import LineProtocolSerializer
+        serializer = LineProtocolSerializer()
+        for name, parent, download, upload in [("12 Elm St, Town", "AP=A", 1000.0, 3.5), ("Trailing\\", "Site 9", 0.1, 100000000.0)]:
+            p = Point('Bandwidth').tag("Circuit", name).tag("ParentNode", parent).tag("Type", "Circuit").field("Download", download).field("Upload", upload)
+            tags = serializer.tagSet(name, (("Circuit", name), ("ParentNode", parent), ("Type", "Circuit")))
+            serializer.add('Bandwidth', tags, (("Download", download), ("Upload", upload)))
+            self.assertEqual(serializer.getvalue(), p.to_line_protocol())
+            serializer.reset()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import threading
+import unittest
+
+class FakeResource:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get(self):
+        return self.entries
+
+class FakeRouterOsApi:
+    # Stands in for a routeros_api API object
+    def __init__(self, leases, bindings, neighbors, delay=None):
+        self.resources = {
+            '/ip/dhcp-server/lease': leases,
+            '/ipv6/dhcp-server/binding': bindings,
+            '/ipv6/neighbor': neighbors,
+        }
+        self.delay = delay
+
+    def get_resource(self, path):
+        if self.delay != None:
+            self.delay.wait(5)
+        return FakeResource(self.resources[path])
+
+def routerApi(octet):
+    # A router with two IPv6 clients, one IPv4-only client and an
+    # incomplete lease
+    return FakeRouterOsApi(
+        [{'mac-address': 'AA:00:00:00:00:0' + str(octet), 'address': '100.64.' + str(octet) + '.1'},
+         {'mac-address': 'BB:00:00:00:00:0' + str(octet), 'address': '100.64.' + str(octet) + '.2'},
+         {'mac-address': 'CC:00:00:00:00:0' + str(octet), 'address': '100.64.' + str(octet) + '.3'},
+         {'mac-address': 'DD:00:00:00:00:0' + str(octet)}],
+        [{'client-address': 'fe80::a' + str(octet), 'address': '2001:db8:' + str(octet) + ':a00::/56'},
+         {'client-address': 'fe80::b' + str(octet), 'address': '2001:db8:' + str(octet) + ':b00::/56'}],
+        [{'mac-address': 'AA:00:00:00:00:0' + str(octet), 'address': 'fe80::a' + str(octet)},
+         {'mac-address': 'BB:00:00:00:00:0' + str(octet), 'address': 'fe80::b' + str(octet)},
+         {'mac-address': 'EE:00:00:00:00:0' + str(octet), 'address': 'fe80::e' + str(octet)}])
+
+class TestMikrotikFindIPv6(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.routerList = os.path.join(self.directory.name, 'mikrotikDHCPRouterList.csv')
+        self.cachePath = os.path.join(self.directory.name, 'mikrotikIPv6Cache.json')
+        with open(self.routerList, 'w') as f:
+            f.write("Router Name / ID,IP,API Username,API Password, API Port\n")
+            f.write("r1,100.64.0.1,admin,password,8729\n")
+            f.write("r2,100.64.0.2,admin,password\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_router_list(self):
+        """
+        Test reading routers with and without an API port
+        """
+        from mikrotikFindIPv6 import readRouterList
+        self.assertEqual(readRouterList(self.routerList), [
+            ('r1', '100.64.0.1', 'admin', 'password', 8729),
+            ('r2', '100.64.0.2', 'admin', 'password', 8728),
+        ])
+
+    def test_join_by_mac(self):
+        """
+        Test joining leases, bindings and neighbors of one router
+        """
+        from mikrotikFindIPv6 import routerIPv4ToIPv6
+        self.assertEqual(routerIPv4ToIPv6(routerApi(1)), {
+            '100.64.1.1': '2001:db8:1:a00::/56',
+            '100.64.1.2': '2001:db8:1:b00::/56',
+        })
+
+    def test_poll_and_cache(self):
+        """
+        Test polling every router, reusing the cached maps
+        within the TTL and keeping a failed router's last map
+        """
+        from mikrotikFindIPv6 import pullMikrotikIPv6
+        polled = []
+        failing = set()
+        def connect(router, timeoutSeconds):
+            polled.append(router[0])
+            if router[0] in failing:
+                raise ConnectionError("unreachable")
+            return routerApi(int(router[1].split('.')[-1]))
+        def pull(now):
+            return pullMikrotikIPv6(self.routerList, self.cachePath, cacheSeconds=600, timeoutSeconds=5, connect=connect, now=now)
+        ipv4ToIPv6 = pull(1000)
+        self.assertEqual(len(ipv4ToIPv6), 4)
+        self.assertEqual(ipv4ToIPv6['100.64.2.2'], '2001:db8:2:b00::/56')
+        self.assertEqual(sorted(polled), ['r1', 'r2'])
+        self.assertEqual(pull(1300), ipv4ToIPv6) # Cached
+        self.assertEqual(len(polled), 2)
+        failing.add('r2')
+        self.assertEqual(pull(2000), ipv4ToIPv6) # r2 keeps its map
+        self.assertEqual(polled.count('r2'), 3) # Retried once on a new connection
+
+    def test_timeout(self):
+        """
+        Test that a router that doesn't answer doesn't hold
+        up the others
+        """
+        from mikrotikFindIPv6 import pullMikrotikIPv6
+        release = threading.Event()
+        def connect(router, timeoutSeconds):
+            octet = int(router[1].split('.')[-1])
+            api = routerApi(octet)
+            if octet == 1:
+                api.delay = release
+            return api
+        ipv4ToIPv6 = pullMikrotikIPv6(self.routerList, self.cachePath, cacheSeconds=600, timeoutSeconds=0.2, connect=connect, now=1000)
+        release.set()
+        self.assertEqual(sorted(ipv4ToIPv6), ['100.64.2.1', '100.64.2.2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+
+class FakeClock:
+    # Monotonic clock that only moves when told to, or when slept on
+    def __init__(self, now=1000.0):
+        self.now = now
+    def __call__(self):
+        return self.now
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TestPoller(unittest.TestCase):
+    def test_no_drift(self):
+        """
+        Test that cycles start on a fixed grid regardless of how long
+        each collection takes
+        """
+        from poller import Poller
+        clock = FakeClock()
+        poller = Poller(10, cpuBudget=1.0)
+        starts = []
+        for i in range(5):
+            poller.waitForNextCycle(sleep=clock.sleep, clock=clock)
+            starts.append(clock())
+            clock.now += 3.7
+        self.assertEqual(starts, [1000.0, 1010.0, 1020.0, 1030.0, 1040.0])
+        self.assertEqual(poller.skippedCycles, 0)
+        self.assertEqual(poller.lateCycles, 0)
+
+    def test_skipped_and_late(self):
+        """
+        Test that missed deadlines are counted as skipped, and a cycle
+        starting well after its deadline is counted as late
+        """
+        from poller import Poller
+        clock = FakeClock()
+        poller = Poller(10, cpuBudget=1.0)
+        poller.waitForNextCycle(sleep=clock.sleep, clock=clock)
+        clock.now += 25.0
+        cycle = poller.waitForNextCycle(sleep=clock.sleep, clock=clock)
+        self.assertEqual(cycle, 2)
+        self.assertEqual(poller.skippedCycles, 1)
+        self.assertEqual(poller.lateCycles, 1)
+        self.assertEqual(poller.metrics()['latenessSeconds'], 5.0)
+        # Back on the original grid afterwards
+        poller.waitForNextCycle(sleep=clock.sleep, clock=clock)
+        self.assertEqual(clock(), 1030.0)
+
+    def test_cpu_budget(self):
+        """
+        Test that the interval stretches when a cycle uses more than its
+        CPU budget, and eases back once it doesn't
+        """
+        from poller import Poller
+        clock = FakeClock()
+        cpu = FakeClock(0.0)
+        poller = Poller(10, cpuBudget=0.25)
+        poller.waitForNextCycle(sleep=clock.sleep, clock=clock)
+        with poller.measure(clock=clock, cpuClock=cpu):
+            cpu.now += 5.0
+        self.assertEqual(poller.intervalSeconds, 20.0)
+        poller.waitForNextCycle(sleep=clock.sleep, clock=clock)
+        self.assertEqual(clock(), 1020.0)
+        with poller.measure(clock=clock, cpuClock=cpu):
+            cpu.now += 100.0
+        self.assertEqual(poller.intervalSeconds, 60)
+        for i in range(30):
+            with poller.measure(clock=clock, cpuClock=cpu):
+                cpu.now += 0.1
+        self.assertEqual(poller.intervalSeconds, 10)
+
+    def test_circuit_rates_from_sample_times(self):
+        """
+        Test that a circuit with a qdisc on only one interface
+        is rated in that direction only, and that a prior query
+        from before a reboot is discarded
+        """
+        import os
+        import tempfile
+        from ispConfig import interfaceA, interfaceB
+        workingDirectory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            # graphInfluxDB's stores keep their files in the working directory
+            os.chdir(directory)
+            try:
+                from graphInfluxDB import getCircuitBandwidthStats
+            finally:
+                os.chdir(workingDirectory)
+        tins = [{'sent_packets': 0, 'drops': 0, 'ecn_mark': 0, 'ack_drops': 0}] * 4
+        def reader(samples):
+            # samples: {interface: (monotonic time, {classid: bytes})}
+            def read(interface):
+                sampleTime, bytesByClassID = samples[interface]
+                return {classid: {'bytes': b, 'drops': 0, 'packets': 1, 'tins': tins} for classid, b in bytesByClassID.items()}, sampleTime
+            return read
+        circuits = [{'classid': '0x1:0x3', 'ParentNode': 'AP_A'}]
+        getCircuitBandwidthStats(circuits, {}, reader({interfaceA: (100.0, {'0x1:0x3': 1000}), interfaceB: (100.0, {})}))
+        getCircuitBandwidthStats(circuits, {}, reader({interfaceA: (110.0, {'0x1:0x3': 11000}), interfaceB: (110.0, {'0x1:0x3': 500})}))
+        self.assertEqual(circuits[0]['stats']['sinceLastQuery']['bitsDownload'], 8000)
+        self.assertEqual(circuits[0]['stats']['sinceLastQuery']['bitsUpload'], 0)
+        getCircuitBandwidthStats(circuits, {}, reader({interfaceA: (120.0, {'0x1:0x3': 21000}), interfaceB: (120.0, {'0x1:0x3': 10500})}))
+        self.assertEqual(circuits[0]['stats']['sinceLastQuery']['bitsUpload'], 8000)
+
+        # Rebooted: the monotonic clock and the counters start over
+        getCircuitBandwidthStats(circuits, {}, reader({interfaceA: (5.0, {'0x1:0x3': 100}), interfaceB: (5.0, {'0x1:0x3': 100})}))
+        self.assertNotIn('priorQuery', circuits[0]['stats'])
+        self.assertEqual(circuits[0]['stats']['sinceLastQuery']['bitsDownload'], 0.0)
+        self.assertEqual(circuits[0]['stats']['sinceLastQuery']['bytesSentDownload'], 0.0)
+        getCircuitBandwidthStats(circuits, {}, reader({interfaceA: (15.0, {'0x1:0x3': 10100}), interfaceB: (15.0, {'0x1:0x3': 100})}))
+        self.assertEqual(circuits[0]['stats']['sinceLastQuery']['bitsDownload'], 8000)
+
+if __name__ == '__main__':
+    unittest.main()
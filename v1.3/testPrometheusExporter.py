@@ -0,0 +1,94 @@
+import unittest
+
+def makeCircuit(classid, circuitID, name, parentNode, bitsDownload):
+    return {'classid': classid, 'circuitID': circuitID, 'circuitName': name, 'ParentNode': parentNode,
+        'stats': {'sinceLastQuery': {'bitsDownload': bitsDownload, 'bitsUpload': 10.0, 'tcpLatencyPercentiles': {'p50': 12.5, 'p95': 30.0, 'p99': 41.0}},
+            'currentQuery': {'bytesSentDownload': 1000.0, 'bytesSentUpload': 20.0, 'packetsSentDownload': 5.0, 'packetsSentUpload': 1.0, 'packetDropsDownload': 0.0, 'packetDropsUpload': 0.0}}}
+
+def makeNode(name):
+    return {'parentNodeName': name, 'stats': {'sinceLastQuery': {'bitsDownload': 1.5, 'bitsUpload': 2.0, 'packetDropsTotal': 0.0, 'overloadFactorTotal': 0.0,
+        'tcpLatencyPercentiles': {'p50': 10.0, 'p95': 20.0, 'p99': 30.0}}}}
+
+class TestPrometheusExporter(unittest.TestCase):
+    def test_exposition(self):
+        """
+        Test the text exposition of circuit, node and CPU series, including
+        label escaping
+        """
+        from prometheusExporter import MetricsExporter
+        exporter = MetricsExporter()
+        circuits = [makeCircuit('0x1:0x3', '1', 'Say "hi"\\', 'AP_A', 100.0), makeCircuit('0x2:0x3', '2', 'Two', 'AP_A', 50.5)]
+        exporter.updateBandwidth(circuits, [makeNode('AP_A')])
+        body = exporter.body.decode('utf-8')
+        self.assertIn('# TYPE libreqos_circuit_bytes_total counter\n', body)
+        self.assertIn('libreqos_circuit_bits_per_second{circuit_id="1",circuit="Say \\"hi\\"\\\\",parent_node="AP_A",direction="download"} 100.0\n', body)
+        self.assertIn('libreqos_node_bits_per_second{node="AP_A",direction="upload"} 2.0\n', body)
+        self.assertIn('libreqos_cpu_bits_per_second{cpu="1",direction="download"} 50.5\n', body)
+        self.assertIn('libreqos_cpu_circuits{cpu="0"} 1\n', body)
+        self.assertTrue(body.endswith('\n'))
+
+    def test_sections(self):
+        """
+        Test that a latency update keeps the bandwidth series, and that
+        renames are picked up by the label cache
+        """
+        from prometheusExporter import MetricsExporter
+        exporter = MetricsExporter()
+        circuits = [makeCircuit('0x1:0x3', '1', 'One', 'AP_A', 100.0)]
+        exporter.updateBandwidth(circuits, [])
+        exporter.updateLatency(circuits, [makeNode('AP_A')])
+        body = exporter.body.decode('utf-8')
+        self.assertIn('libreqos_circuit_bits_per_second{', body)
+        self.assertIn('libreqos_circuit_tcp_latency_ms{circuit_id="1",circuit="One",parent_node="AP_A",quantile="0.95"} 30.0\n', body)
+        self.assertIn('libreqos_node_tcp_latency_ms{node="AP_A",quantile="0.50"} 10.0\n', body)
+        self.assertLess(body.index('libreqos_circuit_bits_per_second'), body.index('libreqos_circuit_tcp_latency_ms'))
+
+        circuits[0]['circuitName'] = 'Renamed'
+        exporter.updateBandwidth(circuits, [])
+        body = exporter.body.decode('utf-8')
+        self.assertIn('circuit="Renamed"', body.split('libreqos_circuit_tcp_latency_ms')[0])
+
+    def test_queue_load(self):
+        """
+        Test the per MQ queue series and the imbalance flag
+        """
+        from prometheusExporter import MetricsExporter
+        from cpuLoad import QueueLoad
+        exporter = MetricsExporter()
+        circuits = [makeCircuit('0x1:0x3', '1', 'One', 'AP_A', 90000000.0), makeCircuit('0x2:0x3', '2', 'Two', 'AP_B', 10000000.0)]
+        for circuit in circuits:
+            circuit['stats']['sinceLastQuery'].update({'packetsSentDownload': 10.0, 'packetsSentUpload': 1.0, 'packetDropsDownload': 0.0, 'packetDropsUpload': 0.0})
+        queueLoad = QueueLoad(imbalanceShare=0.5)
+        queueLoad.update(circuits)
+        exporter.updateQueueLoad(queueLoad)
+        body = exporter.body.decode('utf-8')
+        self.assertIn('libreqos_queue_share{queue="0x1",cpu="0",direction="download"} 0.9\n', body)
+        self.assertIn('libreqos_queue_imbalanced{queue="0x1",cpu="0",direction="download"} 1\n', body)
+        self.assertIn('libreqos_queue_imbalanced{queue="0x2",cpu="1",direction="download"} 0\n', body)
+
+    def test_http(self):
+        """
+        Test serving the cached body over HTTP, plain and gzipped
+        """
+        import gzip
+        import urllib.request
+        import urllib.error
+        from prometheusExporter import MetricsExporter, serveMetrics
+        exporter = MetricsExporter()
+        exporter.updateBandwidth([makeCircuit('0x1:0x3', '1', 'One', 'AP_A', 100.0)], [])
+        server = serveMetrics(exporter, '127.0.0.1', 0)
+        try:
+            url = 'http://127.0.0.1:' + str(server.server_address[1])
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(response.read(), exporter.body)
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            with urllib.request.urlopen(urllib.request.Request(url + '/metrics', headers={'Accept-Encoding': 'gzip'})) as response:
+                self.assertEqual(gzip.decompress(response.read()), exporter.body)
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+def makeCircuit(classid, bitsDownload, bitsUpload):
+    return {'classid': classid, 'circuitID': classid, 'circuitName': classid, 'ParentNode': 'AP_A',
+        'stats': {'sinceLastQuery': {'bitsDownload': bitsDownload, 'bitsUpload': bitsUpload}}}
+
+class TestRollup(unittest.TestCase):
+    def test_windows(self):
+        """
+        Test min / mean / max per circuit over wall-clock aligned windows
+        """
+        from rollup import CircuitRollup
+        rollup = CircuitRollup(60)
+        self.assertIsNone(rollup.add([makeCircuit('0x1:0x3', 10.0, 1.0), makeCircuit('0x1:0x4', 0.0, 0.0)], 125.0))
+        self.assertIsNone(rollup.add([makeCircuit('0x1:0x3', 30.0, 5.0)], 135.0))
+        self.assertIsNone(rollup.add([makeCircuit('0x1:0x3', 20.0, 3.0)], 179.9))
+        windowStart, results = rollup.add([makeCircuit('0x1:0x3', 1000.0, 1000.0)], 180.0)
+        self.assertEqual(windowStart, 120)
+        self.assertEqual(results[0][1], (10.0, 20.0, 30.0))
+        self.assertEqual(results[0][2], (1.0, 3.0, 5.0))
+        self.assertEqual(results[1][1], (0.0, 0.0, 0.0))
+        # The next window starts from the poll that closed this one
+        windowStart, results = rollup.add([makeCircuit('0x1:0x3', 0.0, 0.0)], 400.0)
+        self.assertEqual(windowStart, 180)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][1], (1000.0, 1000.0, 1000.0))
+
+    def test_invalid_window(self):
+        """
+        Test that a zero window is rejected
+        """
+        from rollup import CircuitRollup
+        with self.assertRaises(ValueError):
+            CircuitRollup(0)
+
+if __name__ == '__main__':
+    unittest.main()
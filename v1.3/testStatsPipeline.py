@@ -0,0 +1,210 @@
+import os
+import time
+import unittest
+
+def exitImmediately(heartbeat):
+    pass
+
+def countLedgerCircuits(circuitCount, heartbeat):
+    # Stands in for a restarted exporter, reporting what its ledger knows
+    import graphInfluxDB
+    graphInfluxDB.openStores()
+    circuitCount.value = len(graphInfluxDB.circuitUsageLedger.circuitIDs)
+
+def reportForever(heartbeat):
+    while True:
+        heartbeat.value = time.monotonic()
+        time.sleep(0.05)
+
+class TestStatsPipeline(unittest.TestCase):
+    def test_counter_block(self):
+        """
+        Test that a reader sees the last complete write of a shared counter block
+        """
+        from array import array
+        from statsPipeline import CounterBlock
+        name = 'libreqos_test_' + str(os.getpid())
+        writer = CounterBlock(name, 3, 2, create=True)
+        reader = CounterBlock(name, 3, 2)
+        try:
+            self.assertIsNone(reader.snapshot())
+            writer.write(array('d', [1.0, 2.0, 3.0]), 100.5)
+            sequence, rows, sampleTime = reader.snapshot()
+            self.assertEqual(list(rows), [1.0, 2.0, 3.0])
+            self.assertEqual(sampleTime, 100.5)
+            # Rows past the capacity are dropped
+            self.assertEqual(writer.write(array('d', range(9)), 101.0), 2)
+            newSequence, rows, sampleTime = reader.snapshot()
+            self.assertGreater(newSequence, sequence)
+            self.assertEqual(list(rows), [0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+        finally:
+            reader.close()
+            writer.close(unlink=True)
+
+    def test_interface_rows(self):
+        """
+        Test that tc stats survive the trip through flat counter rows
+        """
+        from statsPipeline import interfaceRows, interfaceDict, interfaceRowWidth
+        tins = [{'sent_packets': 10 + tin, 'drops': tin, 'ack_drops': 0, 'ecn_mark': 1} for tin in range(4)]
+        jsonDict = {
+            '0x1:0x3': {'bytes': 1500, 'packets': 1, 'drops': 0, 'tins': tins},
+            '0x2:0x1a': {'bytes': 3000, 'packets': 2, 'drops': 1},
+        }
+        rows = interfaceRows(jsonDict)
+        self.assertEqual(len(rows), 2 * interfaceRowWidth)
+        result = interfaceDict(rows, hasTins=True)
+        self.assertEqual(list(result), ['0x1:0x3', '0x2:0x1a'])
+        self.assertEqual(result['0x1:0x3']['bytes'], 1500)
+        self.assertEqual(result['0x1:0x3']['tins'], tins)
+        self.assertEqual(result['0x2:0x1a']['tins'][3]['sent_packets'], 0)
+        self.assertNotIn('tins', interfaceDict(rows, hasTins=False)['0x1:0x3'])
+
+    def test_latency_rows(self):
+        """
+        Test that xdp_pping entries survive the trip through flat counter rows
+        """
+        from statsPipeline import latencyRows, latencyEntries
+        listOfEntries = [
+            {'tc': '1:3', 'avg': 12.5, 'min': 10.0, 'max': 20.0, 'median': 11.0, 'samples': 7},
+            {'tc': '2:26', 'avg': 40.0},
+            {'note': 'no tc handle'},
+        ]
+        entries = latencyEntries(latencyRows(listOfEntries))
+        self.assertEqual(entries[0], listOfEntries[0])
+        self.assertEqual(entries[1], {'tc': '2:26', 'avg': 40.0, 'min': 40.0, 'max': 40.0, 'median': 40.0, 'samples': 1})
+        self.assertEqual(len(entries), 2)
+
+    def test_stats_files_lock(self):
+        """
+        Test that a reload saving the stats files waits for the
+        exporter to finish rewriting them
+        """
+        import tempfile
+        import threading
+        from statsPipeline import statsFilesLock
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'statsFiles.lock')
+            saved = []
+            def save():
+                with statsFilesLock(path):
+                    saved.append(True)
+            with statsFilesLock(path):
+                reload = threading.Thread(target=save)
+                reload.start()
+                reload.join(0.2)
+                self.assertEqual(saved, [])
+            reload.join()
+            self.assertEqual(saved, [True])
+
+    def test_truncated_rows(self):
+        """
+        Test that rows past the capacity are reported when their number changes
+        """
+        import contextlib
+        import io
+        from statsPipeline import warnIfTruncated
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            dropped = warnIfTruncated('tc eth1', 10, 12, 0)
+            dropped = warnIfTruncated('tc eth1', 10, 12, dropped)
+            dropped = warnIfTruncated('tc eth1', 10, 10, dropped)
+            dropped = warnIfTruncated('tc eth1', 10, 13, dropped)
+        self.assertEqual(dropped, 3)
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
+        self.assertIn('2 of 12 rows', output.getvalue())
+
+    def test_unread_latency(self):
+        """
+        Test that a latency window is marked as read by the exporter,
+        so the xdp_pping worker knows to carry it into the next one
+        """
+        from statsPipeline import CounterBlock, SnapshotReader, latencyRows, latencyRowWidth
+        block = CounterBlock('libreqos_test_latency' + str(os.getpid()), latencyRowWidth, 2, create=True)
+        try:
+            reader = SnapshotReader({}, block, hasTins=False)
+            self.assertFalse(block.unread())
+            block.write(latencyRows([{'tc': '1:3', 'avg': 10.0}]), 1.0)
+            self.assertTrue(block.unread())
+            listOfEntries, sampleTimeNs = reader.readPpingEntries()
+            self.assertEqual([entry['tc'] for entry in listOfEntries], ['1:3'])
+            self.assertFalse(block.unread())
+            block.write(latencyRows([]), 2.0)
+            self.assertTrue(block.unread())
+        finally:
+            block.close(unlink=True)
+
+    def test_new_samples(self):
+        """
+        Test that the exporter only runs once every interface has a new sample
+        """
+        from array import array
+        from statsPipeline import CounterBlock, SnapshotReader, interfaceRowWidth
+        blocks = {interface: CounterBlock('libreqos_test_' + interface + str(os.getpid()), interfaceRowWidth, 1, create=True) for interface in ['a', 'b']}
+        try:
+            reader = SnapshotReader(blocks, None, hasTins=False)
+            row = array('d', [1.0, 3.0] + [0.0] * (interfaceRowWidth - 2))
+            blocks['a'].write(row, 1.0)
+            self.assertFalse(reader.hasNewSamples())
+            blocks['b'].write(row, 1.0)
+            self.assertTrue(reader.hasNewSamples())
+            jsonDict, sampleTime = reader.readInterfaceStats('a')
+            self.assertEqual(list(jsonDict), ['0x1:0x3'])
+            reader.readInterfaceStats('b')
+            self.assertFalse(reader.hasNewSamples())
+            blocks['a'].write(row, 2.0)
+            blocks['b'].write(row, 2.0)
+            self.assertTrue(reader.hasNewSamples())
+        finally:
+            for block in blocks.values():
+                block.close(unlink=True)
+
+    def test_supervisor_restarts(self):
+        """
+        Test that the supervisor restarts a worker that exits and leaves a healthy one alone
+        """
+        from statsPipeline import Supervisor
+        supervisor = Supervisor(hungAfterSeconds=60.0)
+        supervisor.addWorker('exits', exitImmediately, ())
+        supervisor.addWorker('healthy', reportForever, ())
+        supervisor.start()
+        try:
+            supervisor.workers['exits']['process'].join(5)
+            supervisor.check()
+            metrics = supervisor.metrics()
+            self.assertEqual(metrics['exits']['restarts'], 1)
+            self.assertEqual(metrics['healthy'], {'alive': True, 'restarts': 0})
+        finally:
+            supervisor.stop()
+
+    def test_stores_opened_per_worker(self):
+        """
+        Test that a restarted exporter opens the usage ledger from
+        disk rather than using the copy the scheduler had before forking
+        """
+        import tempfile
+        from statsPipeline import Supervisor
+        from usageLedger import UsageLedger
+        workingDirectory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                import graphInfluxDB
+                graphInfluxDB.openStores()
+                self.assertEqual(graphInfluxDB.circuitUsageLedger.circuitIDs, [])
+                # Written by an earlier exporter
+                earlier = UsageLedger()
+                earlier.add([{'circuitID': '1', 'stats': {'priorQuery': {'bytesSentDownload': 0.0}, 'currentQuery': {'bytesSentDownload': 10.0}}}], 0)
+                earlier.flush()
+                supervisor = Supervisor()
+                circuitCount = supervisor.context.Value('i', -1)
+                supervisor.addWorker('exporter', countLedgerCircuits, (circuitCount,))
+                supervisor.start()
+                supervisor.workers['exporter']['process'].join(10)
+                supervisor.stop()
+                self.assertEqual(circuitCount.value, 1)
+            finally:
+                os.chdir(workingDirectory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+
+class TestTimeSeriesStore(unittest.TestCase):
+    def test_ring_wraps(self):
+        """
+        Test that the poll ring keeps the most recent samples, oldest first
+        """
+        import tempfile
+        from timeSeriesStore import TimeSeriesStore
+        with tempfile.TemporaryDirectory() as directory:
+            store = TimeSeriesStore(directory, seriesCapacity=4, pollSlots=3, minuteSlots=5)
+            for i in range(5):
+                store.startSample(1000.0 + i)
+                store.record('circuit', '1', 'bitsDownload', float(i))
+                if i % 2 == 0:
+                    store.record('node', 'AP_A', 'tcpLatency', 10.0 + i)
+                store.finishSample()
+            self.assertEqual(store.query('circuit', '1', 'bitsDownload'), [(1002.0, 2.0), (1003.0, 3.0), (1004.0, 4.0)])
+            self.assertEqual(store.query('node', 'AP_A', 'tcpLatency'), [(1002.0, 12.0), (1004.0, 14.0)])
+            self.assertEqual(store.query('circuit', '1', 'bitsDownload', start=1003.5), [(1004.0, 4.0)])
+            self.assertEqual(store.query('circuit', '2', 'bitsDownload'), [])
+            store.close()
+
+    def test_minute_averages(self):
+        """
+        Test that the minute ring holds the average of each finished minute
+        """
+        import tempfile
+        from timeSeriesStore import TimeSeriesStore
+        with tempfile.TemporaryDirectory() as directory:
+            store = TimeSeriesStore(directory, seriesCapacity=4, pollSlots=10, minuteSlots=5)
+            for timestamp, value in [(60.0, 1.0), (90.0, 3.0), (120.0, 10.0), (150.0, None), (185.0, 0.0)]:
+                store.startSample(timestamp)
+                store.record('circuit', '1', 'bitsUpload', value)
+                store.finishSample()
+            self.assertEqual(store.query('circuit', '1', 'bitsUpload', resolution='minute'), [(60.0, 2.0), (120.0, 10.0)])
+            with self.assertRaises(ValueError):
+                store.query('circuit', '1', 'bitsUpload', resolution='hour')
+            store.close()
+
+    def test_reopen_and_capacity(self):
+        """
+        Test that history survives reopening the store, and that series
+        past the capacity are dropped rather than overwriting others
+        """
+        import tempfile
+        from timeSeriesStore import TimeSeriesStore
+        with tempfile.TemporaryDirectory() as directory:
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4)
+            store.startSample(1000.0)
+            for name in ['1', '2', '3']:
+                store.record('circuit', name, 'bitsDownload', 5.0)
+            store.finishSample()
+            self.assertEqual(store.seriesDropped, 1)
+            store.close()
+
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4)
+            self.assertEqual(store.series('circuit'), [('circuit', '1', 'bitsDownload'), ('circuit', '2', 'bitsDownload')])
+            store.startSample(1010.0)
+            store.record('circuit', '2', 'bitsDownload', 7.0)
+            store.finishSample()
+            self.assertEqual(store.query('circuit', '2', 'bitsDownload'), [(1000.0, 5.0), (1010.0, 7.0)])
+            store.close()
+
+            # Changing the ring size starts the history over
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=8, minuteSlots=4)
+            self.assertEqual(store.query('circuit', '2', 'bitsDownload'), [])
+            store.close()
+
+    def test_latency_ring(self):
+        """
+        Test that latency samples don't take rows of the
+        bandwidth ring, and are still averaged per minute
+        """
+        import tempfile
+        from timeSeriesStore import TimeSeriesStore
+        with tempfile.TemporaryDirectory() as directory:
+            store = TimeSeriesStore(directory, seriesCapacity=4, pollSlots=3, minuteSlots=5, latencySlots=2)
+            for i in range(6):
+                store.startSample(60.0 + (10.0 * i))
+                store.record('circuit', '1', 'bitsDownload', float(i))
+                store.finishSample()
+                if i % 3 == 0:
+                    store.startSample(59.5 + (10.0 * i), 'latency')
+                    store.record('circuit', '1', 'tcpLatency', 10.0 + i)
+                    store.finishSample()
+            store.startSample(120.0)
+            store.finishSample()
+            self.assertEqual(store.query('circuit', '1', 'bitsDownload'), [(100.0, 4.0), (110.0, 5.0)])
+            self.assertEqual(store.query('circuit', '1', 'tcpLatency'), [(59.5, 10.0), (89.5, 13.0)])
+            self.assertEqual(store.query('circuit', '1', 'tcpLatency', resolution='minute'), [(60.0, 11.5)])
+            store.close()
+
+    def test_reclaim_removed_series(self):
+        """
+        Test that once every slot is taken, the slots of
+        circuits that are gone are emptied and reused
+        """
+        import tempfile
+        from timeSeriesStore import TimeSeriesStore
+        with tempfile.TemporaryDirectory() as directory:
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4)
+            store.retainOnly({('circuit', '1'), ('circuit', '2')})
+            store.startSample(1000.0)
+            store.record('circuit', '1', 'bitsDownload', 1.0)
+            store.record('circuit', '2', 'bitsDownload', 2.0)
+            store.finishSample()
+            store.retainOnly({('circuit', '2'), ('circuit', '3')})
+            store.startSample(1010.0)
+            store.record('circuit', '2', 'bitsDownload', 2.0)
+            store.record('circuit', '3', 'bitsDownload', 3.0)
+            store.finishSample()
+            self.assertEqual(store.seriesDropped, 0)
+            self.assertEqual(store.query('circuit', '1', 'bitsDownload'), [])
+            self.assertEqual(store.query('circuit', '3', 'bitsDownload'), [(1010.0, 3.0)])
+            self.assertEqual(store.query('circuit', '2', 'bitsDownload'), [(1000.0, 2.0), (1010.0, 2.0)])
+            store.record('circuit', '4', 'bitsDownload', 4.0) # Nothing left to reclaim
+            self.assertEqual(store.seriesDropped, 1)
+            store.close()
+
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4)
+            self.assertEqual(store.series('circuit'), [('circuit', '2', 'bitsDownload'), ('circuit', '3', 'bitsDownload')])
+            store.close()
+
+    def test_read_only(self):
+        """
+        Test that reading with settings that differ from the
+        collector's leaves its files as they are
+        """
+        import os
+        import tempfile
+        from timeSeriesStore import TimeSeriesStore
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4, readOnly=True)
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4)
+            store.startSample(1000.0)
+            store.record('circuit', '1', 'bitsDownload', 1.0)
+            store.finishSample()
+            store.close()
+            sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)}
+
+            reader = TimeSeriesStore(directory, seriesCapacity=8, pollSlots=16, minuteSlots=4, readOnly=True)
+            self.assertEqual(reader.query('circuit', '1', 'bitsDownload'), [(1000.0, 1.0)])
+            reader.close()
+            self.assertEqual({name: os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)}, sizes)
+            store = TimeSeriesStore(directory, seriesCapacity=2, pollSlots=4, minuteSlots=4)
+            self.assertEqual(store.query('circuit', '1', 'bitsDownload'), [(1000.0, 1.0)])
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+
+def makeTins(sent, drops, marks, ackDrops=0):
+    # Builds the 'tins' list of a cake qdisc as reported by tc -j -s
+    return [{'sent_packets': s, 'drops': d + ackDrops, 'ecn_mark': m, 'ack_drops': ackDrops} for s, d, m in zip(sent, drops, marks)]
+
+def makeCircuits():
+    return [
+        {'classid': '0x1:0x3', 'ParentNode': 'AP_B', 'circuitName': 'Circuit 1'},
+        {'classid': '0x1:0x4', 'ParentNode': 'AP_A', 'circuitName': 'Circuit 2'},
+        {'classid': '0x2:0x3', 'ParentNode': 'AP_B', 'circuitName': 'Circuit 3'},
+    ]
+
+class TestTinStats(unittest.TestCase):
+    def test_global_totals(self):
+        """
+        Test that global tin totals and percentages match the
+        layout of tinsStats.json
+        """
+        from tinStats import TinStats
+        circuits = makeCircuits()
+        engine = TinStats('global')
+        tinsStats = {}
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([100, 100, 100, 100], [0, 0, 0, 0], [0, 0, 0, 0]))
+            engine.record(i, 1, makeTins([10, 10, 10, 10], [0, 0, 0, 0], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+        self.assertEqual(tinsStats['currentQuery']['Voice']['Download']['sent_packets'], 300.0)
+        self.assertEqual(tinsStats['sinceLastQuery']['Voice']['Download']['dropPercentage'], 0.0)
+
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([200, 300, 100, 200], [0, 2, 0, 1], [0, 0, 0, 2], ackDrops=5))
+            engine.record(i, 1, makeTins([10, 10, 10, 10], [0, 0, 0, 0], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+        voice = tinsStats['sinceLastQuery']['Voice']['Download']
+        self.assertEqual(voice['sent_packets'], 300.0)
+        self.assertEqual(voice['drops'], 9.0) # ACK drops are not counted, ECN marks are
+        self.assertEqual(voice['dropPercentage'], 3.0)
+        self.assertEqual(voice['markPercentage'], 2.0)
+        self.assertEqual(tinsStats['sinceLastQuery']['BestEffort']['Download']['percentage'], 50.0)
+        self.assertEqual(tinsStats['priorQuery']['Voice']['Download']['sent_packets'], 300.0)
+
+    def test_per_node_and_circuit(self):
+        """
+        Test that node and circuit granularity produce per-row
+        percentages, with rows grouped by parent node
+        """
+        from tinStats import TinStats, tinNames
+        circuits = makeCircuits()
+        engine = TinStats('circuit')
+        tinsStats = {}
+        for voiceSent, voiceDrops in [(100, 0), (200, 10)]:
+            engine.startQuery(circuits)
+            engine.record(0, 0, makeTins([0, 0, 0, voiceSent], [0, 0, 0, voiceDrops], [0, 0, 0, 0]))
+            engine.record(1, 0, makeTins([0, 0, 0, voiceSent], [0, 0, 0, 0], [0, 0, 0, 0]))
+            engine.record(2, 0, makeTins([0, 0, 0, voiceSent], [0, 0, 0, 0], [0, 0, 0, 0]))
+            engine.finishQuery(tinsStats)
+        voice = tinNames.index('Voice')
+        self.assertEqual(engine.nodeNames, ['AP_A', 'AP_B'])
+        sent, drops, marks = engine.nodePercentages[(0, voice)]
+        self.assertEqual(sent, [100.0, 200.0])
+        self.assertEqual(drops, [0.0, 5.0])
+        rows = {circuit['circuitName']: row for row, circuit in enumerate(engine.circuits)}
+        sent, drops, marks = engine.circuitPercentages[(0, voice)]
+        self.assertEqual(drops[rows['Circuit 1']], 10.0)
+        self.assertEqual(drops[rows['Circuit 2']], 0.0)
+        self.assertEqual(sent[rows['Circuit 3']], 100.0)
+
+    def test_counter_reset_and_new_circuits(self):
+        """
+        Test that a counter going backwards (qdisc recreated) and a new
+        circuit appearing both count as zero rather than negative
+        """
+        from tinStats import TinStats, tinNames
+        circuits = makeCircuits()
+        engine = TinStats('circuit')
+        tinsStats = {}
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([500, 500, 500, 500], [5, 5, 5, 5], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+
+        circuits.append({'classid': '0x3:0x3', 'ParentNode': 'AP_A', 'circuitName': 'Circuit 4'})
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([600, 600, 600, 600], [6, 6, 6, 6], [0, 0, 0, 0]))
+        engine.record(3, 0, makeTins([50, 50, 50, 50], [50, 50, 50, 50], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+        rows = {circuit['circuitName']: row for row, circuit in enumerate(engine.circuits)}
+        sent, drops, marks = engine.circuitPercentages[(0, tinNames.index('Bulk'))]
+        self.assertEqual(sent[rows['Circuit 4']], 0.0)
+        self.assertEqual(drops[rows['Circuit 4']], 0.0)
+        self.assertEqual(sent[rows['Circuit 1']], 100.0)
+        self.assertEqual(drops[rows['Circuit 1']], 1.0)
+
+        engine.startQuery(circuits)
+        for i in range(4):
+            engine.record(i, 0, makeTins([1, 1, 1, 1], [0, 0, 0, 0], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+        sent, drops, marks = engine.circuitPercentages[(0, tinNames.index('Bulk'))]
+        self.assertEqual(sent, [0.0, 0.0, 0.0, 0.0])
+
+    def test_circuit_joins_node(self):
+        """
+        Test that a circuit added to an existing node between
+        two polls doesn't add its lifetime counters to the
+        node's or the global deltas
+        """
+        from tinStats import TinStats, tinNames
+        circuits = makeCircuits()
+        engine = TinStats('node')
+        tinsStats = {}
+        bulk = tinNames.index('Bulk')
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([100, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+
+        circuits.append({'classid': '0x3:0x3', 'ParentNode': 'AP_B', 'circuitName': 'Circuit 4'})
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([200, 0, 0, 0], [10, 0, 0, 0], [0, 0, 0, 0]))
+        engine.record(3, 0, makeTins([1000000, 0, 0, 0], [900000, 0, 0, 0], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+        sent, drops, marks = engine.nodePercentages[(0, bulk)]
+        self.assertEqual(engine.nodeNames, ['AP_A', 'AP_B'])
+        self.assertEqual(sent, [100.0, 200.0])
+        self.assertEqual(drops, [10.0, 10.0])
+        self.assertEqual(tinsStats['sinceLastQuery']['Bulk']['Download']['sent_packets'], 300.0)
+        self.assertEqual(tinsStats['sinceLastQuery']['Bulk']['Download']['drops'], 30.0)
+
+        engine.startQuery(circuits)
+        for i in range(3):
+            engine.record(i, 0, makeTins([300, 0, 0, 0], [10, 0, 0, 0], [0, 0, 0, 0]))
+        engine.record(3, 0, makeTins([1000100, 0, 0, 0], [900000, 0, 0, 0], [0, 0, 0, 0]))
+        engine.finishQuery(tinsStats)
+        sent, drops, marks = engine.nodePercentages[(0, bulk)]
+        self.assertEqual(sent, [100.0, 300.0])
+
+    def test_unknown_granularity(self):
+        """
+        Test that a typo in tinStatsGranularity is reported
+        """
+        from tinStats import TinStats
+        with self.assertRaises(ValueError):
+            TinStats('per-circuit')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+def makeCircuit(i, parentNode, bitsDownload, dropsDownload=0.0, packetsDownload=1000.0, tcpLatency=None):
+    return {'circuitID': str(i), 'circuitName': 'Circuit ' + str(i), 'ParentNode': parentNode, 'classid': '0x1:' + hex(3 + i),
+        'stats': {'sinceLastQuery': {'bitsDownload': bitsDownload, 'bitsUpload': 0.0,
+            'packetDropsDownload': dropsDownload, 'packetDropsUpload': 0.0,
+            'packetsSentDownload': packetsDownload, 'packetsSentUpload': 0.0,
+            'tcpLatency': tcpLatency}}}
+
+class TestTopK(unittest.TestCase):
+    def test_bounded_heap(self):
+        """
+        Test that TopK keeps only the k largest values, largest first
+        """
+        from topK import TopK
+        table = TopK(3)
+        for i, value in enumerate([5, 1, 9, 7, 3, 9]):
+            table.offer(value, i, {'n': i})
+        self.assertEqual(len(table.heap), 3)
+        self.assertEqual([value for value, circuit in table.items()], [9, 9, 7])
+        self.assertEqual(table.items()[0][1], {'n': 2})
+
+    def test_scopes_and_metrics(self):
+        """
+        Test per parent node and overall tables for each metric
+        """
+        from topK import HeavyHitters
+        circuits = [makeCircuit(i, 'AP_' + str(i % 2), float(i * 1000), dropsDownload=float(i), tcpLatency=float(100 - i)) for i in range(10)]
+        heavyHitters = HeavyHitters(3)
+        heavyHitters.updateBandwidth(circuits)
+        heavyHitters.updateLatency(circuits)
+        self.assertEqual([e['circuitID'] for e in heavyHitters.top('throughput', 'Download')], ['9', '8', '7'])
+        self.assertEqual([e['circuitID'] for e in heavyHitters.top('throughput', 'Download', 'AP_0')], ['8', '6', '4'])
+        self.assertEqual(heavyHitters.top('overload', 'Download', count=1)[0]['value'], 0.009)
+        self.assertEqual([e['circuitID'] for e in heavyHitters.top('latency', 'Total')], ['0', '1', '2'])
+        # Idle directions are not listed
+        self.assertEqual(heavyHitters.top('throughput', 'Upload'), [])
+
+    def test_latency_kept_across_bandwidth_polls(self):
+        """
+        Test that a bandwidth poll replaces the bandwidth tables but keeps
+        the latency table, and that topK.json reads back
+        """
+        import os
+        import tempfile
+        from topK import HeavyHitters, loadTopK
+        heavyHitters = HeavyHitters(2)
+        heavyHitters.updateLatency([makeCircuit(1, 'AP_A', 0.0, tcpLatency=40.0)])
+        heavyHitters.updateBandwidth([makeCircuit(1, 'AP_A', 500.0)])
+        heavyHitters.updateBandwidth([makeCircuit(2, 'AP_B', 100.0)])
+        self.assertEqual(heavyHitters.top('throughput', 'Download', 'AP_A'), [])
+        self.assertEqual(heavyHitters.top('latency', 'Total')[0]['value'], 40.0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'topK.json')
+            heavyHitters.save(path)
+            self.assertEqual(loadTopK('throughput', 'Download', 'AP_B', path=path)[0]['circuitName'], 'Circuit 2')
+            self.assertEqual(loadTopK('drops', 'Upload', path=path), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+
+def makeCircuit(circuitID, parentNode, prior, current):
+    return {'circuitID': circuitID, 'ParentNode': parentNode, 'stats': {
+        'priorQuery': {'bytesSentDownload': prior, 'bytesSentUpload': prior / 10},
+        'currentQuery': {'bytesSentDownload': current, 'bytesSentUpload': current / 10}}}
+
+class TestUsageLedger(unittest.TestCase):
+    def test_counter_reset(self):
+        """
+        Test that a counter restarting from zero counts what was sent since
+        """
+        from usageLedger import byteDelta
+        self.assertEqual(byteDelta(1500.0, 1000.0), 500.0)
+        self.assertEqual(byteDelta(200.0, 1000.0), 200.0)
+
+    def test_record_and_query(self):
+        """
+        Test hourly records, queries at coarser resolutions, and compaction
+        into daily and monthly records
+        """
+        from usageLedger import UsageLedger, query, readRecords, parseDate, monthResolution
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'usageLedger.bin')
+            ledger = UsageLedger(path, hourlyDays=2, dailyDays=20, flushSeconds=300)
+            start = parseDate('2026-01-01') * 3600
+            # Two polls in each of three hours on 2026-01-01, one on 2026-03-01
+            for timestamp in [start, start + 60, start + 3600, start + 3660, start + 7200, start + 7260]:
+                ledger.add([makeCircuit('1', 'AP_A', 0.0, 1000.0), makeCircuit('2', 'AP_B', 500.0, 100.0)], timestamp)
+            ledger.flush()
+            self.assertEqual(query(['1'], 'hour', path=path), [('2026-01-01T00:00', 2000, 200), ('2026-01-01T01:00', 2000, 200), ('2026-01-01T02:00', 2000, 200)])
+            self.assertEqual(query(['1', '2'], 'day', path=path), [('2026-01-01', 6600, 660)])
+            self.assertEqual(query(['1'], 'hour', start=parseDate('2026-01-01T01:00'), end=parseDate('2026-01-01T02:00'), path=path), [('2026-01-01T01:00', 2000, 200)])
+            ledger.add([makeCircuit('1', 'AP_A', 0.0, 1000.0)], parseDate('2026-03-01') * 3600)
+            ledger.compact(parseDate('2026-03-01') * 3600)
+            records = list(readRecords(path))
+            # Days before the month holding 2026-03-01 minus 20 days are folded into months
+            self.assertEqual([record[:3] for record in records], [(0, parseDate('2026-03-01'), 0), (monthResolution, parseDate('2026-01-01'), 0), (monthResolution, parseDate('2026-01-01'), 1)])
+            self.assertEqual(records[2][3:], (600, 60))
+            # Queries still see January and records appended after compaction
+            ledger.add([makeCircuit('2', 'AP_B', 0.0, 50.0)], parseDate('2026-03-02') * 3600)
+            ledger.flush()
+            self.assertEqual(query(['2'], 'month', path=path), [('2026-01', 600, 60), ('2026-03', 50, 5)])
+            self.assertEqual(query(['1'], 'month', path=path), [('2026-01', 6000, 600), ('2026-03', 1000, 100)])
+            self.assertEqual(query(['unknown'], 'month', path=path), [])
+
+    def test_missing_prior_direction(self):
+        """
+        Test that a direction missing from the prior query isn't
+        counted as everything sent since zero
+        """
+        from usageLedger import UsageLedger, query
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'usageLedger.bin')
+            ledger = UsageLedger(path)
+            circuit = makeCircuit('1', 'AP_A', 1000.0, 1500.0)
+            del circuit['stats']['priorQuery']['bytesSentUpload']
+            ledger.add([circuit], 0)
+            ledger.flush()
+            self.assertEqual(query(['1'], 'hour', path=path), [('1970-01-01T00:00', 500, 0)])
+
+    def test_compact_waits_for_lock(self):
+        """
+        Test that compacting waits while another process holds
+        the ledger's lock
+        """
+        import fcntl
+        import threading
+        from usageLedger import UsageLedger, readRecords
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'usageLedger.bin')
+            ledger = UsageLedger(path)
+            ledger.add([makeCircuit('1', 'AP_A', 0.0, 1000.0)], 0)
+            compactor = UsageLedger(path)
+            with open(path + '.lock', 'a') as lockFile:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+                compaction = threading.Thread(target=compactor.compact, args=(0,))
+                compaction.start()
+                compaction.join(0.2)
+                self.assertTrue(compaction.is_alive())
+            compaction.join()
+            self.assertFalse(compaction.is_alive())
+            ledger.compact(0)
+            self.assertEqual([record[3:] for record in readRecords(path)], [(1000, 100)])
+
+    def test_compact_in_runs(self):
+        """
+        Test that compacting the unsorted records in several runs, merged
+        with the sorted part, sums and folds them as a single run would
+        """
+        from unittest import mock
+        import usageLedger
+        from usageLedger import UsageLedger, readRecords, recordCounts, parseDate, dayResolution
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'usageLedger.bin')
+            ledger = UsageLedger(path, hourlyDays=1, dailyDays=400)
+            start = parseDate('2026-01-01') * 3600
+            for hour in range(4):
+                ledger.add([makeCircuit(str(circuit), 'AP_A', 0.0, 100.0 * (circuit + 1)) for circuit in range(3)], start + (hour * 3600))
+                ledger.flush()
+            ledger.compact(start)
+            for hour in range(4):
+                ledger.add([makeCircuit(str(circuit), 'AP_A', 0.0, 100.0 * (circuit + 1)) for circuit in range(3)], start + (hour * 3600))
+                ledger.flush()
+            with mock.patch.object(usageLedger, 'runRecords', 5):
+                ledger.compact(parseDate('2026-01-03') * 3600)
+            self.assertEqual(recordCounts(path), (3, 3))
+            self.assertEqual(list(readRecords(path)), [(dayResolution, parseDate('2026-01-01'), circuit, 800 * (circuit + 1), 80 * (circuit + 1)) for circuit in range(3)])
+            self.assertEqual([name for name in os.listdir(directory) if '.run' in name or name.endswith('.tmp')], [])
+
+    def test_compact_in_background(self):
+        """
+        Test that the daily compaction runs beside polls, once a day
+        """
+        from usageLedger import UsageLedger, readRecords, recordCounts
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'usageLedger.bin')
+            ledger = UsageLedger(path)
+            ledger.add([makeCircuit('1', 'AP_A', 0.0, 1000.0)], 0)
+            ledger.flush()
+            ledger.compactIfDue(60)
+            compaction = ledger.compaction
+            compaction.join()
+            self.assertEqual(recordCounts(path), (1, 1))
+            ledger.compactIfDue(120)
+            self.assertIs(ledger.compaction, compaction)
+            # Pending records aren't touched, and land after the sorted part
+            ledger.add([makeCircuit('1', 'AP_A', 0.0, 500.0)], 120)
+            ledger.compactIfDue(86400)
+            ledger.compaction.join()
+            self.assertEqual(len(ledger.pending), 1)
+            ledger.flush()
+            self.assertEqual([record[3:] for record in readRecords(path)], [(1000, 100), (500, 50)])
+
+    def test_subtree(self):
+        """
+        Test finding the circuits under a node of network.json
+        """
+        from usageLedger import subtreeCircuitIDs
+        network = {'Site_1': {'children': {'AP_A': {}, 'AP_B': {}}}, 'Site_2': {}}
+        circuits = [{'circuitID': '1', 'ParentNode': 'AP_A'}, {'circuitID': '2', 'ParentNode': 'Site_1'}, {'circuitID': '3', 'ParentNode': 'Site_2'}]
+        self.assertEqual(subtreeCircuitIDs('Site_1', network, circuits), ['1', '2'])
+        self.assertEqual(subtreeCircuitIDs('AP_A', network, circuits), ['1'])
+
+if __name__ == '__main__':
+    unittest.main()
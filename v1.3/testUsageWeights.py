@@ -0,0 +1,49 @@
+import os
+import tempfile
+import time
+import unittest
+
+def makeCircuit(circuitID, mbpsDownload, mbpsUpload):
+    return {'circuitID': circuitID, 'stats': {'sinceLastQuery': {'bitsDownload': mbpsDownload * 1000000.0, 'bitsUpload': mbpsUpload * 1000000.0}}}
+
+class TestUsageWeights(unittest.TestCase):
+    def test_daily_p95(self):
+        """
+        Test that each day's 95th percentile is kept, and that weights are
+        the median of the recent days
+        """
+        from usageWeights import UsageTracker, loadWeights
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'circuitUsage.json')
+            tracker = UsageTracker(historyDays=7, path=path, saveEverySeconds=600)
+            start = time.mktime((2026, 1, 1, 0, 0, 0, 0, 0, -1))
+            for day, peak in enumerate([100.0, 10.0, 40.0]):
+                for poll in range(100):
+                    # 90 quiet polls and 10 at the peak
+                    mbps = peak if poll >= 90 else 1.0
+                    tracker.add([makeCircuit('1', mbps * 0.9, mbps * 0.1), makeCircuit('', 50.0, 50.0)], start + (day * 86400) + (poll * 60))
+            tracker.save(start + (2 * 86400) + 6000)
+            self.assertEqual(sorted(tracker.dailyP95['1']), ['2026-01-01', '2026-01-02', '2026-01-03'])
+            self.assertAlmostEqual(tracker.dailyP95['1']['2026-01-01'], 100.0, delta=2.0)
+            self.assertNotIn('', tracker.dailyP95)
+            weights = loadWeights(path, historyDays=7, now=start + (3 * 86400))
+            self.assertAlmostEqual(weights['1'], 40.0, delta=1.0)
+            # Days older than the history are dropped
+            self.assertEqual(loadWeights(path, historyDays=1, now=start + (10 * 86400)), {})
+
+    def test_binpacking_weights(self):
+        """
+        Test that measured weights replace plan rates only where there is history
+        """
+        from usageWeights import measuredBinpackingWeights
+        subscriberCircuits = [
+            {'circuitID': 'a', 'idForCircuitsWithoutParentNodes': 0},
+            {'circuitID': 'b', 'idForCircuitsWithoutParentNodes': 1},
+            {'circuitID': 'c', 'ParentNode': 'AP_A'},
+        ]
+        weights, measuredCount = measuredBinpackingWeights(subscriberCircuits, {0: 218, 1: 218}, {'a': 12.5, 'c': 80.0})
+        self.assertEqual(weights, {0: 12.5, 1: 218})
+        self.assertEqual(measuredCount, 1)
+
+if __name__ == '__main__':
+    unittest.main()
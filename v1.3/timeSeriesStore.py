@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# Local time-series history, for shapers without an InfluxDB server.
+# Each resolution is one fixed-size, memory-mapped ring file: a row per
+# sample, holding a timestamp and one float32 slot per series (a metric of
+# a circuit or parent node). Bandwidth polls and latency polls have rings
+# of their own, so each keeps a uniform step. Recording a value is a
+# single store into the mapped row, and the files are reopened where they
+# left off when the collector restarts. Slots of circuits and nodes that
+# are gone are reused once every slot has been taken. The command line
+# opens the files read-only, e.g.
+#   python3 timeSeriesStore.py list circuit
+#   python3 timeSeriesStore.py query circuit 1234 bitsDownload --resolution minute --since 3600
+
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import time
+from array import array
+
+resolutions = ['poll', 'minute']
+
+headerFormat = '<8sIIIQ'
+headerSize = 64
+magic = b'LQTSRING'
+version = 1
+
+
+class RingFile:
+	# A ring of ringLength rows. Layout: header, ringLength float64
+	# timestamps, then ringLength rows of seriesCapacity float32 values.
+	# Unwritten slots hold NaN.
+
+	def __init__(self, path, seriesCapacity, ringLength, readOnly=False):
+		# Read-only, the file is read with the settings it was created with,
+		# and a file that is missing or isn't a ring raises ValueError
+		if readOnly:
+			seriesCapacity, ringLength = self.__settingsOfFile(path, seriesCapacity, ringLength)
+		self.path = path
+		self.readOnly = readOnly
+		self.seriesCapacity = seriesCapacity
+		self.ringLength = ringLength
+		self.timesOffset = headerSize
+		self.valuesOffset = headerSize + (8 * ringLength)
+		fileSize = self.valuesOffset + (4 * ringLength * seriesCapacity)
+		self.nanRow = array('f', [float('nan')]) * seriesCapacity
+
+		existing = os.path.isfile(path) and (os.path.getsize(path) == fileSize)
+		if readOnly:
+			self.file = open(path, 'rb')
+			self.map = mmap.mmap(self.file.fileno(), fileSize, access=mmap.ACCESS_READ)
+		else:
+			self.file = open(path, 'r+b' if existing else 'w+b')
+			if not existing:
+				self.file.truncate(fileSize)
+			self.map = mmap.mmap(self.file.fileno(), fileSize)
+		self.times = memoryview(self.map)[self.timesOffset:self.valuesOffset].cast('d')
+		self.values = memoryview(self.map)[self.valuesOffset:].cast('f')
+		if readOnly or (existing and (self.__readHeader() == (magic, version, seriesCapacity, ringLength))):
+			self.rowsWritten = struct.unpack_from(headerFormat, self.map, 0)[4]
+		else:
+			if existing:
+				print("Time series file " + path + " was created with different settings, starting it over")
+			self.rowsWritten = 0
+			for row in range(ringLength):
+				self.times[row] = float('nan')
+				self.__clearRow(row)
+			self.__writeHeader()
+		self.row = None
+
+	def __settingsOfFile(self, path, seriesCapacity, ringLength):
+		if not os.path.isfile(path):
+			raise ValueError("There is no time series file " + path)
+		with open(path, 'rb') as f:
+			header = f.read(struct.calcsize(headerFormat))
+		if (len(header) < struct.calcsize(headerFormat)) or (struct.unpack(headerFormat, header)[0:2] != (magic, version)):
+			raise ValueError(path + " isn't a time series file")
+		fileCapacity, fileRingLength = struct.unpack(headerFormat, header)[2:4]
+		if (fileCapacity, fileRingLength) != (seriesCapacity, ringLength):
+			print("Time series file " + path + " holds " + str(fileCapacity) + " series of " + str(fileRingLength) + " samples, but ispConfig.py asks for " + str(seriesCapacity) + " of " + str(ringLength) + ". Reading it as it is.")
+		if os.path.getsize(path) != headerSize + (8 * fileRingLength) + (4 * fileRingLength * fileCapacity):
+			raise ValueError("Time series file " + path + " is truncated")
+		return fileCapacity, fileRingLength
+
+	def __readHeader(self):
+		return struct.unpack_from(headerFormat, self.map, 0)[0:4]
+
+	def __writeHeader(self):
+		struct.pack_into(headerFormat, self.map, 0, magic, version, self.seriesCapacity, self.ringLength, self.rowsWritten)
+
+	def __clearRow(self, row):
+		start = row * self.seriesCapacity
+		self.values[start:start + self.seriesCapacity] = self.nanRow
+
+	def startRow(self, timestamp):
+		# Overwrites the oldest row with an empty row for this timestamp
+		self.row = self.rowsWritten % self.ringLength
+		self.__clearRow(self.row)
+		self.times[self.row] = timestamp
+
+	def set(self, slot, value):
+		self.values[(self.row * self.seriesCapacity) + slot] = value
+
+	def clearSlot(self, slot):
+		# Empties one series in every row, before its slot is reused
+		for row in range(self.ringLength):
+			self.values[(row * self.seriesCapacity) + slot] = float('nan')
+
+	def finishRow(self):
+		self.rowsWritten += 1
+		self.__writeHeader()
+		self.row = None
+
+	def series(self, slot, start=None, end=None):
+		# Returns [(timestamp, value)], oldest first, skipping empty slots
+		points = []
+		rows = min(self.rowsWritten, self.ringLength)
+		firstRow = self.rowsWritten - rows
+		for i in range(firstRow, self.rowsWritten):
+			row = i % self.ringLength
+			timestamp = self.times[row]
+			if ((start != None) and (timestamp < start)) or ((end != None) and (timestamp > end)):
+				continue
+			value = self.values[(row * self.seriesCapacity) + slot]
+			if value == value:
+				points.append((timestamp, value))
+		return points
+
+	def lastTimestamp(self):
+		if self.rowsWritten == 0:
+			return None
+		return self.times[(self.rowsWritten - 1) % self.ringLength]
+
+	def close(self):
+		self.times.release()
+		self.values.release()
+		if not self.readOnly:
+			self.map.flush()
+		self.map.close()
+		self.file.close()
+
+
+class TimeSeriesStore:
+	# A bandwidth poll ring, a latency poll ring and a 1-minute ring in one
+	# directory, and index.json mapping [kind, name, metric] to a slot in
+	# all of them (null for a free slot). Call startSample(), record() for
+	# each value, then finishSample().
+
+	def __init__(self, directory, seriesCapacity=65536, pollSlots=360, minuteSlots=1440, latencySlots=120, readOnly=False):
+		if not readOnly:
+			os.makedirs(directory, exist_ok=True)
+		self.directory = directory
+		self.indexPath = os.path.join(directory, 'index.json')
+		self.slotForSeries = {}
+		self.freeSlots = []
+		slotCount = 0
+		if os.path.isfile(self.indexPath):
+			with open(self.indexPath, 'r') as j:
+				keys = json.loads(j.read())
+			slotCount = len(keys)
+			for slot, key in enumerate(keys):
+				if key == None:
+					self.freeSlots.append(slot)
+				else:
+					self.slotForSeries[tuple(key)] = slot
+		elif readOnly:
+			raise ValueError("There is no time series index " + self.indexPath)
+		self.rings = {
+			'poll': RingFile(os.path.join(directory, 'poll.ring'), seriesCapacity, pollSlots, readOnly),
+			'latency': RingFile(os.path.join(directory, 'latency.ring'), seriesCapacity, latencySlots, readOnly),
+			'minute': RingFile(os.path.join(directory, 'minute.ring'), seriesCapacity, minuteSlots, readOnly),
+		}
+		self.seriesCapacity = self.rings['poll'].seriesCapacity
+		# Slots are handed out in order, then from freeSlots, then by
+		# reclaiming the slot of a series whose circuit or node is gone
+		self.nextSlot = min(slotCount, self.seriesCapacity)
+		self.reclaimable = []
+		self.liveNames = None
+		self.indexChanged = False
+		self.seriesDropped = 0
+		self.sampleRing = None
+		if readOnly:
+			return
+		# Running per-slot sums for the minute being collected
+		self.minuteSums = array('d', bytes(8 * self.seriesCapacity))
+		self.minuteCounts = array('I', bytes(4 * self.seriesCapacity))
+		self.minuteTouched = []
+		lastMinute = self.rings['minute'].lastTimestamp()
+		self.currentMinute = None if lastMinute == None else math.floor(lastMinute / 60.0)
+
+	def __slot(self, key):
+		slot = self.slotForSeries.get(key)
+		if slot == None:
+			if self.nextSlot < self.seriesCapacity:
+				slot = self.nextSlot
+				self.nextSlot += 1
+			elif len(self.freeSlots) > 0:
+				slot = self.freeSlots.pop()
+			elif len(self.reclaimable) > 0:
+				slot = self.slotForSeries.pop(self.reclaimable.pop())
+				for ring in self.rings.values():
+					ring.clearSlot(slot)
+				if self.minuteCounts[slot] > 0:
+					self.minuteTouched.remove(slot)
+					self.minuteSums[slot] = 0.0
+					self.minuteCounts[slot] = 0
+			else:
+				self.seriesDropped += 1
+				return None
+			self.slotForSeries[key] = slot
+			self.indexChanged = True
+		return slot
+
+	def retainOnly(self, names):
+		# names is the set of (kind, name) of the circuits and nodes that
+		# exist now. The slots of other series may be reused from here on,
+		# and are kept until they are.
+		if names == self.liveNames:
+			return
+		self.liveNames = names
+		self.reclaimable = [key for key in self.slotForSeries if key[0:2] not in names]
+
+	def startSample(self, timestamp, ring='poll'):
+		# timestamp is in seconds since the epoch. ring is 'poll' for
+		# bandwidth samples, 'latency' for latency samples.
+		minute = math.floor(timestamp / 60.0)
+		# A latency sample can trail the bandwidth sample into the minute
+		# before, which is still being collected as part of this one
+		if (self.currentMinute != None) and ((minute > self.currentMinute) or (minute < self.currentMinute - 1)):
+			self.__flushMinute()
+			self.currentMinute = minute
+		elif self.currentMinute == None:
+			self.currentMinute = minute
+		self.sampleRing = self.rings[ring]
+		self.sampleRing.startRow(timestamp)
+
+	def record(self, kind, name, metric, value):
+		# kind is 'circuit' or 'node'. None and NaN values are skipped.
+		if (value == None) or (value != value):
+			return
+		slot = self.__slot((kind, name, metric))
+		if slot == None:
+			return
+		self.sampleRing.set(slot, value)
+		if self.minuteCounts[slot] == 0:
+			self.minuteTouched.append(slot)
+		self.minuteSums[slot] += value
+		self.minuteCounts[slot] += 1
+
+	def finishSample(self):
+		self.sampleRing.finishRow()
+		self.sampleRing = None
+		if self.indexChanged:
+			self.__saveIndex()
+
+	def __flushMinute(self):
+		# Writes the average of each series over the minute just finished
+		if len(self.minuteTouched) == 0:
+			return
+		ring = self.rings['minute']
+		ring.startRow(self.currentMinute * 60.0)
+		for slot in self.minuteTouched:
+			ring.set(slot, self.minuteSums[slot] / self.minuteCounts[slot])
+			self.minuteSums[slot] = 0.0
+			self.minuteCounts[slot] = 0
+		ring.finishRow()
+		self.minuteTouched = []
+
+	def __saveIndex(self):
+		keys = [None] * self.nextSlot
+		for key, slot in self.slotForSeries.items():
+			keys[slot] = list(key)
+		temporaryPath = self.indexPath + '.tmp'
+		with open(temporaryPath, 'w') as f:
+			f.write(json.dumps(keys))
+		os.replace(temporaryPath, self.indexPath)
+		self.indexChanged = False
+
+	def series(self, kind=None, name=None):
+		# Lists the (kind, name, metric) series held, optionally filtered
+		return sorted(key for key in self.slotForSeries if ((kind == None) or (key[0] == kind)) and ((name == None) or (key[1] == name)))
+
+	def query(self, kind, name, metric, resolution='poll', start=None, end=None):
+		# Returns [(timestamp, value)], oldest first. At poll resolution
+		# this is from the bandwidth or the latency ring, whichever has it.
+		if resolution not in resolutions:
+			raise ValueError("Unknown resolution '" + str(resolution) + "'. Use one of " + str(resolutions))
+		slot = self.slotForSeries.get((kind, name, metric))
+		if slot == None:
+			return []
+		if resolution == 'poll':
+			return sorted(self.rings['poll'].series(slot, start, end) + self.rings['latency'].series(slot, start, end))
+		return self.rings[resolution].series(slot, start, end)
+
+	def close(self):
+		for ring in self.rings.values():
+			ring.close()
+
+
+def openFromConfig(readOnly=False):
+	# Opens the store configured in ispConfig.py
+	from ispConfig import timeSeriesDirectory, timeSeriesMaxSeries, timeSeriesPollSlots, timeSeriesMinuteSlots, timeSeriesLatencySlots
+	return TimeSeriesStore(timeSeriesDirectory, timeSeriesMaxSeries, timeSeriesPollSlots, timeSeriesMinuteSlots, timeSeriesLatencySlots, readOnly)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Read the local time-series history")
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	listParser = subparsers.add_parser('list', help="List series")
+	listParser.add_argument('kind', nargs='?', choices=['circuit', 'node'])
+	listParser.add_argument('name', nargs='?')
+	queryParser = subparsers.add_parser('query', help="Print the history of one series")
+	queryParser.add_argument('kind', choices=['circuit', 'node'])
+	queryParser.add_argument('name', help="circuitID, or parent node name")
+	queryParser.add_argument('metric')
+	queryParser.add_argument('--resolution', choices=resolutions, default='poll')
+	queryParser.add_argument('--since', type=float, default=None, help="Only the last N seconds")
+	queryParser.add_argument('--json', action='store_true', help="Print JSON instead of a table")
+	args = parser.parse_args()
+
+	# Read-only, so settings that differ from the collector's can't
+	# start its files over
+	try:
+		store = openFromConfig(readOnly=True)
+	except ValueError as e:
+		print(e)
+		raise SystemExit(1)
+	if args.command == 'list':
+		for kind, name, metric in store.series(args.kind, args.name):
+			print(kind + "\t" + name + "\t" + metric)
+	elif args.command == 'query':
+		start = (time.time() - args.since) if args.since != None else None
+		points = store.query(args.kind, args.name, args.metric, args.resolution, start)
+		if args.json:
+			print(json.dumps(points))
+		else:
+			for timestamp, value in points:
+				print(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) + "\t" + str(round(value, 3)))
+	store.close()
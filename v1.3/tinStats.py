@@ -0,0 +1,202 @@
+# Per-circuit and per-node CAKE diffserv4 tin statistics.
+# Counters for every circuit are kept in one flat array of doubles, one
+# row per circuit, laid out as [direction][tin][counter]. Rows are ordered
+# by ParentNode so that node totals (and the global totals) are sums over
+# contiguous, strided slices rather than per-circuit dictionary updates.
+
+from array import array
+
+tinNames = ['Bulk', 'BestEffort', 'Video', 'Voice']
+directions = ['Download', 'Upload']
+# sent_packets, drops (excluding ACK drops), ECN marks
+counterNames = ['sent_packets', 'drops', 'marks']
+
+countersPerTin = len(counterNames)
+countersPerDirection = len(tinNames) * countersPerTin
+countersPerRow = len(directions) * countersPerDirection
+
+# Export granularities, from least to most series
+granularities = ['global', 'node', 'circuit']
+
+
+def columnOffset(direction, tin, counter):
+	# Offset of a counter within a row
+	return (direction * countersPerDirection) + (tin * countersPerTin) + counter
+
+
+def zeroedCounters(rows):
+	return array('d', bytes(8 * countersPerRow * rows))
+
+
+def columnDeltas(current, prior, rows):
+	# Returns the since-last-query delta for every column of a counter
+	# table, as a list of per-row lists. Counters that went backwards
+	# (the qdisc was recreated by a reload) or that have no prior
+	# value (NaN) count as zero.
+	deltas = []
+	for column in range(countersPerRow):
+		currentColumn = current[column:rows * countersPerRow:countersPerRow]
+		if prior is None:
+			deltas.append([0.0] * rows)
+		else:
+			priorColumn = prior[column:rows * countersPerRow:countersPerRow]
+			deltas.append([d if d > 0.0 else 0.0 for d in map(float.__sub__, currentColumn, priorColumn)])
+	return deltas
+
+
+def percentagesFromDeltas(deltas):
+	# Computes drop and mark percentages for every (direction, tin) pair.
+	# Returns {(direction, tin): (sentPackets, dropPercentages, markPercentages)}
+	# where each member is a per-row list. Marks are counted as drops, as
+	# they are congestion signals sent in place of a drop.
+	result = {}
+	for direction in range(len(directions)):
+		for tin in range(len(tinNames)):
+			sent = deltas[columnOffset(direction, tin, 0)]
+			drops = deltas[columnOffset(direction, tin, 1)]
+			marks = deltas[columnOffset(direction, tin, 2)]
+			dropPercentages = [round(((d + m) / s) * 100.0, 3) if s > 0.0 else 0.0 for s, d, m in zip(sent, drops, marks)]
+			markPercentages = [round((m / s) * 100.0, 3) if s > 0.0 else 0.0 for s, m in zip(sent, marks)]
+			result[(direction, tin)] = (sent, dropPercentages, markPercentages)
+	return result
+
+
+class TinStats:
+	# Holds tin counters between polls. One instance should live for the
+	# life of the collector process; call startQuery(), then record() for
+	# each circuit and direction, then finishQuery().
+
+	def __init__(self, granularity='global'):
+		if granularity not in granularities:
+			raise ValueError("Unknown tin stats granularity '" + str(granularity) + "'. Use one of " + str(granularities))
+		self.granularity = granularity
+		self.circuitKeys = []
+		self.circuits = []
+		self.rowForCircuitIndex = []
+		self.nodeNames = []
+		self.nodeRowRanges = []
+		self.circuitCurrent = zeroedCounters(0)
+		self.circuitPrior = None
+		self.globalCurrent = None
+		self.circuitPercentages = {}
+		self.nodePercentages = {}
+
+	def startQuery(self, subscriberCircuits):
+		# Lays out one row per circuit, grouped by ParentNode, and rotates
+		# the current counters into prior. Rows are only remapped when the
+		# set of circuits has changed since the last query.
+		order = sorted(range(len(subscriberCircuits)), key=lambda i: subscriberCircuits[i]['ParentNode'])
+		keys = [subscriberCircuits[i]['classid'] for i in order]
+		if keys == self.circuitKeys:
+			self.circuitPrior = self.circuitCurrent
+		elif len(self.circuitKeys) > 0:
+			self.circuitPrior = self.__remap(self.circuitCurrent, self.circuitKeys, keys)
+		else:
+			self.circuitPrior = None
+		self.circuitKeys = keys
+		self.circuits = [subscriberCircuits[i] for i in order]
+		self.rowForCircuitIndex = [0] * len(subscriberCircuits)
+		for row, circuitIndex in enumerate(order):
+			self.rowForCircuitIndex[circuitIndex] = row
+		self.circuitCurrent = zeroedCounters(len(keys))
+
+		nodeNames = []
+		nodeRowRanges = []
+		for row, circuit in enumerate(self.circuits):
+			if (len(nodeNames) == 0) or (nodeNames[-1] != circuit['ParentNode']):
+				nodeNames.append(circuit['ParentNode'])
+				nodeRowRanges.append([row, row + 1])
+			else:
+				nodeRowRanges[-1][1] = row + 1
+		self.nodeNames = nodeNames
+		self.nodeRowRanges = nodeRowRanges
+
+	def __remap(self, counters, oldKeys, newKeys):
+		# Copies rows for keys that still exist into a new layout. Rows
+		# for new keys are NaN, so their first delta is zero.
+		remapped = array('d', [float('nan')]) * (countersPerRow * len(newKeys))
+		oldRowForKey = {key: row for row, key in enumerate(oldKeys)}
+		for newRow, key in enumerate(newKeys):
+			oldRow = oldRowForKey.get(key)
+			if oldRow is not None:
+				remapped[newRow * countersPerRow:(newRow + 1) * countersPerRow] = counters[oldRow * countersPerRow:(oldRow + 1) * countersPerRow]
+		return remapped
+
+	def record(self, circuitIndex, direction, tins):
+		# Stores the cumulative tin counters from one circuit's cake qdisc.
+		# circuitIndex is the circuit's position in the list passed to
+		# startQuery(), direction is 0 (Download) or 1 (Upload)
+		counters = self.circuitCurrent
+		offset = (self.rowForCircuitIndex[circuitIndex] * countersPerRow) + (direction * countersPerDirection)
+		for tin in tins[:len(tinNames)]:
+			counters[offset] = float(tin['sent_packets'])
+			counters[offset + 1] = float(tin['drops']) - float(tin['ack_drops'])
+			counters[offset + 2] = float(tin['ecn_mark'])
+			offset += countersPerTin
+
+	def finishQuery(self, tinsStats):
+		# Computes deltas and percentages. Global results are written into
+		# tinsStats in the layout of tinsStats.json; node and circuit
+		# results are kept in nodePercentages / circuitPercentages when
+		# the configured granularity asks for them. Node and global deltas
+		# are sums of the circuit deltas, so a circuit that joins a node or
+		# has its qdisc recreated doesn't add its lifetime counters to it.
+		circuitRows = len(self.circuitKeys)
+		stride = countersPerRow
+		self.globalCurrent = zeroedCounters(1)
+		for column in range(stride):
+			self.globalCurrent[column] = sum(self.circuitCurrent[column:circuitRows * stride:stride])
+		circuitDeltas = columnDeltas(self.circuitCurrent, self.circuitPrior, circuitRows)
+		if self.circuitPrior is not None:
+			globalDeltas = [[sum(column)] for column in circuitDeltas]
+		elif ('currentQuery' in tinsStats) and ('Bulk' in tinsStats['currentQuery']):
+			# First query in this process, continue from tinsStats.json
+			globalDeltas = columnDeltas(self.globalCurrent, self.__countersFromDict(tinsStats['currentQuery']), 1)
+		else:
+			globalDeltas = columnDeltas(self.globalCurrent, None, 1)
+		self.__writeGlobal(tinsStats, globalDeltas)
+
+		if self.granularity in ('node', 'circuit'):
+			self.nodePercentages = percentagesFromDeltas([[sum(column[firstRow:lastRow]) for firstRow, lastRow in self.nodeRowRanges] for column in circuitDeltas])
+		if self.granularity == 'circuit':
+			self.circuitPercentages = percentagesFromDeltas(circuitDeltas)
+		return tinsStats
+
+	def __countersFromDict(self, query):
+		counters = zeroedCounters(1)
+		for direction, directionName in enumerate(directions):
+			for tin, tinName in enumerate(tinNames):
+				entry = query[tinName][directionName]
+				marks = entry.get('marks', 0.0)
+				counters[columnOffset(direction, tin, 0)] = entry['sent_packets']
+				counters[columnOffset(direction, tin, 1)] = entry['drops'] - marks
+				counters[columnOffset(direction, tin, 2)] = marks
+		return counters
+
+	def __writeGlobal(self, tinsStats, globalDeltas):
+		if 'currentQuery' in tinsStats:
+			tinsStats['priorQuery'] = tinsStats['currentQuery']
+		percentages = percentagesFromDeltas(globalDeltas)
+		tinsStats['currentQuery'] = {tinName: {} for tinName in tinNames}
+		tinsStats['sinceLastQuery'] = {tinName: {} for tinName in tinNames}
+		for direction, directionName in enumerate(directions):
+			allPackets = sum(globalDeltas[columnOffset(direction, tin, 0)][0] for tin in range(len(tinNames)))
+			for tin, tinName in enumerate(tinNames):
+				drops = self.globalCurrent[columnOffset(direction, tin, 1)]
+				marks = self.globalCurrent[columnOffset(direction, tin, 2)]
+				tinsStats['currentQuery'][tinName][directionName] = {
+					'sent_packets': self.globalCurrent[columnOffset(direction, tin, 0)],
+					'drops': drops + marks,
+					'marks': marks,
+				}
+				sent, dropPercentages, markPercentages = percentages[(direction, tin)]
+				deltaDrops = globalDeltas[columnOffset(direction, tin, 1)][0]
+				deltaMarks = globalDeltas[columnOffset(direction, tin, 2)][0]
+				tinsStats['sinceLastQuery'][tinName][directionName] = {
+					'sent_packets': sent[0],
+					'drops': deltaDrops + deltaMarks,
+					'marks': deltaMarks,
+					'dropPercentage': dropPercentages[0],
+					'markPercentage': markPercentages[0],
+					'percentage': min(round((sent[0] / allPackets) * 100.0, 3), 100.0) if allPackets > 0 else 0.0,
+				}
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# Rolling top-K ("heavy hitter") circuits for each stats poll.
+# Each poll offers every circuit once to a bounded min-heap per metric,
+# direction and scope (all circuits, or one parent node), so an update
+# costs at most O(log K) per heap regardless of how many circuits exist,
+# and the results can be read back from topK.json without scanning
+# statsByCircuit.json, e.g.
+#   python3 topK.py throughput Download --node AP_1 --count 10
+
+import argparse
+import heapq
+import json
+from pathlib import Path
+
+metrics = ['throughput', 'drops', 'overload', 'latency']
+directions = {
+	'throughput': ['Download', 'Upload'],
+	'drops': ['Download', 'Upload'],
+	'overload': ['Download', 'Upload'],
+	'latency': ['Total'],
+}
+# Scope holding every circuit; every other scope is a parent node name
+allCircuits = 'All'
+
+
+class TopK:
+	# Keeps the k largest values offered to it. The smallest kept value
+	# sits at heap[0], so most offers are rejected with one comparison.
+
+	def __init__(self, k):
+		self.k = k
+		self.heap = []
+
+	def offer(self, value, sequence, circuit):
+		# sequence breaks ties, so that circuit dictionaries are never compared
+		if len(self.heap) < self.k:
+			heapq.heappush(self.heap, (value, sequence, circuit))
+		elif value > self.heap[0][0]:
+			heapq.heapreplace(self.heap, (value, sequence, circuit))
+
+	def items(self):
+		# Returns (value, circuit) pairs, largest first
+		return [(value, circuit) for value, sequence, circuit in sorted(self.heap, key=lambda entry: (-entry[0], entry[1]))]
+
+
+class HeavyHitters:
+	# Holds the top-K tables for the most recent bandwidth and latency polls
+
+	def __init__(self, k=50):
+		self.k = k
+		self.tables = {}
+
+	def __offerToScopes(self, tables, metric, direction, value, sequence, circuit):
+		for scope in (allCircuits, circuit['ParentNode']):
+			key = (metric, direction, scope)
+			if key not in tables:
+				tables[key] = TopK(self.k)
+			tables[key].offer(value, sequence, circuit)
+
+	def updateBandwidth(self, subscriberCircuits):
+		# Rebuilds the throughput, drops and overload tables from the
+		# sinceLastQuery stats of getCircuitBandwidthStats()
+		tables = {}
+		for sequence, circuit in enumerate(subscriberCircuits):
+			sinceLastQuery = circuit['stats']['sinceLastQuery']
+			for direction in directions['throughput']:
+				bits = sinceLastQuery['bits' + direction]
+				drops = sinceLastQuery['packetDrops' + direction]
+				packets = sinceLastQuery['packetsSent' + direction]
+				if bits > 0:
+					self.__offerToScopes(tables, 'throughput', direction, bits, sequence, circuit)
+				if drops > 0:
+					self.__offerToScopes(tables, 'drops', direction, drops, sequence, circuit)
+					if packets > 0:
+						self.__offerToScopes(tables, 'overload', direction, round(drops / packets, 3), sequence, circuit)
+		self.__replaceTables(tables, ['throughput', 'drops', 'overload'])
+
+	def updateLatency(self, subscriberCircuits):
+		# Rebuilds the latency table from getCircuitLatencyStats()
+		tables = {}
+		for sequence, circuit in enumerate(subscriberCircuits):
+			tcpLatency = circuit['stats']['sinceLastQuery'].get('tcpLatency')
+			if tcpLatency != None:
+				self.__offerToScopes(tables, 'latency', 'Total', tcpLatency, sequence, circuit)
+		self.__replaceTables(tables, ['latency'])
+
+	def __replaceTables(self, tables, replacedMetrics):
+		# Tables of other metrics are kept from their own, less frequent, polls
+		for key in [key for key in self.tables if key[0] in replacedMetrics]:
+			del self.tables[key]
+		self.tables.update(tables)
+
+	def top(self, metric, direction, scope=allCircuits, count=None):
+		# Returns a list of {'circuitID', 'circuitName', 'ParentNode', 'value'}
+		# dictionaries, largest first
+		table = self.tables.get((metric, direction, scope))
+		if table is None:
+			return []
+		entries = []
+		for value, circuit in table.items()[:count]:
+			entries.append({
+				'circuitID': circuit['circuitID'],
+				'circuitName': circuit['circuitName'],
+				'ParentNode': circuit['ParentNode'],
+				'value': value,
+			})
+		return entries
+
+	def circuitIDs(self, metric, scope=allCircuits):
+		# circuitIDs in any direction's table of a metric
+		circuitIDs = set()
+		for direction in directions[metric]:
+			table = self.tables.get((metric, direction, scope))
+			if table != None:
+				circuitIDs.update(circuit['circuitID'] for value, sequence, circuit in table.heap)
+		return circuitIDs
+
+	def toDict(self):
+		# Layout of topK.json: {metric: {direction: {scope: [entries]}}}
+		result = {metric: {direction: {} for direction in directions[metric]} for metric in metrics}
+		for (metric, direction, scope) in self.tables:
+			result[metric][direction][scope] = self.top(metric, direction, scope)
+		return result
+
+	def save(self, path='topK.json'):
+		with open(path, 'w') as f:
+			f.write(json.dumps(self.toDict(), indent=4))
+
+
+def loadTopK(metric, direction, scope=allCircuits, count=None, path='topK.json'):
+	# Reads one table back from topK.json
+	fileLoc = Path(path)
+	if not fileLoc.is_file():
+		return []
+	with open(fileLoc, 'r') as j:
+		topK = json.loads(j.read())
+	return topK.get(metric, {}).get(direction, {}).get(scope, [])[:count]
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Show the top circuits from the last stats poll")
+	parser.add_argument('metric', choices=metrics)
+	parser.add_argument('direction', nargs='?', default=None, help="Download or Upload (latency is always Total)")
+	parser.add_argument('--node', default=allCircuits, help="Limit to the circuits of one parent node")
+	parser.add_argument('--count', type=int, default=None)
+	parser.add_argument('--json', action='store_true', help="Print JSON instead of a table")
+	args = parser.parse_args()
+
+	direction = args.direction if args.direction != None else directions[args.metric][0]
+	if direction not in directions[args.metric]:
+		parser.error("direction for " + args.metric + " must be one of " + str(directions[args.metric]))
+	entries = loadTopK(args.metric, direction, args.node, args.count)
+	if args.json:
+		print(json.dumps(entries, indent=4))
+	else:
+		for rank, entry in enumerate(entries, start=1):
+			print(str(rank).rjust(4) + "  " + str(entry['value']).rjust(14) + "  " + entry['circuitName'] + " (" + entry['ParentNode'] + ")")
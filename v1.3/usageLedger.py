@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+# Per circuit data usage, for billing questions and capacity planning.
+# The collector appends (resolution, period, circuit, bytes Download, bytes
+# Upload) records to usageLedger.bin every few minutes. Compaction, run once
+# a day on a thread of its own, sums duplicate records, folds hourly records
+# older than usageLedgerHourlyDays into daily ones and daily records older
+# than usageLedgerDailyDays into monthly ones, and rewrites the file sorted
+# by circuit, so a query binary-searches the sorted part and scans only the
+# records appended since. It streams: the records appended since the last
+# compaction are sorted in runs of a bounded size, merged with the sorted
+# part, and folded one circuit at a time. Appending holds an flock() on
+# usageLedger.bin.lock, which compaction only takes to note where it starts
+# and to carry over records appended meanwhile, so polls aren't held up. Periods are hours since the epoch (UTC), and
+# circuits are numbered in usageLedger.json. Query with e.g.
+#   python3 usageLedger.py circuit 1234 --resolution day --since 2026-10-01
+#   python3 usageLedger.py node AP_A --resolution month
+
+import argparse
+import calendar
+import fcntl
+import heapq
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+resolutions = ['hour', 'day', 'month']
+hourResolution, dayResolution, monthResolution = range(3)
+
+headerFormat = '<8sIQ'
+headerSize = 32
+magic = b'LQLEDGER'
+version = 1
+# resolution, period (hours since the epoch), circuit, bytes Download, bytes Upload
+recordFormat = '<BxxxIIQQ'
+recordSize = struct.calcsize(recordFormat)
+# Records per sorted run while compacting, which bounds its memory
+runRecords = 262144
+
+
+def periodStart(hour, resolution):
+	# The first hour of the day / month holding hour
+	if resolution == hourResolution:
+		return hour
+	if resolution == dayResolution:
+		return (hour // 24) * 24
+	moment = time.gmtime(hour * 3600)
+	return calendar.timegm((moment.tm_year, moment.tm_mon, 1, 0, 0, 0)) // 3600
+
+
+def parseDate(value):
+	# 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM' (UTC) -> hours since the epoch
+	return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()) // 3600
+
+
+def formatPeriod(hour, resolution):
+	moment = time.gmtime(hour * 3600)
+	return time.strftime(['%Y-%m-%dT%H:00', '%Y-%m-%d', '%Y-%m'][resolution], moment)
+
+
+def byteDelta(current, prior):
+	# Counters restart from zero when LibreQoS.py recreates the qdiscs, in
+	# which case everything counted since the restart is new
+	if current >= prior:
+		return current - prior
+	return current
+
+
+class UsageLedger:
+
+	def __init__(self, path='usageLedger.bin', hourlyDays=62, dailyDays=400, flushSeconds=300):
+		self.path = path
+		self.indexPath = os.path.splitext(path)[0] + '.json'
+		# The ledger itself is replaced by compaction, so lock files that aren't:
+		# one held while appending, one while compacting
+		self.lockPath = path + '.lock'
+		self.compactionLockPath = path + '.compacting'
+		self.hourlyDays = hourlyDays
+		self.dailyDays = dailyDays
+		self.flushSeconds = flushSeconds
+		self.circuitIDs = []
+		if Path(self.indexPath).is_file():
+			with open(self.indexPath, 'r') as j:
+				self.circuitIDs = json.loads(j.read())['circuitIDs']
+		self.numberForCircuitID = {circuitID: number for number, circuitID in enumerate(self.circuitIDs)}
+		with self.__locked():
+			if not Path(path).is_file():
+				self.__writeFile([], 0)
+		# {(hour, circuit): [bytes Download, bytes Upload]} not yet appended
+		self.pending = {}
+		self.lastFlush = None
+		self.lastCompaction = None
+		self.compaction = None
+
+	def __circuitNumber(self, circuitID):
+		number = self.numberForCircuitID.get(circuitID)
+		if number == None:
+			number = len(self.circuitIDs)
+			self.circuitIDs.append(circuitID)
+			self.numberForCircuitID[circuitID] = number
+		return number
+
+	def add(self, subscriberCircuits, timestamp):
+		# Call after getCircuitBandwidthStats(), timestamp in seconds since the epoch
+		hour = int(timestamp // 3600)
+		pending = self.pending
+		for circuit in subscriberCircuits:
+			stats = circuit['stats']
+			if ('priorQuery' not in stats) or (circuit['circuitID'] == ''):
+				continue
+			# A direction missing from either query (no qdisc on that
+			# interface yet) has no delta, rather than one from zero
+			download = 0.0
+			upload = 0.0
+			if ('bytesSentDownload' in stats['currentQuery']) and ('bytesSentDownload' in stats['priorQuery']):
+				download = byteDelta(stats['currentQuery']['bytesSentDownload'], stats['priorQuery']['bytesSentDownload'])
+			if ('bytesSentUpload' in stats['currentQuery']) and ('bytesSentUpload' in stats['priorQuery']):
+				upload = byteDelta(stats['currentQuery']['bytesSentUpload'], stats['priorQuery']['bytesSentUpload'])
+			if (download > 0) or (upload > 0):
+				key = (hour, self.__circuitNumber(circuit['circuitID']))
+				totals = pending.get(key)
+				if totals == None:
+					pending[key] = [download, upload]
+				else:
+					totals[0] += download
+					totals[1] += upload
+		if self.lastFlush == None:
+			self.lastFlush = timestamp
+		elif (timestamp - self.lastFlush) >= self.flushSeconds:
+			self.flush()
+			self.lastFlush = timestamp
+
+	def __locked(self, lockPath=None):
+		# An open file holding an exclusive flock(), released when it's closed
+		lockFile = open(lockPath if lockPath != None else self.lockPath, 'a')
+		fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+		return lockFile
+
+	def flush(self):
+		# Appends the pending records
+		with self.__locked():
+			self.__append()
+
+	def __append(self):
+		if len(self.pending) == 0:
+			return
+		with open(self.indexPath, 'w') as f:
+			f.write(json.dumps({'circuitIDs': self.circuitIDs}))
+		records = b''.join(struct.pack(recordFormat, hourResolution, hour, circuit, round(download), round(upload)) for (hour, circuit), (download, upload) in self.pending.items())
+		with open(self.path, 'ab') as f:
+			f.write(records)
+		self.pending = {}
+
+	def compactIfDue(self, timestamp):
+		# Starts compacting, on a thread of its own, once a day
+		day = int(timestamp // 86400)
+		if (self.lastCompaction != day) and ((self.compaction == None) or not self.compaction.is_alive()):
+			self.compaction = threading.Thread(target=self.compactFile, args=(timestamp,), name='usage ledger compaction', daemon=True)
+			self.compaction.start()
+			self.lastCompaction = day
+
+	def compact(self, timestamp):
+		self.flush()
+		self.compactFile(timestamp)
+
+	def compactFile(self, timestamp):
+		# Compacts the records on disk. Doesn't touch the pending records,
+		# so it can run beside add().
+		hour = int(timestamp // 3600)
+		hourlyCutoff = periodStart(hour - (self.hourlyDays * 24), dayResolution)
+		dailyCutoff = periodStart(hour - (self.dailyDays * 24), monthResolution)
+		with self.__locked(self.compactionLockPath):
+			with self.__locked():
+				sortedRecords, recordCount = recordCounts(self.path)
+			runPaths = self.__writeRuns(sortedRecords, recordCount)
+			temporaryPath = self.path + '.tmp'
+			try:
+				compacted = 0
+				with open(temporaryPath, 'wb') as f:
+					f.write(b'\0' * headerSize)
+					merged = heapq.merge(recordsIn(self.path, 0, sortedRecords), *[recordsIn(runPath, 0, None, 0) for runPath in runPaths], key=circuitOrder)
+					for circuit, records in itertools.groupby(merged, key=lambda record: record[2]):
+						totals = {}
+						for resolution, period, circuit, download, upload in records:
+							if (resolution == hourResolution) and (period < hourlyCutoff):
+								resolution = dayResolution
+								period = periodStart(period, dayResolution)
+							if (resolution == dayResolution) and (period < dailyCutoff):
+								resolution = monthResolution
+								period = periodStart(period, monthResolution)
+							key = (resolution, period)
+							if key in totals:
+								totals[key][0] += download
+								totals[key][1] += upload
+							else:
+								totals[key] = [download, upload]
+						f.write(b''.join(struct.pack(recordFormat, resolution, period, circuit, download, upload) for (resolution, period), (download, upload) in sorted(totals.items())))
+						compacted += len(totals)
+				with self.__locked():
+					# Records appended while compacting follow, unsorted
+					with open(temporaryPath, 'r+b') as f:
+						f.seek(0, os.SEEK_END)
+						with open(self.path, 'rb') as ledger:
+							ledger.seek(headerSize + (recordCount * recordSize))
+							f.write(ledger.read())
+						f.seek(0)
+						f.write(struct.pack(headerFormat, magic, version, compacted))
+					os.replace(temporaryPath, self.path)
+			finally:
+				for runPath in runPaths:
+					os.remove(runPath)
+				if os.path.isfile(temporaryPath):
+					os.remove(temporaryPath)
+
+	def __writeRuns(self, start, end):
+		# Sorts the unsorted records start to end in runs of up to
+		# runRecords, duplicates summed, each written to a file of its own
+		runPaths = []
+		for runStart in range(start, end, runRecords):
+			totals = {}
+			for resolution, period, circuit, download, upload in recordsIn(self.path, runStart, min(runStart + runRecords, end)):
+				key = (circuit, resolution, period)
+				if key in totals:
+					totals[key][0] += download
+					totals[key][1] += upload
+				else:
+					totals[key] = [download, upload]
+			runPath = self.path + '.run' + str(len(runPaths))
+			runPaths.append(runPath)
+			with open(runPath, 'wb') as f:
+				f.write(b''.join(struct.pack(recordFormat, resolution, period, circuit, download, upload) for (circuit, resolution, period), (download, upload) in sorted(totals.items())))
+		return runPaths
+
+	def __writeFile(self, records, sortedRecords):
+		temporaryPath = self.path + '.tmp'
+		with open(temporaryPath, 'wb') as f:
+			f.write(struct.pack(headerFormat, magic, version, sortedRecords).ljust(headerSize, b'\0'))
+			f.write(b''.join(struct.pack(recordFormat, *record) for record in records))
+		os.replace(temporaryPath, self.path)
+
+
+def circuitOrder(record):
+	# The order of the sorted part: circuit, resolution, period
+	return (record[2], record[0], record[1])
+
+
+def recordCounts(path):
+	# (sorted records, all records) of the ledger at path
+	with open(path, 'rb') as f:
+		fileMagic, fileVersion, sortedRecords = struct.unpack_from(headerFormat, f.read(headerSize))
+		if (fileMagic != magic) or (fileVersion != version):
+			raise ValueError(path + " is not a usage ledger")
+		return sortedRecords, (os.fstat(f.fileno()).st_size - headerSize) // recordSize
+
+
+def recordsIn(path, start, end, offset=headerSize, blockRecords=65536):
+	# Yields records start to end (to the end of the file if None) of a
+	# file of records starting at offset, reading a block at a time
+	with open(path, 'rb') as f:
+		f.seek(offset + (start * recordSize))
+		remaining = (end - start) if end != None else None
+		while (remaining == None) or (remaining > 0):
+			count = blockRecords if remaining == None else min(remaining, blockRecords)
+			data = f.read(count * recordSize)
+			count = len(data) // recordSize
+			if count == 0:
+				return
+			yield from struct.iter_unpack(recordFormat, data[0:count * recordSize])
+			if remaining != None:
+				remaining -= count
+
+
+def readRecords(path, circuit=None):
+	# Yields (resolution, period, circuit, bytes Download, bytes Upload),
+	# only those of one circuit number if given
+	with open(path, 'rb') as f:
+		header = f.read(headerSize)
+		fileMagic, fileVersion, sortedRecords = struct.unpack_from(headerFormat, header)
+		if (fileMagic != magic) or (fileVersion != version):
+			raise ValueError(path + " is not a usage ledger")
+		size = os.fstat(f.fileno()).st_size
+		if size == headerSize:
+			return
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			recordCount = (size - headerSize) // recordSize
+			if circuit == None:
+				for offset in range(headerSize, headerSize + (recordCount * recordSize), recordSize):
+					yield struct.unpack_from(recordFormat, data, offset)
+				return
+			# The sorted part is ordered by circuit, so find the first of its records
+			low = 0
+			high = sortedRecords
+			while low < high:
+				middle = (low + high) // 2
+				if struct.unpack_from(recordFormat, data, headerSize + (middle * recordSize))[2] < circuit:
+					low = middle + 1
+				else:
+					high = middle
+			for index in range(low, sortedRecords):
+				record = struct.unpack_from(recordFormat, data, headerSize + (index * recordSize))
+				if record[2] != circuit:
+					break
+				yield record
+			for offset in range(headerSize + (sortedRecords * recordSize), headerSize + (recordCount * recordSize), recordSize):
+				record = struct.unpack_from(recordFormat, data, offset)
+				if record[2] == circuit:
+					yield record
+
+
+def query(circuitIDs, resolution='day', start=None, end=None, path='usageLedger.bin'):
+	# Totals of the given circuits, as a sorted list of
+	# (period label, bytes Download, bytes Upload). Records kept at a coarser
+	# resolution than asked for are counted in their period's first bucket.
+	resolution = resolutions.index(resolution)
+	indexPath = os.path.splitext(path)[0] + '.json'
+	with open(indexPath, 'r') as j:
+		numberForCircuitID = {circuitID: number for number, circuitID in enumerate(json.loads(j.read())['circuitIDs'])}
+	totals = {}
+	for circuitID in circuitIDs:
+		if circuitID not in numberForCircuitID:
+			continue
+		for recordResolution, period, circuit, download, upload in readRecords(path, numberForCircuitID[circuitID]):
+			if ((start != None) and (period < start)) or ((end != None) and (period >= end)):
+				continue
+			bucket = periodStart(period, max(resolution, recordResolution))
+			if bucket not in totals:
+				totals[bucket] = [0, 0]
+			totals[bucket][0] += download
+			totals[bucket][1] += upload
+	return [(formatPeriod(bucket, resolution), download, upload) for bucket, (download, upload) in sorted(totals.items())]
+
+
+def subtreeCircuitIDs(nodeName, network, subscriberCircuits):
+	# circuitIDs of the circuits under a node, from network.json and statsByCircuit.json
+	from exportSchema import getNodeDetails
+	nodeDetails = getNodeDetails(network)
+	if nodeName not in nodeDetails:
+		return [circuit['circuitID'] for circuit in subscriberCircuits if circuit['ParentNode'] == nodeName]
+	nodePath = nodeDetails[nodeName]['path']
+	subtree = set(node for node, details in nodeDetails.items() if (details['path'] == nodePath) or details['path'].startswith(nodePath + '/'))
+	return [circuit['circuitID'] for circuit in subscriberCircuits if circuit['ParentNode'] in subtree]
+
+
+def openFromConfig():
+	from ispConfig import usageLedgerHourlyDays, usageLedgerDailyDays
+	return UsageLedger(hourlyDays=usageLedgerHourlyDays, dailyDays=usageLedgerDailyDays)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	for command, helpText in [('circuit', "Usage of one circuit"), ('node', "Usage of every circuit under a node of network.json")]:
+		subparser = subparsers.add_parser(command, help=helpText)
+		subparser.add_argument('name', help="circuitID" if command == 'circuit' else "node name")
+		subparser.add_argument('--resolution', choices=resolutions, default='day')
+		subparser.add_argument('--since', default=None, help="YYYY-MM-DD (UTC)")
+		subparser.add_argument('--until', default=None, help="YYYY-MM-DD (UTC), exclusive")
+		subparser.add_argument('--json', action='store_true', help="Print JSON instead of a table")
+	subparsers.add_parser('compact', help="Compact usageLedger.bin now")
+	args = parser.parse_args()
+
+	if args.command == 'compact':
+		openFromConfig().compact(time.time())
+	else:
+		if args.command == 'circuit':
+			circuitIDs = [args.name]
+		else:
+			with open('network.json', 'r') as j:
+				network = json.loads(j.read())
+			with open('statsByCircuit.json', 'r') as j:
+				subscriberCircuits = json.loads(j.read())
+			circuitIDs = subtreeCircuitIDs(args.name, network, subscriberCircuits)
+		rows = query(circuitIDs, args.resolution,
+			parseDate(args.since) if args.since != None else None,
+			parseDate(args.until) if args.until != None else None)
+		if args.json:
+			print(json.dumps([{'period': period, 'bytesDownload': download, 'bytesUpload': upload} for period, download, upload in rows], indent=4))
+		else:
+			for period, download, upload in rows:
+				print(period.ljust(18) + str(round(download / 1000000000, 3)).rjust(12) + " GB down" + str(round(upload / 1000000000, 3)).rjust(12) + " GB up")
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# Measured throughput of each circuit, for balancing circuits across CPUs.
+# The collector adds each circuit's Download + Upload rate (Mbps) to a
+# log-bucketed sketch every poll (see latencySketch.py, which works for any
+# positive value), and keeps the 95th percentile of each day in
+# circuitUsage.json. A circuit's weight is the median of its daily 95th
+# percentiles over the last measuredTrafficHistoryDays, so one unusual day
+# doesn't move it. LibreQoS.py uses these weights for binpacking when
+# useMeasuredTrafficForBinpacking is set, and the plan rate for circuits
+# with no history. Compare the two with
+#   python3 usageWeights.py simulate
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from latencySketch import LatencySketch
+
+
+def dayOf(timestamp):
+	return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+
+class UsageTracker:
+
+	def __init__(self, historyDays=7, path='circuitUsage.json', saveEverySeconds=600):
+		self.historyDays = historyDays
+		self.path = path
+		self.saveEverySeconds = saveEverySeconds
+		self.day = None
+		self.sketches = {}
+		self.lastSave = None
+		# {circuitID: {day: p95 Mbps}}
+		self.dailyP95 = {}
+		fileLoc = Path(path)
+		if fileLoc.is_file():
+			with open(fileLoc, 'r') as j:
+				self.dailyP95 = json.loads(j.read()).get('dailyP95', {})
+
+	def add(self, subscriberCircuits, timestamp):
+		# Call after getCircuitBandwidthStats(), timestamp in seconds since the epoch
+		day = dayOf(timestamp)
+		if day != self.day:
+			if self.day != None:
+				self.__closeDay()
+			self.day = day
+		sketches = self.sketches
+		for circuit in subscriberCircuits:
+			circuitID = circuit['circuitID']
+			if circuitID == '':
+				continue
+			sketch = sketches.get(circuitID)
+			if sketch == None:
+				sketch = sketches[circuitID] = LatencySketch()
+			sinceLastQuery = circuit['stats']['sinceLastQuery']
+			sketch.add((sinceLastQuery['bitsDownload'] + sinceLastQuery['bitsUpload']) / 1000000.0)
+		if (self.lastSave == None) or ((timestamp - self.lastSave) >= self.saveEverySeconds):
+			self.save(timestamp)
+
+	def __closeDay(self):
+		for circuitID, sketch in self.sketches.items():
+			if sketch.total > 0:
+				self.dailyP95.setdefault(circuitID, {})[self.day] = sketch.quantile(0.95)
+		self.sketches = {}
+
+	def save(self, timestamp):
+		# The current day is saved as it stands, and completed at midnight
+		oldestDay = dayOf(timestamp - (self.historyDays * 86400))
+		for circuitID, sketch in self.sketches.items():
+			if sketch.total > 0:
+				self.dailyP95.setdefault(circuitID, {})[self.day] = sketch.quantile(0.95)
+		for circuitID in list(self.dailyP95):
+			days = {day: p95 for day, p95 in self.dailyP95[circuitID].items() if day > oldestDay}
+			if len(days) > 0:
+				self.dailyP95[circuitID] = days
+			else:
+				del self.dailyP95[circuitID]
+		with open(self.path, 'w') as f:
+			f.write(json.dumps({'historyDays': self.historyDays, 'dailyP95': self.dailyP95}))
+		self.lastSave = timestamp
+
+
+def loadWeights(path='circuitUsage.json', historyDays=7, now=None):
+	# {circuitID: Mbps}, the median of each circuit's recent daily 95th percentiles
+	fileLoc = Path(path)
+	if not fileLoc.is_file():
+		return {}
+	with open(fileLoc, 'r') as j:
+		dailyP95 = json.loads(j.read()).get('dailyP95', {})
+	oldestDay = dayOf((time.time() if now == None else now) - (historyDays * 86400))
+	weights = {}
+	for circuitID, days in dailyP95.items():
+		recent = [p95 for day, p95 in days.items() if day > oldestDay]
+		if len(recent) > 0:
+			weights[circuitID] = statistics.median(recent)
+	return weights
+
+
+def measuredBinpackingWeights(subscriberCircuits, dictForCircuitsWithoutParentNodes, weights):
+	# Replaces the plan rate weight of each circuit without a parent node by
+	# its measured weight, where there is one. Returns (dict, measuredCount).
+	measured = dict(dictForCircuitsWithoutParentNodes)
+	measuredCount = 0
+	for circuit in subscriberCircuits:
+		if ('idForCircuitsWithoutParentNodes' in circuit) and (circuit['circuitID'] in weights):
+			measured[circuit['idForCircuitsWithoutParentNodes']] = weights[circuit['circuitID']]
+			measuredCount += 1
+	return measured, measuredCount
+
+
+def simulate(shapedDevicesFile='ShapedDevices.csv', bins=None, path='circuitUsage.json', historyDays=7):
+	# Binpacks the circuits without a parent node by plan rate and by
+	# measured weight, and shows the measured load each CPU would get
+	import binpacking
+	from LibreQoS import loadSubscriberCircuits
+	subscriberCircuits, dictForCircuitsWithoutParentNodes = loadSubscriberCircuits(shapedDevicesFile)
+	if len(dictForCircuitsWithoutParentNodes) == 0:
+		print("No circuits without a parent node in " + shapedDevicesFile + ", nothing is binpacked")
+		return
+	if bins == None:
+		fileLoc = Path('queuingStructure.json')
+		if fileLoc.is_file():
+			with open(fileLoc, 'r') as j:
+				bins = len(json.loads(j.read())['generatedPNs'])
+		if not bins:
+			import multiprocessing
+			bins = multiprocessing.cpu_count()
+	weights = loadWeights(path, historyDays)
+	measured, measuredCount = measuredBinpackingWeights(subscriberCircuits, dictForCircuitsWithoutParentNodes, weights)
+	print(str(measuredCount) + " of " + str(len(dictForCircuitsWithoutParentNodes)) + " circuits have measured history, the rest use their plan rate")
+	for title, binWeights in [("By plan rate (current)", dictForCircuitsWithoutParentNodes), ("By measured p95", measured)]:
+		loads = []
+		for binItem in binpacking.to_constant_bin_number(binWeights, bins):
+			loads.append((len(binItem), sum(dictForCircuitsWithoutParentNodes[key] for key in binItem), sum(measured[key] for key in binItem)))
+		measuredLoads = [load[2] for load in loads]
+		mean = sum(measuredLoads) / len(measuredLoads)
+		print()
+		print(title)
+		print("CPU".rjust(5) + "Circuits".rjust(10) + "Plan Mbps".rjust(12) + "p95 Mbps".rjust(12))
+		for cpu, (circuits, planMbps, p95Mbps) in enumerate(loads):
+			print(str(cpu).rjust(5) + str(circuits).rjust(10) + str(round(planMbps)).rjust(12) + str(round(p95Mbps)).rjust(12))
+		print("Busiest CPU carries " + str(round(max(measuredLoads) / mean, 2) if mean > 0 else 0) + "x the mean measured load")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	simulateParser = subparsers.add_parser('simulate', help="Compare CPU balancing by plan rate and by measured throughput")
+	simulateParser.add_argument('--shapedDevices', default='ShapedDevices.csv')
+	simulateParser.add_argument('--bins', type=int, default=None, help="CPUs to balance across (default: generated parent nodes in queuingStructure.json)")
+	args = parser.parse_args()
+
+	if args.command == 'simulate':
+		from ispConfig import measuredTrafficHistoryDays
+		simulate(args.shapedDevices, args.bins, historyDays=measuredTrafficHistoryDays)